@@ -0,0 +1,237 @@
+"""
+站点可用性索引
+
+CabinetAvailability 按 (站点, 尺寸) 保存空闲柜子数和空闲柜子列表，可用柜子查询
+直接读索引行，不再扫描、序列化整张柜子表。
+
+柜子经 save()/delete() 变化时（下单、取消、扫码开柜、后台修改等）由信号在同一事务内
+增量更新受影响的索引行：先对索引行执行一次 UPDATE（version + 1）取得写锁，再读改写
+空闲列表，并发修改同一站点不会丢失更新。列表字段有任何变化都会递增该分组的版本号，
+作为站点列表的 ETag 依据（见 versions 模块）；分组没有柜子后索引行保留，版本号不回退。
+空闲数变化提交后推送到事件流（见 events 模块）。
+bulk_create / QuerySet.update() 不触发信号，批量写入柜子后需调用 rebuild()。
+索引与柜子表的一致性用 manage.py check_availability 检查。
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from waylink.responsecache import purge_on_commit
+
+from . import events
+from .events import cabinet_events
+from .versions import cabinet_versions
+
+# 影响索引内容的柜子字段（空闲列表中保存位置和单价，供列表直接返回）
+INDEXED_FIELDS = ('status', 'station', 'size', 'location', 'price_per_hour', 'cabinet_id')
+
+
+def snapshot(cabinet):
+    """柜子当前的索引相关字段；有字段未加载时返回 None"""
+    if cabinet.get_deferred_fields().intersection(INDEXED_FIELDS):
+        return None
+    return tuple(getattr(cabinet, field) for field in INDEXED_FIELDS)
+
+
+def entry(pk, cabinet_id, location, price_per_hour):
+    """空闲列表中的一项: [主键, 柜子编号, 位置, 单价]（单价与序列化器输出一致，保留两位小数）"""
+    return [pk, cabinet_id, location, str(Decimal(str(price_per_hour)).quantize(Decimal('0.01')))]
+
+
+def cabinet_saved(cabinet, previous, created=False):
+    """
+    柜子保存后增量更新索引
+
+    previous 为加载时的 snapshot()；未知（手动构造的实例）时重建该柜子所在分组。
+    """
+    current = snapshot(cabinet)
+    if current is None or (previous is None and not created):
+        rebuild_group(cabinet.station, cabinet.size)
+        return
+    if previous == current:
+        return
+
+    with transaction.atomic(savepoint=False):
+        if previous is not None and previous[1:3] != current[1:3]:
+            # 调整站点或尺寸（少见）：两个分组都重建
+            rebuild_group(previous[1], previous[2])
+            rebuild_group(current[1], current[2])
+        elif current[0] == 'available':
+            _edit(current[1], current[2], add=entry(cabinet.pk, cabinet.cabinet_id, current[3], current[4]))
+        else:
+            # 不在空闲列表中也要递增版本号；新建的分组即使没有空闲柜子也要有索引行（空闲数为 0）
+            _edit(current[1], current[2], remove=cabinet.pk)
+
+
+def cabinet_deleted(cabinet):
+    """柜子删除后重建其所在分组"""
+    rebuild_group(cabinet.station, cabinet.size)
+
+
+def _edit(station, size, remove=None, add=None):
+    """读改写一个索引行；索引行不存在时按柜子表重建该分组"""
+    from .models import CabinetAvailability
+
+    transaction.on_commit(cabinet_versions.invalidate_groups)
+    with transaction.atomic(savepoint=False):
+        rows = CabinetAvailability.objects.filter(station=station, size=size)
+        # 先写后读：UPDATE 取得行锁（SQLite 为库写锁），之后读到的空闲列表不会被并发修改
+        if not rows.update(version=F('version') + 1):
+            rebuild_group(station, size)
+            return
+        row = rows.get()
+        free = [item for item in row.free if item[0] != remove and (add is None or item[0] != add[0])]
+        if add is not None:
+            free.append(add)
+            free.sort(key=lambda item: item[1])
+        if len(free) != row.available:
+            cabinet_events.publish_on_commit([events.availability_event(station, size, len(free))])
+        row.free = free
+        row.available = len(free)
+        row.save(update_fields=['free', 'available', 'updated_at'])
+
+
+def compute(stations=None):
+    """
+    按柜子表计算索引内容
+
+    返回 {(站点, 尺寸): [空闲列表项, ...]}，包含有柜子但没有空闲柜子的分组。
+    """
+    from .models import Cabinet
+
+    queryset = Cabinet.objects.all()
+    if stations is not None:
+        queryset = queryset.filter(station__in=stations)
+    groups = {key: [] for key in queryset.values_list('station', 'size').distinct().order_by()}
+    free = queryset.filter(status='available').order_by('cabinet_id').values_list(
+        'station', 'size', 'pk', 'cabinet_id', 'location', 'price_per_hour'
+    )
+    for station, size, *fields in free:
+        groups[(station, size)].append(entry(*fields))
+    return groups
+
+
+def rebuild(stations=None):
+    """按柜子表重建索引（stations 为 None 时重建全部），返回重建的分组数"""
+    from .models import CabinetAvailability
+
+    transaction.on_commit(cabinet_versions.invalidate_groups)
+    with transaction.atomic(savepoint=False):
+        existing = CabinetAvailability.objects.all()
+        if stations is not None:
+            existing = existing.filter(station__in=stations)
+        # 先取得写锁再读柜子表
+        existing.update(version=F('version') + 1)
+        versions = {(row.station, row.size): row.version for row in existing.only('station', 'size', 'version')}
+        groups = compute(stations)
+        for key in versions:
+            groups.setdefault(key, [])
+        existing.delete()
+        # 批量写入柜子不触发信号，在此清除受影响站点的响应缓存，并通知事件流客户端重新读取
+        purge_on_commit(['cabinets', *{f'station:{station}' for station, _ in groups}])
+        cabinet_events.publish_on_commit([events.reset_event(stations)])
+        CabinetAvailability.objects.bulk_create([
+            CabinetAvailability(
+                station=station, size=size, available=len(free), free=free,
+                version=versions.get((station, size), 0)
+            )
+            for (station, size), free in groups.items()
+        ], batch_size=500)
+    return len(groups)
+
+
+def rebuild_group(station, size):
+    """重建单个分组"""
+    from .models import CabinetAvailability
+
+    transaction.on_commit(cabinet_versions.invalidate_groups)
+    with transaction.atomic(savepoint=False):
+        rows = CabinetAvailability.objects.filter(station=station, size=size)
+        rows.update(version=F('version') + 1)
+        free = compute([station]).get((station, size), [])
+        row, created = CabinetAvailability.objects.get_or_create(
+            station=station, size=size, defaults={'available': len(free), 'free': free}
+        )
+        if created or row.available != len(free):
+            cabinet_events.publish_on_commit([events.availability_event(station, size, len(free))])
+        if not created:
+            row.free = free
+            row.available = len(free)
+            row.save(update_fields=['free', 'available', 'updated_at'])
+
+
+def check():
+    """
+    比对索引与柜子表
+
+    返回不一致的分组列表，每项为
+    {'station', 'size', 'indexed', 'actual', 'missing': [...], 'extra': [...], 'stale': [...]}，
+    missing/extra/stale 分别为索引中缺少、多出、位置或单价过期的柜子编号。
+    """
+    from .models import CabinetAvailability
+
+    indexed = {(row.station, row.size): row.free for row in CabinetAvailability.objects.all()}
+    actual = compute()
+    problems = []
+    for key in sorted(set(indexed) | set(actual), key=lambda key: (key[0], key[1])):
+        index_items = {item[0]: item for item in indexed.get(key, [])}
+        actual_items = {item[0]: item for item in actual.get(key, [])}
+        # 已没有柜子的分组保留空的索引行
+        if key in indexed and index_items == actual_items:
+            continue
+        problems.append({
+            'station': key[0],
+            'size': key[1],
+            'indexed': len(index_items) if key in indexed else None,
+            'actual': len(actual_items),
+            'missing': sorted(actual_items[pk][1] for pk in actual_items.keys() - index_items.keys()),
+            'extra': sorted(index_items[pk][1] for pk in index_items.keys() - actual_items.keys()),
+            'stale': sorted(
+                actual_items[pk][1] for pk in actual_items.keys() & index_items.keys()
+                if actual_items[pk] != index_items[pk]
+            ),
+        })
+    return problems
+
+
+def available_cabinets(station=None, size=None):
+    """从索引读取空闲柜子，返回与 CabinetListSerializer 相同结构的列表（按站点、编号排序）"""
+    from .models import Cabinet
+
+    size_display = dict(Cabinet.SIZE_CHOICES)
+    status_display = dict(Cabinet.STATUS_CHOICES)['available']
+    cabinets = []
+    for row in availability_rows(station, size):
+        cabinets.extend(
+            {
+                'id': pk, 'cabinet_id': cabinet_id, 'size': row.size, 'size_display': size_display.get(row.size),
+                'location': location, 'station': row.station,
+                'status': 'available', 'status_display': status_display, 'price_per_hour': price,
+            }
+            for pk, cabinet_id, location, price in row.free
+        )
+    cabinets.sort(key=lambda cabinet: (cabinet['station'], cabinet['cabinet_id']))
+    return cabinets
+
+
+def availability_rows(station=None, size=None):
+    from .models import CabinetAvailability
+
+    rows = CabinetAvailability.objects.all()
+    if station:
+        rows = rows.filter(station=station)
+    if size:
+        rows = rows.filter(size=size)
+    return rows
+
+
+def summary(station=None, size=None):
+    """各 (站点, 尺寸) 的空闲数和空闲柜子编号"""
+    return [
+        {
+            'station': row.station, 'size': row.size, 'available': row.available,
+            'cabinet_ids': [item[1] for item in row.free],
+        }
+        for row in availability_rows(station, size)
+    ]
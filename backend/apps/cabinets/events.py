@@ -0,0 +1,207 @@
+"""
+柜子状态事件流（Server-Sent Events，见 CabinetStreamView）
+
+写入提交后发布事件：
+- cabinet：柜子状态、柜门锁定、电机锁、物品检测变化，data 为
+  {"cabinet_id", "station", "changes": {字段: [旧值, 新值]}}（与设备状态日志格式相同），
+  新建柜子的旧值为 null，删除时 data 为 {"cabinet_id", "station", "deleted": true}。
+  设备状态上报（bulk_update 不触发信号）由 services.apply_status_report 发布，
+  下单、取消、扫码开柜、后台修改等经 save()/delete() 的写入由信号发布；
+- availability：站点可用性索引中某 (站点, 尺寸) 的空闲数变化，data 为 {"station", "size", "available"}；
+- reset：批量重建索引等无法逐条描述的变化，客户端应重新读取全量状态。
+
+事件经消息代理广播，每个持有事件流连接的工作进程在内存中保留最近 CABINET_STREAM_BUFFER 条，
+断线重连时按 Last-Event-ID 补发。事件ID由接收的进程按到达顺序分配（"<进程标识>-<序号>"）：
+不同进程发布的事件到达顺序与发布时间无关，只有到达顺序的序号能保证续传点之后的事件都在缓冲中。
+因此只能在同一进程内续传，续传点来自其他进程（重连到了另一个工作进程、进程已重启）或已被淘汰时先发送 reset。
+在线连接各有一个队列，事件到达时直接推送，空闲连接不查询数据库。
+"""
+import asyncio
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+EVENT_CHANNEL = 'cabinet-events'
+
+# 推送变化的柜子字段（锁舌角度属于遥测，不推送）
+STREAM_FIELDS = ('status', 'is_locked', 'lock_locked', 'has_item')
+
+# reset 事件最多列出的站点数，超过时视为全部站点（避免超出消息代理的单条消息大小）
+MAX_RESET_STATIONS = 200
+
+
+def snapshot(cabinet):
+    """柜子当前的推送字段；有字段未加载时返回 None"""
+    if cabinet.get_deferred_fields().intersection(STREAM_FIELDS):
+        return None
+    return {field: getattr(cabinet, field) for field in STREAM_FIELDS}
+
+
+def cabinet_event(cabinet_id, station, changes, previous_station=None):
+    """changes 为 {字段: [旧值, 新值]}，只保留推送字段；没有推送字段变化时返回 None"""
+    changes = {field: diff for field, diff in changes.items() if field in STREAM_FIELDS}
+    if not changes and previous_station in (None, station):
+        return None
+    data = {'cabinet_id': cabinet_id, 'station': station, 'changes': changes}
+    stations = [station]
+    if previous_station not in (None, station):
+        # 调整站点：两个站点的订阅者都收到
+        changes['station'] = [previous_station, station]
+        stations.append(previous_station)
+    return {'event': 'cabinet', 'stations': stations, 'data': data}
+
+
+def cabinet_deleted_event(cabinet_id, station):
+    data = {'cabinet_id': cabinet_id, 'station': station, 'deleted': True}
+    return {'event': 'cabinet', 'stations': [station], 'data': data}
+
+
+def availability_event(station, size, available):
+    data = {'station': station, 'size': size, 'available': available}
+    return {'event': 'availability', 'stations': [station], 'data': data}
+
+
+def reset_event(stations=None):
+    """stations 为 None 时表示全部站点"""
+    if stations is not None:
+        stations = sorted(set(stations))
+        if len(stations) > MAX_RESET_STATIONS:
+            stations = None
+    return {'event': 'reset', 'stations': stations, 'data': {'stations': stations}}
+
+
+class Subscription:
+    """单个事件流连接（在其事件循环中接收推送）"""
+
+    def __init__(self, station, limit):
+        self.loop = asyncio.get_running_loop()
+        self.station = station
+        self.queue = asyncio.Queue(limit)
+        self.overflowed = False
+
+    def matches(self, event):
+        return not self.station or event['stations'] is None or self.station in event['stations']
+
+    def put(self, events):
+        """在事件循环线程中调用；队列满（客户端读取太慢）时标记溢出，由连接结束后重连补发"""
+        for event in events:
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.overflowed = True
+                return
+
+
+class CabinetEventStream:
+    """事件发布与进程内事件缓冲（每个工作进程一个实例）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._epoch = None
+        self._last_seq = 0
+        self._events = []
+        self._subscriptions = set()
+        self._subscribed_pid = None
+
+    @property
+    def buffer_size(self):
+        return getattr(settings, 'CABINET_STREAM_BUFFER', 1000)
+
+    def publish(self, events):
+        """广播事件（可在任意进程、任意线程调用），事件ID由各接收进程分配"""
+        from apps.devices.broker import get_broker
+
+        events = [event for event in events if event is not None]
+        if not events:
+            return
+        get_broker().publish(EVENT_CHANNEL, {'events': events})
+
+    def publish_on_commit(self, events):
+        """当前事务提交后发布（自动提交模式下立即发布）"""
+        events = [event for event in events if event is not None]
+        if events:
+            transaction.on_commit(lambda: self.publish(events))
+
+    def _on_message(self, message):
+        events = message.get('events') or []
+        if not events:
+            return
+        with self._lock:
+            received = []
+            for event in events:
+                self._last_seq += 1
+                received.append(dict(event, id=f'{self._epoch}-{self._last_seq}', seq=self._last_seq))
+            events = received
+            self._events.extend(events)
+            excess = len(self._events) - self.buffer_size
+            if excess > 0:
+                del self._events[:excess]
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            matched = [event for event in events if subscription.matches(event)]
+            if not matched:
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, matched)
+            except RuntimeError:
+                # 事件循环已关闭，连接会在退出时自行取消订阅
+                pass
+
+    @contextmanager
+    def subscribe(self, station=None):
+        """在当前事件循环中订阅（station 为空时订阅全部站点），返回 Subscription"""
+        self._ensure_subscribed()
+        subscription = Subscription(station, self.buffer_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                self._subscriptions.discard(subscription)
+
+    def since(self, last_id, station=None):
+        """
+        缓冲中在 last_id（Last-Event-ID）之后到达的事件
+
+        返回 (事件列表, 是否完整)；last_id 不是本进程分配的、或其后的事件已被淘汰时不完整。
+        """
+        epoch, _, seq = (last_id or '').rpartition('-')
+        with self._lock:
+            if epoch != self._epoch or not seq.isdigit() or int(seq) > self._last_seq:
+                return [], False
+            first_seq = self._events[0]['seq'] if self._events else self._last_seq + 1
+            if int(seq) < first_seq - 1:
+                return [], False
+            events = self._events[int(seq) - first_seq + 1:]
+        if station:
+            events = [event for event in events if event['stations'] is None or station in event['stations']]
+        return events, True
+
+    def latest_id(self):
+        """本进程最后收到的事件ID，新连接以此作为续传起点"""
+        self._ensure_subscribed()
+        with self._lock:
+            return f'{self._epoch}-{self._last_seq}'
+
+    def _ensure_subscribed(self):
+        from apps.devices.broker import get_broker
+
+        pid = os.getpid()
+        with self._lock:
+            if self._subscribed_pid == pid:
+                return
+            self._subscribed_pid = pid
+            # fork 后重新生成进程标识，继承自父进程的续传点一律视为不完整
+            self._epoch = uuid.uuid4().hex[:12]
+            self._last_seq = 0
+            self._events.clear()
+            self._subscriptions.clear()
+        get_broker().subscribe(EVENT_CHANNEL, self._on_message)
+
+
+cabinet_events = CabinetEventStream()
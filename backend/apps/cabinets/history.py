@@ -0,0 +1,161 @@
+"""
+柜子状态历史
+
+柜子的状态、柜门锁定、电机锁和物品检测变化以只追加的 CabinetEvent 记录
+（{字段: [旧值, 新值]}，附来源和关联订单），与状态写入在同一事务内：
+- 设备状态上报由 services.apply_status_report 批量写入，关联柜子当前的有效订单；
+- 其他经 save() 的写入由信号写入，来源和订单由调用方传给 save(event_source=, order_id=)；
+- 批量开通（bulk_create）的柜子由 record_created 写入初始事件和初始快照。
+
+CabinetSnapshot 是某一时刻的完整状态，由 snapshot_cabinets 命令定期生成（只为有新事件的柜子生成）。
+任一时刻 T 的状态 = T 之前最近的快照 + 其后到 T 为止的事件，回放的事件数不超过一个快照周期内的变化数。
+快照由事件回放得出而不是读柜子表，与事件严格一致。
+"""
+from datetime import timedelta
+
+from django.db.models import Max, OuterRef, Subquery
+from django.utils import timezone
+
+from .events import STREAM_FIELDS
+
+# 事件记录的柜子字段（与事件流推送的字段相同）
+HISTORY_FIELDS = STREAM_FIELDS
+
+# 生成快照时跳过最近的事件（其前面可能还有未提交事务中的事件）
+SNAPSHOT_LAG = timedelta(minutes=1)
+
+
+def record(cabinet, changes, source='system', order_id=None):
+    """记录一次状态变化（在写入柜子的事务内调用），changes 中不属于记录字段的忽略"""
+    from .models import CabinetEvent
+
+    changes = {field: diff for field, diff in changes.items() if field in HISTORY_FIELDS}
+    if changes:
+        CabinetEvent.objects.create(cabinet=cabinet, changes=changes, source=source, order_id=order_id)
+
+
+def record_created(cabinets, source='system', now=None):
+    """
+    为批量创建的柜子（bulk_create 不触发信号）记录初始状态事件和初始快照，cabinets 须已有主键
+
+    快照的 event_id 为 0：回放时重复应用初始事件不改变状态，也不推进 take_snapshots 的水位线
+    （水位线跳过初始事件会漏掉其他柜子尚未生成快照的事件）。
+    """
+    from .models import CabinetEvent, CabinetSnapshot
+
+    now = now or timezone.now()
+    states = {cabinet.pk: {field: getattr(cabinet, field) for field in HISTORY_FIELDS} for cabinet in cabinets}
+    CabinetEvent.objects.bulk_create([
+        CabinetEvent(
+            cabinet_id=cabinet_pk, changes={field: [None, value] for field, value in state.items()},
+            source=source, created_at=now
+        )
+        for cabinet_pk, state in states.items()
+    ], batch_size=500)
+    CabinetSnapshot.objects.bulk_create([
+        CabinetSnapshot(cabinet_id=cabinet_pk, state=state, event_id=0, taken_at=now)
+        for cabinet_pk, state in states.items()
+    ], batch_size=500)
+
+
+def record_device_changes(changes, now=None):
+    """批量记录设备上报的变化 {柜子主键: {字段: [旧值, 新值]}}，关联各柜子当前的有效订单"""
+    from apps.orders.models import Order
+
+    from .models import CabinetEvent
+
+    changes = {
+        cabinet_pk: {field: diff for field, diff in diffs.items() if field in HISTORY_FIELDS}
+        for cabinet_pk, diffs in changes.items()
+    }
+    changes = {cabinet_pk: diffs for cabinet_pk, diffs in changes.items() if diffs}
+    if not changes:
+        return
+    orders = dict(Order.objects.filter(
+        cabinet_id__in=changes, status__in=['pending', 'paid', 'in_use']
+    ).values_list('cabinet_id', 'pk'))
+    CabinetEvent.objects.bulk_create([
+        CabinetEvent(
+            cabinet_id=cabinet_pk, changes=diffs, source='device', order_id=orders.get(cabinet_pk),
+            created_at=now or timezone.now()
+        )
+        for cabinet_pk, diffs in changes.items()
+    ])
+
+
+def apply(state, changes):
+    for field, (_, new) in changes.items():
+        state[field] = new
+
+
+def state_at(cabinet, at):
+    """
+    柜子在 at 时刻的状态
+
+    返回 {'state', 'snapshot_at', 'replayed'}；at 早于柜子的第一条记录时返回 None。
+    """
+    from .models import CabinetEvent, CabinetSnapshot
+
+    snapshot = CabinetSnapshot.objects.filter(cabinet=cabinet, taken_at__lte=at).order_by('-taken_at', '-pk').first()
+    state = dict(snapshot.state) if snapshot else {}
+    events = CabinetEvent.objects.filter(cabinet=cabinet, created_at__lte=at)
+    if snapshot:
+        events = events.filter(pk__gt=snapshot.event_id)
+    replayed = 0
+    for changes in events.order_by('pk').values_list('changes', flat=True):
+        apply(state, changes)
+        replayed += 1
+    if not state:
+        return None
+    return {
+        'state': {field: state.get(field) for field in HISTORY_FIELDS},
+        'snapshot_at': snapshot.taken_at if snapshot else None,
+        'replayed': replayed,
+    }
+
+
+def take_snapshots(batch_size=500, now=None):
+    """
+    为上次快照后有新事件的柜子生成快照，返回生成的快照数
+
+    以所有快照的最大 event_id 为起点找出有新事件的柜子，在各自最近的快照上回放新事件。
+    """
+    from .models import CabinetEvent, CabinetSnapshot
+
+    cutoff = (now or timezone.now()) - SNAPSHOT_LAG
+    watermark = CabinetSnapshot.objects.aggregate(last=Max('event_id'))['last'] or 0
+    cabinet_pks = sorted(set(CabinetEvent.objects.filter(
+        pk__gt=watermark, created_at__lte=cutoff
+    ).order_by().values_list('cabinet_id', flat=True).distinct()))
+
+    created = 0
+    for start in range(0, len(cabinet_pks), batch_size):
+        batch = cabinet_pks[start:start + batch_size]
+        latest = CabinetSnapshot.objects.filter(cabinet=OuterRef('cabinet')).order_by('-taken_at', '-pk')
+        bases = {
+            snapshot.cabinet_id: snapshot
+            for snapshot in CabinetSnapshot.objects.filter(cabinet_id__in=batch, pk=Subquery(latest.values('pk')[:1]))
+        }
+        states = {pk: dict(bases[pk].state) if pk in bases else {} for pk in batch}
+        last = {}
+        stopped = set()
+        since = min((snapshot.event_id for snapshot in bases.values()), default=0) if len(bases) == len(batch) else 0
+        events = CabinetEvent.objects.filter(cabinet_id__in=batch, pk__gt=since).order_by('pk').values_list(
+            'pk', 'cabinet_id', 'changes', 'created_at'
+        )
+        for pk, cabinet_pk, changes, created_at in events.iterator():
+            if cabinet_pk in stopped or (cabinet_pk in bases and pk <= bases[cabinet_pk].event_id):
+                continue
+            if created_at > cutoff:
+                # 之后的事件留到下次
+                stopped.add(cabinet_pk)
+                continue
+            apply(states[cabinet_pk], changes)
+            last[cabinet_pk] = (pk, created_at)
+        CabinetSnapshot.objects.bulk_create([
+            CabinetSnapshot(cabinet_id=cabinet_pk, state=states[cabinet_pk], event_id=pk, taken_at=created_at)
+            for cabinet_pk, (pk, created_at) in last.items()
+        ])
+        created += len(last)
+    return created
+
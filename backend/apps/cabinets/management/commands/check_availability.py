@@ -0,0 +1,41 @@
+"""
+检查站点可用性索引与柜子表是否一致（见 apps/cabinets/availability.py）
+
+不一致时列出缺少、多出和位置/单价过期的柜子并以非零状态退出；--fix 时按柜子表重建索引：
+    python manage.py check_availability
+    python manage.py check_availability --fix
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.cabinets import availability
+
+
+class Command(BaseCommand):
+    help = '检查（并可重建）站点可用性索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='不一致时按柜子表重建索引')
+        parser.add_argument('--rebuild', action='store_true', help='不检查，直接重建全部索引')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = availability.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'已重建 {count} 个分组'))
+            return
+
+        problems = availability.check()
+        for problem in problems:
+            self.stdout.write(
+                f"{problem['station']} {problem['size']}: 索引 {problem['indexed']} / 实际 {problem['actual']}"
+            )
+            for label, key in (('缺少', 'missing'), ('多出', 'extra'), ('过期', 'stale')):
+                if problem[key]:
+                    self.stdout.write(f"  {label}: {', '.join(problem[key])}")
+
+        if not problems:
+            self.stdout.write(self.style.SUCCESS('站点可用性索引一致'))
+            return
+        if not options['fix']:
+            raise CommandError(f'{len(problems)} 个分组不一致，使用 --fix 重建')
+        availability.rebuild({problem['station'] for problem in problems})
+        self.stdout.write(self.style.SUCCESS(f'已重建 {len(problems)} 个不一致的分组'))
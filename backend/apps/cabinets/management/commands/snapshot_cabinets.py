@@ -0,0 +1,20 @@
+"""
+为有新状态事件的柜子生成状态快照（见 apps/cabinets/history.py）
+
+快照越密，查询某一时刻状态时需要回放的事件越少；建议每小时运行一次：
+    python manage.py snapshot_cabinets
+"""
+from django.core.management.base import BaseCommand
+
+from apps.cabinets import history
+
+
+class Command(BaseCommand):
+    help = '为上次快照后有状态变化的柜子生成快照'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的柜子数')
+
+    def handle(self, *args, **options):
+        count = history.take_snapshots(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'已生成 {count} 个柜子的快照'))
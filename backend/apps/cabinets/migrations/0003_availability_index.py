@@ -0,0 +1,51 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:33
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def build_index(apps, schema_editor):
+    """按现有柜子生成站点可用性索引"""
+    Cabinet = apps.get_model('cabinets', 'Cabinet')
+    CabinetAvailability = apps.get_model('cabinets', 'CabinetAvailability')
+
+    groups = {key: [] for key in Cabinet.objects.values_list('station', 'size').distinct().order_by()}
+    free = Cabinet.objects.filter(status='available').order_by('cabinet_id').values_list(
+        'station', 'size', 'pk', 'cabinet_id', 'location', 'price_per_hour'
+    )
+    for station, size, pk, cabinet_id, location, price in free:
+        groups[(station, size)].append([pk, cabinet_id, location, str(Decimal(price).quantize(Decimal('0.01')))])
+    CabinetAvailability.objects.bulk_create([
+        CabinetAvailability(station=station, size=size, available=len(items), free=items)
+        for (station, size), items in groups.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinets', '0002_cabinet_has_item_cabinet_item_detected_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CabinetAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('station', models.CharField(max_length=50, verbose_name='所属站点')),
+                ('size', models.CharField(choices=[('small', '小柜（放背包）'), ('medium', '中柜（放行李箱）'), ('large', '大柜（放多个行李）')], max_length=10, verbose_name='尺寸规格')),
+                ('available', models.PositiveIntegerField(default=0, verbose_name='空闲数量')),
+                ('free', models.JSONField(default=list, verbose_name='空闲柜子')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='版本号')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '站点可用性索引',
+                'verbose_name_plural': '站点可用性索引',
+                'ordering': ['station', 'size'],
+                'constraints': [models.UniqueConstraint(fields=('station', 'size'), name='cabinet_availability_key')],
+            },
+        ),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
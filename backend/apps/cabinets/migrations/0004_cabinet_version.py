@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinets', '0003_availability_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cabinet',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='版本号'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+def backfill_stations(apps, schema_editor):
+    """按柜子、设备上已有的站点编号生成站点（坐标待后台补录）"""
+    Station = apps.get_model('cabinets', 'Station')
+    Cabinet = apps.get_model('cabinets', 'Cabinet')
+    Device = apps.get_model('devices', 'Device')
+
+    codes = set(Cabinet.objects.values_list('station', flat=True).distinct())
+    codes.update(Device.objects.values_list('station', flat=True).distinct())
+    Station.objects.bulk_create(
+        [Station(code=code, name=code) for code in sorted(codes) if code],
+        batch_size=500, ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinets', '0004_cabinet_version'),
+        ('devices', '0008_devicecommand_result'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Station',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50, unique=True, verbose_name='站点编号')),
+                ('name', models.CharField(blank=True, max_length=100, verbose_name='站点名称')),
+                ('address', models.CharField(blank=True, max_length=200, verbose_name='地址')),
+                ('latitude', models.FloatField(blank=True, null=True, verbose_name='纬度')),
+                ('longitude', models.FloatField(blank=True, null=True, verbose_name='经度')),
+                ('is_active', models.BooleanField(default=True, verbose_name='是否启用')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '站点',
+                'verbose_name_plural': '站点',
+                'ordering': ['code'],
+            },
+        ),
+        migrations.RunPython(backfill_stations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:50
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def initial_snapshots(apps, schema_editor):
+    """以现有柜子的当前状态作为状态历史的起点"""
+    Cabinet = apps.get_model('cabinets', 'Cabinet')
+    CabinetSnapshot = apps.get_model('cabinets', 'CabinetSnapshot')
+
+    now = timezone.now()
+    fields = ('status', 'is_locked', 'lock_locked', 'has_item')
+    CabinetSnapshot.objects.bulk_create([
+        CabinetSnapshot(cabinet_id=row['pk'], state={field: row[field] for field in fields}, taken_at=now)
+        for row in Cabinet.objects.values('pk', *fields)
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinets', '0005_station'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CabinetEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('changes', models.JSONField(verbose_name='变化')),
+                ('source', models.CharField(choices=[('device', '设备上报'), ('order', '订单'), ('admin', '管理员'), ('system', '系统')], max_length=10, verbose_name='来源')),
+                ('order_id', models.PositiveBigIntegerField(blank=True, db_index=True, null=True, verbose_name='关联订单ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='发生时间')),
+                ('cabinet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='cabinets.cabinet', verbose_name='储物柜')),
+            ],
+            options={
+                'verbose_name': '柜子状态事件',
+                'verbose_name_plural': '柜子状态事件',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['cabinet', 'created_at'], name='cabinet_event_time')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CabinetSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.JSONField(verbose_name='状态')),
+                ('event_id', models.PositiveBigIntegerField(default=0, verbose_name='已包含的最后事件ID')),
+                ('taken_at', models.DateTimeField(verbose_name='快照时间')),
+                ('cabinet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='cabinets.cabinet', verbose_name='储物柜')),
+            ],
+            options={
+                'verbose_name': '柜子状态快照',
+                'verbose_name_plural': '柜子状态快照',
+                'ordering': ['cabinet', 'taken_at'],
+                'indexes': [models.Index(fields=['cabinet', 'taken_at'], name='cabinet_snapshot_time')],
+            },
+        ),
+        migrations.RunPython(initial_snapshots, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,29 @@
 from django.db import models
+from django.utils import timezone
+
+
+class Station(models.Model):
+    """站点（公交站），code 与柜子、设备的 station 字段对应"""
+
+    code = models.CharField(max_length=50, unique=True, verbose_name='站点编号')
+    name = models.CharField(max_length=100, blank=True, verbose_name='站点名称')
+    address = models.CharField(max_length=200, blank=True, verbose_name='地址')
+
+    # WGS84 坐标，未设置坐标的站点不参与附近站点搜索
+    latitude = models.FloatField(null=True, blank=True, verbose_name='纬度')
+    longitude = models.FloatField(null=True, blank=True, verbose_name='经度')
+
+    is_active = models.BooleanField(default=True, verbose_name='是否启用')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        verbose_name = '站点'
+        verbose_name_plural = verbose_name
+        ordering = ['code']
+
+    def __str__(self):
+        return f"{self.code} {self.name}".strip()
 
 
 class Cabinet(models.Model):
@@ -47,6 +72,9 @@ class Cabinet(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
+    # 每次写入递增，用于 ETag（见 versions 模块）
+    version = models.PositiveBigIntegerField(default=0, verbose_name='版本号')
+
     class Meta:
         verbose_name = '储物柜'
         verbose_name_plural = verbose_name
@@ -54,3 +82,100 @@ class Cabinet(models.Model):
 
     def __str__(self):
         return f"{self.cabinet_id} ({self.get_size_display()}) - {self.get_status_display()}"
+
+    def save(self, *args, event_source='system', order_id=None, **kwargs):
+        # 状态变化事件的来源与关联订单（由信号记入 CabinetEvent，见 history 模块）
+        self._event_source = (event_source, order_id)
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        self.version = models.F('version') + 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+        # 丢弃 F 表达式，下次访问时从库中读取实际版本号
+        del self.__dict__['version']
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录加载时的状态、站点等字段，保存时据此增量更新站点可用性索引、发布状态变化事件
+        from . import availability, events
+        instance._availability = availability.snapshot(instance)
+        instance._stream = events.snapshot(instance)
+        return instance
+
+
+class CabinetAvailability(models.Model):
+    """站点可用性索引（按站点、尺寸汇总空闲柜子，由 availability 模块维护）"""
+
+    station = models.CharField(max_length=50, verbose_name='所属站点')
+    size = models.CharField(max_length=10, choices=Cabinet.SIZE_CHOICES, verbose_name='尺寸规格')
+    available = models.PositiveIntegerField(default=0, verbose_name='空闲数量')
+    # [[主键, 柜子编号, 位置, 单价], ...]，按柜子编号排序
+    free = models.JSONField(default=list, verbose_name='空闲柜子')
+    version = models.PositiveBigIntegerField(default=0, verbose_name='版本号')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        verbose_name = '站点可用性索引'
+        verbose_name_plural = verbose_name
+        ordering = ['station', 'size']
+        constraints = [
+            models.UniqueConstraint(fields=['station', 'size'], name='cabinet_availability_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.station} {self.get_size_display()}: {self.available}"
+
+
+class CabinetEvent(models.Model):
+    """柜子状态变化事件（只追加，见 history 模块）"""
+
+    SOURCE_CHOICES = [
+        ('device', '设备上报'),
+        ('order', '订单'),
+        ('admin', '管理员'),
+        ('system', '系统'),
+    ]
+
+    cabinet = models.ForeignKey(Cabinet, on_delete=models.CASCADE, related_name='events', verbose_name='储物柜')
+    # {字段: [旧值, 新值]}，字段为 status / is_locked / lock_locked / has_item
+    changes = models.JSONField(verbose_name='变化')
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, verbose_name='来源')
+    # 关联订单（不使用外键，订单删除后事件保留）
+    order_id = models.PositiveBigIntegerField(null=True, blank=True, db_index=True, verbose_name='关联订单ID')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='发生时间')
+
+    class Meta:
+        verbose_name = '柜子状态事件'
+        verbose_name_plural = verbose_name
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['cabinet', 'created_at'], name='cabinet_event_time'),
+        ]
+
+    def __str__(self):
+        return f"{self.cabinet_id} {self.get_source_display()} {self.created_at:%Y-%m-%d %H:%M:%S}"
+
+
+class CabinetSnapshot(models.Model):
+    """柜子状态快照：应用该柜子 ID 不超过 event_id 的全部事件后的状态（由 snapshot_cabinets 定期生成）"""
+
+    cabinet = models.ForeignKey(Cabinet, on_delete=models.CASCADE, related_name='snapshots', verbose_name='储物柜')
+    # {status, is_locked, lock_locked, has_item}
+    state = models.JSONField(verbose_name='状态')
+    event_id = models.PositiveBigIntegerField(default=0, verbose_name='已包含的最后事件ID')
+    # 最后一个已包含事件的发生时间（此后到下一个事件之间的状态即为 state）
+    taken_at = models.DateTimeField(verbose_name='快照时间')
+
+    class Meta:
+        verbose_name = '柜子状态快照'
+        verbose_name_plural = verbose_name
+        ordering = ['cabinet', 'taken_at']
+        indexes = [
+            models.Index(fields=['cabinet', 'taken_at'], name='cabinet_snapshot_time'),
+        ]
+
+    def __str__(self):
+        return f"{self.cabinet_id} @ {self.taken_at:%Y-%m-%d %H:%M:%S}"
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Cabinet
+from .models import Cabinet, Station
 
 
 class CabinetSerializer(serializers.ModelSerializer):
@@ -53,3 +53,14 @@ class CabinetCreateSerializer(serializers.ModelSerializer):
             'cabinet_id', 'size', 'location', 'station',
             'price_per_hour', 'device_id'
         )
+
+
+class StationSerializer(serializers.ModelSerializer):
+    """站点序列化器"""
+    latitude = serializers.FloatField(min_value=-90, max_value=90, allow_null=True, required=False)
+    longitude = serializers.FloatField(min_value=-180, max_value=180, allow_null=True, required=False)
+
+    class Meta:
+        model = Station
+        fields = ('id', 'code', 'name', 'address', 'latitude', 'longitude', 'is_active', 'updated_at')
+        read_only_fields = ('updated_at',)
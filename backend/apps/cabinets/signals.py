@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from waylink.responsecache import purge_on_commit
+
+from . import availability, events, history
+from .events import cabinet_events
+from .models import Cabinet, Station
+from .stations import ensure_stations, station_index
+from .versions import cabinet_versions
+
+
+@receiver(post_save, sender=Cabinet)
+def update_availability_on_save(sender, instance, created, **kwargs):
+    """柜子状态、站点、位置或单价变化时增量更新站点可用性索引，并记录、推送状态变化事件"""
+    previous = getattr(instance, '_availability', None)
+    availability.cabinet_saved(instance, previous, created=created)
+    current = instance._availability = availability.snapshot(instance)
+
+    cabinet_ids = {instance.cabinet_id}
+    if previous is not None:
+        cabinet_ids.add(previous[-1])
+    transaction.on_commit(lambda: cabinet_versions.invalidate_cabinets(cabinet_ids))
+
+    # 响应缓存：柜子详情总是清除；列表字段有变化时清除站点列表和统计
+    tags = {f'cabinet:{cabinet_id}' for cabinet_id in cabinet_ids}
+    if previous is None or previous != current:
+        tags.update({'cabinets', f'station:{instance.station}'})
+        if previous is not None:
+            tags.add(f'station:{previous[1]}')
+    purge_on_commit(tags)
+
+    # 新出现的站点编号登记为站点
+    if previous is None or previous[1] != instance.station:
+        ensure_stations([instance.station])
+
+    # 状态、柜门、电机锁或物品检测变化记入状态历史并推送到事件流；新建或手动构造的实例没有旧值，按全部字段变化处理
+    loaded = getattr(instance, '_stream', None)
+    stream = instance._stream = events.snapshot(instance)
+    if stream is not None:
+        changes = {
+            field: [None if loaded is None else loaded[field], value]
+            for field, value in stream.items() if loaded is None or loaded[field] != value
+        }
+        source, order_id = getattr(instance, '_event_source', ('system', None))
+        history.record(instance, changes, source, order_id)
+        cabinet_events.publish_on_commit([events.cabinet_event(
+            instance.cabinet_id, instance.station, changes, previous_station=previous[1] if previous else None
+        )])
+
+
+@receiver(post_delete, sender=Cabinet)
+def update_availability_on_delete(sender, instance, **kwargs):
+    availability.cabinet_deleted(instance)
+    cabinet_id = instance.cabinet_id
+    transaction.on_commit(lambda: cabinet_versions.invalidate_cabinets([cabinet_id]))
+    purge_on_commit(['cabinets', f'station:{instance.station}', f'cabinet:{cabinet_id}'])
+    cabinet_events.publish_on_commit([events.cabinet_deleted_event(cabinet_id, instance.station)])
+
+
+@receiver(post_save, sender=Station)
+@receiver(post_delete, sender=Station)
+def invalidate_station_index(sender, instance, **kwargs):
+    """站点坐标或启用状态变化时重建附近站点索引"""
+    transaction.on_commit(station_index.invalidate)
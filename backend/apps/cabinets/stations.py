@@ -0,0 +1,154 @@
+"""
+站点与附近站点搜索
+
+Station.code 与柜子、设备的 station 字段对应（仍为字符串，不做外键）。
+有坐标的启用站点加载到进程内网格索引（按 STATION_GRID_CELL 度划分经纬度网格），
+搜索时从查询点所在格子按环向外扩展，取到 limit 个有空闲柜子的站点且下一环不可能
+更近时停止，扫描范围受 radius 限制，耗时与站点总数无关。
+
+空闲数来自站点可用性索引（经 cabinet_versions 缓存，与列表 ETag 共用一次加载），
+热缓存下一次搜索不访问数据库。索引在本进程内缓存 STATION_INDEX_TTL 秒，
+站点变化时清除并通过消息代理通知其他工作进程。
+"""
+import heapq
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+
+STATION_CHANNEL = 'station-index'
+
+EARTH_RADIUS = 6371008.8  # 米
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+# 单次搜索最多扫描的环数（高纬度经度格很窄时限制扫描范围）
+MAX_RINGS = 100
+
+
+def distance(lat1, lng1, lat2, lng2):
+    """两点球面距离（米，haversine）"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def ensure_stations(codes):
+    """为尚未登记的站点编号创建站点（无坐标，需后台补录）"""
+    from .models import Station
+
+    codes = {code for code in codes if code}
+    if not codes:
+        return
+    existing = set(Station.objects.filter(code__in=codes).values_list('code', flat=True))
+    if codes - existing:
+        Station.objects.bulk_create(
+            [Station(code=code, name=code) for code in sorted(codes - existing)], ignore_conflicts=True
+        )
+
+
+class StationIndex:
+    """有坐标站点的网格索引（每个工作进程一个实例）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._generation = 0
+        self._subscribed_pid = None
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'STATION_INDEX_TTL', 300)
+
+    @property
+    def cell(self):
+        return getattr(settings, 'STATION_GRID_CELL', 0.01)
+
+    def _load(self):
+        """返回 (站点列表, {(纬度格, 经度格): [站点下标]})"""
+        from .models import Station
+
+        self._ensure_subscribed()
+        now = time.monotonic()
+        with self._lock:
+            if self._snapshot is not None and self._snapshot[1] > now:
+                return self._snapshot[0]
+            generation = self._generation
+
+        cell = self.cell
+        stations = list(Station.objects.filter(
+            is_active=True, latitude__isnull=False, longitude__isnull=False
+        ).values('code', 'name', 'address', 'latitude', 'longitude'))
+        grid = {}
+        for i, station in enumerate(stations):
+            key = (math.floor(station['latitude'] / cell), math.floor(station['longitude'] / cell))
+            grid.setdefault(key, []).append(i)
+        with self._lock:
+            if generation == self._generation:
+                self._snapshot = ((stations, grid), now + self.ttl)
+        return stations, grid
+
+    def nearest(self, lat, lng, limit, radius, accept=None):
+        """
+        距 (lat, lng) 最近的 limit 个站点（radius 米以内，accept(站点) 为真的）
+
+        返回 [(距离米, 站点dict)]，按距离升序。
+        """
+        stations, grid = self._load()
+        if not stations or limit <= 0:
+            return []
+
+        cell = self.cell
+        # 环 r 之外的点离查询点至少 r 个格宽；经度格宽按搜索范围内最高纬度取保守值
+        radius_degrees = radius / METERS_PER_DEGREE
+        max_lat = min(89.9, abs(lat) + radius_degrees + cell)
+        cell_width = cell * METERS_PER_DEGREE * math.cos(math.radians(max_lat))
+        max_ring = min(int(radius // cell_width) + 1, MAX_RINGS)
+
+        center_i, center_j = math.floor(lat / cell), math.floor(lng / cell)
+        best = []  # (-距离, 下标) 最大堆，保留最近的 limit 个
+        for ring in range(max_ring + 1):
+            for di in range(-ring, ring + 1):
+                step = 1 if abs(di) == ring else 2 * ring
+                for dj in range(-ring, ring + 1, step):
+                    for index in grid.get((center_i + di, center_j + dj), ()):
+                        station = stations[index]
+                        meters = distance(lat, lng, station['latitude'], station['longitude'])
+                        if meters > radius or (len(best) == limit and meters >= -best[0][0]):
+                            continue
+                        if accept is not None and not accept(station):
+                            continue
+                        if len(best) == limit:
+                            heapq.heapreplace(best, (-meters, index))
+                        else:
+                            heapq.heappush(best, (-meters, index))
+            if len(best) == limit and -best[0][0] <= ring * cell_width:
+                break
+        return [(-negative, stations[index]) for negative, index in sorted(best, reverse=True)]
+
+    def invalidate(self, broadcast=True):
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+        if broadcast:
+            from apps.devices.broker import get_broker
+            get_broker().publish(STATION_CHANNEL, {'invalidate': True})
+
+    def _ensure_subscribed(self):
+        from apps.devices.broker import get_broker
+
+        pid = os.getpid()
+        with self._lock:
+            if self._subscribed_pid == pid:
+                return
+            self._subscribed_pid = pid
+        get_broker().subscribe(STATION_CHANNEL, self._on_message)
+
+    def _on_message(self, message):
+        self.invalidate(broadcast=False)
+
+
+station_index = StationIndex()
@@ -1,9 +1,14 @@
 from django.urls import path
-from .views import CabinetListView, CabinetDetailView, CabinetStatusView, AvailableCabinetsView, CabinetCreateView
+from .views import (
+    CabinetListView, CabinetDetailView, CabinetStatusView, AvailableCabinetsView, NearbyStationsView, CabinetStreamView,
+    CabinetCreateView
+)
 
 urlpatterns = [
     path('', CabinetListView.as_view(), name='cabinet-list'),
     path('available/', AvailableCabinetsView.as_view(), name='available-cabinets'),
+    path('nearby/', NearbyStationsView.as_view(), name='nearby-stations'),
+    path('stream/', CabinetStreamView.as_view(), name='cabinet-stream'),
     path('create/', CabinetCreateView.as_view(), name='cabinet-create'),
     path('<str:cabinet_id>/', CabinetDetailView.as_view(), name='cabinet-detail'),
     path('<str:cabinet_id>/status/', CabinetStatusView.as_view(), name='cabinet-status'),
@@ -0,0 +1,144 @@
+"""
+柜子/站点版本号与 ETag
+
+每个柜子有版本号（Cabinet.version），任何写入都会递增：save() 中递增，
+状态上报的 bulk_update 一并递增。站点按 (站点, 尺寸) 使用可用性索引行的版本号
+（CabinetAvailability.version），列表字段（状态、位置、单价等）变化时递增，
+传感器状态变化不影响站点版本。
+
+读接口据此生成强 ETag，If-None-Match 命中时直接返回 304，不查询、不序列化。
+版本号在本进程内缓存 CABINET_VERSION_CACHE_TTL 秒；写入提交后清除，并通过
+消息代理通知其他工作进程（与柜子状态指纹缓存相同的方式）。
+"""
+import hashlib
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.utils.http import quote_etag
+
+VERSION_CHANNEL = 'cabinet-versions'
+
+
+class CabinetVersionCache:
+    """柜子编号 -> (主键, 版本号) 与 (站点, 尺寸) -> 版本号、空闲数缓存（每个工作进程一个实例）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cabinets = {}
+        self._groups = None
+        self._generation = 0
+        self._subscribed_pid = None
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'CABINET_VERSION_CACHE_TTL', 30)
+
+    def cabinet(self, cabinet_id):
+        """返回 (主键, 版本号)，柜子不存在时返回 None（不缓存）"""
+        from .models import Cabinet
+
+        self._ensure_subscribed()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cabinets.get(cabinet_id)
+            if entry is not None and entry[1] > now:
+                return entry[0]
+            generation = self._generation
+
+        value = Cabinet.objects.filter(cabinet_id=cabinet_id).values_list('pk', 'version').first()
+        if value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._cabinets[cabinet_id] = (value, now + self.ttl)
+        return value
+
+    def groups(self):
+        """返回 {(站点, 尺寸): 版本号}"""
+        return self._load_groups()[0]
+
+    def available_counts(self):
+        """返回 {(站点, 尺寸): 空闲数}（与版本号同一次加载，供附近站点搜索使用）"""
+        return self._load_groups()[1]
+
+    def _load_groups(self):
+        from .models import CabinetAvailability
+
+        self._ensure_subscribed()
+        now = time.monotonic()
+        with self._lock:
+            if self._groups is not None and self._groups[1] > now:
+                return self._groups[0]
+            generation = self._generation
+
+        versions, counts = {}, {}
+        for station, size, version, available in CabinetAvailability.objects.values_list(
+            'station', 'size', 'version', 'available'
+        ):
+            versions[(station, size)] = version
+            counts[(station, size)] = available
+        with self._lock:
+            if generation == self._generation:
+                self._groups = ((versions, counts), now + self.ttl)
+        return versions, counts
+
+    def cabinet_etag(self, view, cabinet_id):
+        """单个柜子的强 ETag（不同视图的表示不同，ETag 带上视图名）；柜子不存在时返回 None"""
+        value = self.cabinet(cabinet_id)
+        if value is None:
+            return None
+        return quote_etag(f'{view}-{value[0]}-{value[1]}')
+
+    def list_etag(self, view, station=None, size=None, *params):
+        """柜子列表的强 ETag：所涉及分组的版本号与查询参数的摘要"""
+        versions = sorted(
+            (key, version) for key, version in self.groups().items()
+            if (not station or key[0] == station) and (not size or key[1] == size)
+        )
+        digest = hashlib.sha1(repr((station, size, params, versions)).encode('utf-8')).hexdigest()[:20]
+        return quote_etag(f'{view}-{digest}')
+
+    def invalidate_cabinets(self, cabinet_ids, broadcast=True):
+        cabinet_ids = list(cabinet_ids)
+        with self._lock:
+            self._generation += 1
+            for cabinet_id in cabinet_ids:
+                self._cabinets.pop(cabinet_id, None)
+        if broadcast and cabinet_ids:
+            from apps.devices.broker import get_broker
+            get_broker().publish(VERSION_CHANNEL, {'cabinets': cabinet_ids})
+
+    def invalidate_groups(self, broadcast=True):
+        with self._lock:
+            self._generation += 1
+            self._groups = None
+        if broadcast:
+            from apps.devices.broker import get_broker
+            get_broker().publish(VERSION_CHANNEL, {'groups': True})
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cabinets.clear()
+            self._groups = None
+
+    def _ensure_subscribed(self):
+        from apps.devices.broker import get_broker
+
+        pid = os.getpid()
+        with self._lock:
+            if self._subscribed_pid == pid:
+                return
+            self._subscribed_pid = pid
+        get_broker().subscribe(VERSION_CHANNEL, self._on_message)
+
+    def _on_message(self, message):
+        """其他进程的失效通知（本进程发布的也会收到，重复清除无副作用）"""
+        if message.get('cabinets'):
+            self.invalidate_cabinets(message['cabinets'], broadcast=False)
+        if message.get('groups'):
+            self.invalidate_groups(broadcast=False)
+
+
+cabinet_versions = CabinetVersionCache()
@@ -1,31 +1,95 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.http import HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.views import View
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 
+from waylink.responsecache import cache_response
+
+from . import availability
+from .events import cabinet_events
 from .models import Cabinet
 from .serializers import CabinetSerializer, CabinetListSerializer, CabinetStatusSerializer, CabinetCreateSerializer
+from .stations import station_index
+from .versions import cabinet_versions
+
+
+class ConditionalGetMixin:
+    """
+    公开读接口的条件请求（ETag / If-None-Match）
+
+    视图在查询前设置 self.etag（由版本号生成，见 versions 模块），
+    If-None-Match 命中时直接返回 304，不查询也不序列化；未命中时再读响应缓存
+    （cache_response 装饰的方法）。这些接口不使用用户信息，跳过认证以免 JWT 用户查询访问数据库。
+    """
+    etag = None
+
+    def perform_authentication(self, request):
+        pass
+
+    def not_modified(self, request, etag):
+        """设置本次响应的 ETag；客户端缓存仍然有效时返回 304 响应，否则返回 None"""
+        self.etag = etag
+        header = request.headers.get('If-None-Match')
+        if etag is None or not header:
+            return None
+        # If-None-Match 使用弱比较
+        etags = {tag.removeprefix('W/') for tag in parse_etags(header)}
+        if '*' in etags or etag in etags:
+            return HttpResponseNotModified()
+        return None
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.etag is not None and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+        return response
 
-class CabinetListView(APIView):
+
+class CabinetListView(ConditionalGetMixin, APIView):
     """储物柜列表"""
     permission_classes = [AllowAny]
+    query_budget = 4
 
     def get(self, request):
+        station = request.query_params.get('station')
+        size = request.query_params.get('size')
+        status_filter = request.query_params.get('status')
+
+        response = self.not_modified(
+            request, cabinet_versions.list_etag('list', station, size, status_filter)
+        )
+        if response is not None:
+            return response
+        return self.cabinet_list(request, station, size, status_filter)
+
+    @cache_response(tags=lambda request, station, *args: [f'station:{station}' if station else 'cabinets'])
+    def cabinet_list(self, request, station, size, status_filter):
+        # 只看空闲柜子时直接读站点可用性索引
+        if status_filter == 'available':
+            return Response({
+                'code': 0,
+                'message': 'success',
+                'data': availability.available_cabinets(station, size)
+            })
+
         queryset = Cabinet.objects.all()
 
         # 筛选站点
-        station = request.query_params.get('station')
         if station:
             queryset = queryset.filter(station=station)
 
         # 筛选尺寸
-        size = request.query_params.get('size')
         if size:
             queryset = queryset.filter(size=size)
 
         # 筛选状态
-        status_filter = request.query_params.get('status')
         if status_filter:
             queryset = queryset.filter(status=status_filter)
 
@@ -37,11 +101,18 @@ class CabinetListView(APIView):
         })
 
 
-class CabinetDetailView(APIView):
+class CabinetDetailView(ConditionalGetMixin, APIView):
     """储物柜详情"""
     permission_classes = [AllowAny]
 
     def get(self, request, cabinet_id):
+        response = self.not_modified(request, cabinet_versions.cabinet_etag('detail', cabinet_id))
+        if response is not None:
+            return response
+        return self.cabinet_detail(request, cabinet_id)
+
+    @cache_response(tags=lambda request, cabinet_id: [f'cabinet:{cabinet_id}'])
+    def cabinet_detail(self, request, cabinet_id):
         try:
             cabinet = Cabinet.objects.get(cabinet_id=cabinet_id)
         except Cabinet.DoesNotExist:
@@ -57,11 +128,15 @@ class CabinetDetailView(APIView):
         })
 
 
-class CabinetStatusView(APIView):
+class CabinetStatusView(ConditionalGetMixin, APIView):
     """获取柜子实时状态"""
     permission_classes = [AllowAny]
 
     def get(self, request, cabinet_id):
+        response = self.not_modified(request, cabinet_versions.cabinet_etag('status', cabinet_id))
+        if response is not None:
+            return response
+
         try:
             cabinet = Cabinet.objects.get(cabinet_id=cabinet_id)
         except Cabinet.DoesNotExist:
@@ -77,29 +152,160 @@ class CabinetStatusView(APIView):
         })
 
 
-class AvailableCabinetsView(APIView):
-    """获取可用柜子列表"""
+class AvailableCabinetsView(ConditionalGetMixin, APIView):
+    """
+    获取可用柜子列表
+
+    数据来自站点可用性索引（见 availability 模块），不查询柜子表。
+    summary=1 时只返回各站点、尺寸的空闲数和空闲柜子编号。
+    """
     permission_classes = [AllowAny]
+    query_budget = 3
 
     def get(self, request):
         station = request.query_params.get('station')
         size = request.query_params.get('size')
+        summary = request.query_params.get('summary') in ('1', 'true')
 
-        queryset = Cabinet.objects.filter(status='available')
+        response = self.not_modified(request, cabinet_versions.list_etag('available', station, size, summary))
+        if response is not None:
+            return response
+        return self.available_list(request, station, size, summary)
 
-        if station:
-            queryset = queryset.filter(station=station)
-        if size:
-            queryset = queryset.filter(size=size)
+    @cache_response(tags=lambda request, station, *args: [f'station:{station}' if station else 'cabinets'])
+    def available_list(self, request, station, size, summary):
+        if summary:
+            data = availability.summary(station, size)
+        else:
+            data = availability.available_cabinets(station, size)
+        return Response({
+            'code': 0,
+            'message': 'success',
+            'data': data
+        })
 
-        serializer = CabinetListSerializer(queryset, many=True)
+
+class NearbyStationsView(APIView):
+    """
+    附近有空闲柜子的站点
+
+    查询参数: lat、lng（必填）、size、limit（默认5，最多20）、radius（米，默认3000，最多50000）。
+    站点坐标和空闲数均来自进程内索引（见 stations 模块），热缓存下不访问数据库。
+    """
+    permission_classes = [AllowAny]
+    query_budget = 3
+    default_limit, max_limit = 5, 20
+    default_radius, max_radius = 3000, 50000
+
+    def perform_authentication(self, request):
+        # 公开接口，不需要用户信息
+        pass
+
+    def get(self, request):
+        try:
+            lat = float(request.query_params['lat'])
+            lng = float(request.query_params['lng'])
+            limit = int(request.query_params.get('limit', self.default_limit))
+            radius = float(request.query_params.get('radius', self.default_radius))
+        except (KeyError, ValueError):
+            return Response({
+                'code': 400,
+                'message': '参数错误: lat、lng 必填且为数字'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        size = request.query_params.get('size')
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180) or size not in (None, *dict(Cabinet.SIZE_CHOICES)):
+            return Response({
+                'code': 400,
+                'message': '参数错误: 坐标超出范围或尺寸无效'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, self.max_limit))
+        radius = max(0.0, min(radius, self.max_radius))
+
+        counts = {}
+        for (station, group_size), available in cabinet_versions.available_counts().items():
+            counts.setdefault(station, {})[group_size] = available
+
+        def has_free(station):
+            available = counts.get(station['code'], {})
+            return (available.get(size, 0) if size else sum(available.values())) > 0
+
+        data = []
+        for meters, station in station_index.nearest(lat, lng, limit, radius, accept=has_free):
+            available = counts.get(station['code'], {})
+            data.append({
+                'station': station['code'],
+                'name': station['name'],
+                'address': station['address'],
+                'latitude': station['latitude'],
+                'longitude': station['longitude'],
+                'distance': round(meters),
+                'available': {key: available.get(key, 0) for key, _ in Cabinet.SIZE_CHOICES},
+                'total_available': sum(available.values()),
+            })
         return Response({
             'code': 0,
             'message': 'success',
-            'data': serializer.data
+            'data': data
         })
 
 
+class CabinetStreamView(View):
+    """
+    柜子状态事件流（Server-Sent Events，异步视图，需通过 ASGI 部署）
+
+    查询参数: station（只接收该站点的事件，默认全部站点）。
+    推送 cabinet / availability / reset 事件（格式见 events 模块），事件从消息代理直接推送到连接，
+    空闲连接只定期发送注释行保活，不查询数据库。
+    连接建立后先发送 ready 事件（带当前事件ID），客户端应在收到后再读取全量状态，避免漏掉其间的变化。
+    断线重连时浏览器自动带上 Last-Event-ID（也可用 ?last_event_id=），从本进程的事件缓冲补发；
+    无法完整补发（续传点来自其他工作进程或已被淘汰）时发送 reset。客户端读取太慢、缓冲的事件超过 CABINET_STREAM_BUFFER 条时断开连接，由重连补发。
+    """
+
+    async def get(self, request):
+        station = request.GET.get('station') or None
+        last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id') or None
+
+        response = StreamingHttpResponse(self.stream(station, last_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # 关闭 Nginx 的响应缓冲，事件立即送达
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self, station, last_id):
+        keepalive = getattr(settings, 'CABINET_STREAM_KEEPALIVE', 15)
+        retry = getattr(settings, 'CABINET_STREAM_RETRY', 3000)
+        # 先订阅再读缓冲：两者重叠的事件按ID去重，不会遗漏
+        with cabinet_events.subscribe(station) as subscription:
+            yield f'retry: {retry}\n\n'
+            sent = set()
+            if last_id is None:
+                yield self.format({'id': cabinet_events.latest_id(), 'event': 'ready', 'data': {'station': station}})
+            else:
+                backlog, complete = cabinet_events.since(last_id, station)
+                if not complete:
+                    yield self.format({'id': cabinet_events.latest_id(), 'event': 'reset', 'data': {'stations': None}})
+                else:
+                    for event in backlog:
+                        sent.add(event['id'])
+                        yield self.format(event)
+
+            while not subscription.overflowed:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if event['id'] in sent:
+                    sent.discard(event['id'])
+                    continue
+                yield self.format(event)
+
+    @staticmethod
+    def format(event):
+        data = json.dumps(event['data'], ensure_ascii=False, separators=(',', ':'))
+        return f"id: {event['id']}\nevent: {event['event']}\ndata: {data}\n\n"
+
+
 class CabinetCreateView(APIView):
     """创建柜子（管理员）"""
     permission_classes = [IsAdminUser]
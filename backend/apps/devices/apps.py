@@ -1,6 +1,10 @@
+# Devices app
 from django.apps import AppConfig
 
 
 class DevicesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.devices'
+
+    def ready(self):
+        from . import signals  # noqa: F401
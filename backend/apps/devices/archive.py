@@ -0,0 +1,178 @@
+"""
+设备日志冷归档
+
+DeviceLog 按天（本地时区）分桶。早于 DEVICE_LOG_HOT_DAYS 天的桶由
+manage.py archive_device_logs 移出数据库，追加写入 gzip 压缩的 JSON Lines 段文件：
+
+    <DEVICE_LOG_ARCHIVE_DIR>/<YYYY>/<MM>/devicelog-<YYYYMMDD>.jsonl.gz
+
+每台设备每次归档的一天日志写成段文件中一个独立的 gzip 成员，位置和时间范围
+记录在 DeviceLogSegment 中。段文件只追加不改写；读取时按索引定位成员，
+只解压目标设备的数据。
+"""
+import gzip
+import json
+import os
+from datetime import datetime, time, timedelta
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import DeviceLog, DeviceLogSegment
+
+LOG_FIELDS = ('id', 'device_id', 'log_type', 'message', 'data', 'created_at')
+
+
+def archive_dir():
+    return Path(getattr(settings, 'DEVICE_LOG_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archive' / 'device_logs'))
+
+
+def hot_days():
+    return getattr(settings, 'DEVICE_LOG_HOT_DAYS', 30)
+
+
+def day_bounds(day):
+    """某天（本地时区）的 [开始, 结束) 时间"""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+    return start, end
+
+
+def hot_cutoff(now=None, days=None):
+    """热数据起始时间：早于此时间的日志可以归档"""
+    today = timezone.localdate(now or timezone.now())
+    return day_bounds(today - timedelta(days=hot_days() if days is None else days))[0]
+
+
+def segment_path(day):
+    return Path(f'{day:%Y}') / f'{day:%m}' / f'devicelog-{day:%Y%m%d}.jsonl.gz'
+
+
+def archive_day(day):
+    """
+    归档一天的日志，返回归档条数
+
+    段文件先写入并 fsync，再在一个事务内写索引、删除已归档的行；
+    事务失败时段文件中只会多出未被索引引用的成员，重跑不会丢数据。
+    """
+    start, end = day_bounds(day)
+    rows = (
+        DeviceLog.objects
+        .filter(created_at__gte=start, created_at__lt=end)
+        .order_by('device_id', 'created_at', 'id')
+        .values(*LOG_FIELDS)
+    )
+
+    relative = segment_path(day)
+    path = archive_dir() / relative
+    segments = []
+    max_id = None
+    output = None
+    with transaction.atomic():
+        try:
+            for device_id, group in groupby(rows.iterator(chunk_size=2000), key=itemgetter('device_id')):
+                if output is None:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    output = open(path, 'ab')
+                lines = []
+                first_at = last_at = None
+                for row in group:
+                    first_at = first_at or row['created_at']
+                    last_at = row['created_at']
+                    max_id = row['id'] if max_id is None else max(max_id, row['id'])
+                    record = {field: row[field] for field in LOG_FIELDS if field != 'device_id'}
+                    # 保留微秒精度（DjangoJSONEncoder 只保留到毫秒）
+                    record['created_at'] = row['created_at'].isoformat()
+                    lines.append(json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False).encode('utf-8') + b'\n')
+                member = gzip.compress(b''.join(lines))
+                segments.append(DeviceLogSegment(
+                    device_id=device_id,
+                    day=day,
+                    path=str(relative),
+                    offset=output.tell(),
+                    length=len(member),
+                    count=len(lines),
+                    first_at=first_at,
+                    last_at=last_at,
+                ))
+                output.write(member)
+            if output is not None:
+                output.flush()
+                os.fsync(output.fileno())
+        finally:
+            if output is not None:
+                output.close()
+
+        if not segments:
+            return 0
+        DeviceLogSegment.objects.bulk_create(segments)
+        # 过去的桶不会再有新日志写入（created_at 为写入时间），按时间范围删除即可
+        DeviceLog.objects.filter(created_at__gte=start, created_at__lt=end, id__lte=max_id).delete()
+
+    return sum(segment.count for segment in segments)
+
+
+def archive_logs(days=None, now=None):
+    """归档所有早于热数据窗口的日志，返回 [(日期, 条数), ...]"""
+    cutoff = hot_cutoff(now, days)
+    oldest = (
+        DeviceLog.objects.filter(created_at__lt=cutoff)
+        .order_by('created_at').values_list('created_at', flat=True).first()
+    )
+    if oldest is None:
+        return []
+
+    results = []
+    day = timezone.localdate(oldest)
+    while day_bounds(day)[0] < cutoff:
+        count = archive_day(day)
+        if count:
+            results.append((day, count))
+        day += timedelta(days=1)
+    return results
+
+
+def read_segment(segment):
+    """读取一个归档段，返回按时间升序的日志 dict 列表"""
+    with open(archive_dir() / segment.path, 'rb') as source:
+        source.seek(segment.offset)
+        member = source.read(segment.length)
+    rows = []
+    for line in gzip.decompress(member).splitlines():
+        row = json.loads(line)
+        row['created_at'] = parse_datetime(row['created_at'])
+        rows.append(row)
+    return rows
+
+
+def iter_cold_logs(device, start=None, end=None, before=None, log_types=None):
+    """
+    从归档段中按 (created_at, id) 倒序逐条读取设备日志
+
+    start 含、end 不含；before 为 (created_at, id)，只返回排在它之后（更早）的日志。
+    每次只解压一个段。
+    """
+    segments = DeviceLogSegment.objects.filter(device=device)
+    if start is not None:
+        segments = segments.filter(last_at__gte=start)
+    if end is not None:
+        segments = segments.filter(first_at__lt=end)
+    if before is not None:
+        segments = segments.filter(first_at__lte=before[0])
+
+    for segment in segments.order_by('-day', '-last_at').iterator():
+        rows = [
+            row for row in read_segment(segment)
+            if (start is None or row['created_at'] >= start)
+            and (end is None or row['created_at'] < end)
+            and (before is None or (row['created_at'], row['id']) < before)
+            and (not log_types or row['log_type'] in log_types)
+        ]
+        rows.sort(key=itemgetter('created_at', 'id'), reverse=True)
+        yield from rows
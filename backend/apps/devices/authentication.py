@@ -0,0 +1,178 @@
+"""
+ESP32 设备认证
+
+设备通过 X-API-Key 请求头（或请求体中的 api_key 字段）认证。
+密钥到设备的解析结果缓存在进程内的 LRU+TTL 缓存中，缓存键为密钥的
+SHA-256 摘要，命中时不访问数据库。设备的 api_key / is_active 变更后
+由信号清除本进程缓存，事务提交后经消息代理（AUTH_CHANNEL）通知其他工作进程清除。
+"""
+import copy
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.permissions import BasePermission
+
+from .broker import get_broker
+
+AUTH_CHANNEL = 'device-auth'
+
+
+def hash_api_key(api_key):
+    """计算缓存键（不在内存中以明文保存密钥索引）"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+class DeviceKeyCache:
+    """API密钥 -> 设备 的 LRU+TTL 缓存"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_device = {}
+        self._generation = 0
+        self._subscribed_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'DEVICE_AUTH_CACHE_SIZE', 10000)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'DEVICE_AUTH_CACHE_TTL', 60)
+
+    def get(self, api_key):
+        """解析API密钥，返回设备副本；密钥无效或设备停用时返回 None"""
+        from .models import Device
+
+        self._ensure_subscribed()
+        key = hash_api_key(api_key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                device, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.copy(device)
+                self._remove(key)
+            self.misses += 1
+            generation = self._generation
+
+        try:
+            device = Device.objects.get(api_key=api_key, is_active=True)
+        except Device.DoesNotExist:
+            return None
+
+        with self._lock:
+            # 查询期间发生过失效则不回填，避免缓存旧数据
+            if generation == self._generation:
+                self._entries[key] = (device, now + self.ttl)
+                self._keys_by_device[device.pk] = key
+                while len(self._entries) > self.max_size:
+                    oldest = next(iter(self._entries))
+                    self._remove(oldest)
+                    self.evictions += 1
+        return copy.copy(device)
+
+    def get_cached(self, api_key, shared=False):
+        """
+        只查缓存，未命中返回 None（供不能阻塞在数据库上的调用方使用）
+
+        shared=True 时返回缓存中的实例本身而不是副本，调用方不得修改它。
+        """
+        key = hash_api_key(api_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0] if shared else copy.copy(entry[0])
+
+    def invalidate_device(self, device_pk, broadcast=True):
+        """清除指定设备的缓存项（broadcast=True 时同时通知其他工作进程）"""
+        with self._lock:
+            self._generation += 1
+            key = self._keys_by_device.get(device_pk)
+            if key is not None:
+                self._remove(key)
+        if broadcast:
+            get_broker().publish(AUTH_CHANNEL, {'device': device_pk})
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._keys_by_device.clear()
+
+    def stats(self):
+        """命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else None,
+            }
+
+    def _ensure_subscribed(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._subscribed_pid == pid:
+                return
+            self._subscribed_pid = pid
+        get_broker().subscribe(AUTH_CHANNEL, self._on_message)
+
+    def _on_message(self, message):
+        """其他进程的失效通知（本进程发布的也会收到，重复清除无副作用）"""
+        if message.get('device') is not None:
+            self.invalidate_device(message['device'], broadcast=False)
+
+    def _remove(self, key):
+        device, _ = self._entries.pop(key)
+        if self._keys_by_device.get(device.pk) == key:
+            del self._keys_by_device[device.pk]
+
+
+device_key_cache = DeviceKeyCache()
+
+
+class DeviceAPIKeyAuthentication(BaseAuthentication):
+    """ESP32 设备API密钥认证，认证成功后 request.auth 为设备对象"""
+
+    def authenticate(self, request):
+        api_key = request.META.get('HTTP_X_API_KEY')
+        if not api_key:
+            data = request.data
+            api_key = data.get('api_key') if hasattr(data, 'get') else None
+        if not api_key:
+            return None
+
+        device = device_key_cache.get(api_key)
+        if device is None:
+            raise exceptions.AuthenticationFailed('无效的API密钥')
+        return (AnonymousUser(), device)
+
+    def authenticate_header(self, request):
+        return 'X-API-Key'
+
+
+class IsDevice(BasePermission):
+    """仅允许已认证的设备访问"""
+
+    def has_permission(self, request, view):
+        from .models import Device
+        return isinstance(request.auth, Device)
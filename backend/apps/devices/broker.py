@@ -0,0 +1,198 @@
+"""
+跨进程消息代理（发布/订阅）
+
+用于把"某设备有新指令"等通知送达持有该设备连接的工作进程。
+通过 DEVICE_BROKER 选择实现：
+
+- LocalBroker：进程内实现，开发环境和单进程部署使用；
+- UnixSocketBroker：同一主机上的多个工作进程（gunicorn + ASGI）通过
+  Unix 数据报套接字互发消息，无需额外服务，作为 Redis 的本地替身；
+- RedisBroker：基于 Redis pub/sub，适用于多主机部署（需安装 redis）。
+
+消息为可 JSON 序列化的 dict，投递为尽力而为（best-effort），
+订阅方需要有兜底（如长轮询的数据库定期检查）。
+"""
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BaseBroker:
+    """消息代理接口"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = {}
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, channel, callback):
+        """订阅频道，callback(message) 在代理的投递线程中调用；返回取消订阅函数"""
+        with self._lock:
+            self._callbacks.setdefault(channel, []).append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = self._callbacks.get(channel, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+        return unsubscribe
+
+    def dispatch(self, channel, message):
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(message)
+            except Exception:
+                logger.exception('消息处理失败: %s', channel)
+
+
+class LocalBroker(BaseBroker):
+    """进程内消息代理"""
+
+    def publish(self, channel, message):
+        self.dispatch(channel, message)
+
+
+class UnixSocketBroker(BaseBroker):
+    """
+    单机多进程消息代理
+
+    每个订阅进程在 DEVICE_BROKER_SOCKET_DIR 下绑定 <pid>.sock，
+    发布时向目录中所有套接字发送数据报；对端已退出的套接字文件会被清理。
+    """
+
+    def __init__(self, socket_dir=None):
+        super().__init__()
+        self.socket_dir = Path(socket_dir or getattr(
+            settings, 'DEVICE_BROKER_SOCKET_DIR', Path(settings.BASE_DIR) / 'run' / 'broker'
+        ))
+        self._sender = None
+        self._receiver = None
+        self._receiver_pid = None
+
+    def publish(self, channel, message):
+        data = json.dumps({'channel': channel, 'message': message}).encode('utf-8')
+        if self._sender is None:
+            self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.setblocking(False)
+        try:
+            names = os.listdir(self.socket_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith('.sock'):
+                continue
+            path = str(self.socket_dir / name)
+            try:
+                self._sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 对端进程已退出
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError:
+                logger.warning('消息投递失败（接收方缓冲区已满）: %s', path)
+
+    def subscribe(self, channel, callback):
+        self._ensure_receiver()
+        return super().subscribe(channel, callback)
+
+    def _ensure_receiver(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._receiver_pid == pid:
+                return
+            self.socket_dir.mkdir(parents=True, exist_ok=True)
+            path = self.socket_dir / f'{pid}.sock'
+            if path.exists():
+                path.unlink()
+            receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            receiver.bind(str(path))
+            self._receiver = receiver
+            self._receiver_pid = pid
+            atexit.register(self._cleanup, path)
+            threading.Thread(target=self._receive, args=(receiver,), name='broker-receiver', daemon=True).start()
+
+    def _receive(self, receiver):
+        while True:
+            try:
+                data = receiver.recv(65536)
+                envelope = json.loads(data)
+            except OSError:
+                return
+            except ValueError:
+                continue
+            self.dispatch(envelope.get('channel'), envelope.get('message'))
+
+    @staticmethod
+    def _cleanup(path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+class RedisBroker(BaseBroker):
+    """基于 Redis pub/sub 的消息代理（DEVICE_BROKER_URL 指定连接地址）"""
+
+    def __init__(self, url=None):
+        super().__init__()
+        import redis
+
+        self._client = redis.Redis.from_url(url or getattr(settings, 'DEVICE_BROKER_URL', 'redis://127.0.0.1:6379/0'))
+        self._pubsub = None
+        self._pubsub_pid = None
+
+    def publish(self, channel, message):
+        self._client.publish(channel, json.dumps(message))
+
+    def subscribe(self, channel, callback):
+        pid = os.getpid()
+        with self._lock:
+            if self._pubsub_pid != pid:
+                self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                self._pubsub_pid = pid
+                self._pubsub.subscribe(channel)
+                threading.Thread(target=self._receive, args=(self._pubsub,), name='broker-receiver', daemon=True).start()
+            elif channel not in self._callbacks:
+                self._pubsub.subscribe(channel)
+        return super().subscribe(channel, callback)
+
+    def _receive(self, pubsub):
+        for item in pubsub.listen():
+            try:
+                message = json.loads(item['data'])
+            except (TypeError, ValueError):
+                continue
+            channel = item['channel']
+            if isinstance(channel, bytes):
+                channel = channel.decode('utf-8')
+            self.dispatch(channel, message)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """按 DEVICE_BROKER 配置返回进程内唯一的消息代理实例"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_class = import_string(getattr(settings, 'DEVICE_BROKER', 'apps.devices.broker.LocalBroker'))
+                _broker = broker_class()
+    return _broker
@@ -0,0 +1,119 @@
+"""
+设备指令队列
+
+指令状态流转：pending -> leased -> acked，超时未下发或下发后未确认的
+指令标记为 expired，不会重复下发（至多一次语义，避免重复开柜）。
+队列查询走 (device, state, created_at) 索引，与日志表大小无关。
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import DeviceCommand
+from .notify import command_notifier, reply_notifier
+
+
+def command_ttl():
+    """指令未被领取时的有效期（秒）"""
+    return getattr(settings, 'DEVICE_COMMAND_TTL', 60)
+
+
+def lease_timeout():
+    """指令下发后等待设备确认的时间（秒）"""
+    return getattr(settings, 'DEVICE_COMMAND_LEASE_TIMEOUT', 30)
+
+
+def enqueue_command(device, command, payload=None, ttl=None):
+    """为设备创建一条待下发指令"""
+    now = timezone.now()
+    # 顺带清理该设备已过期的指令（只走索引范围）
+    expire_commands(device, now=now)
+    cmd = DeviceCommand.objects.create(
+        device=device,
+        command=command,
+        payload=payload or {},
+        expires_at=now + timedelta(seconds=ttl or command_ttl()),
+    )
+    # 提交后唤醒本进程内等待该设备指令的长轮询请求
+    transaction.on_commit(lambda: command_notifier.notify(device.pk))
+    return cmd
+
+
+def lease_commands(device, command=None, limit=10, auto_ack=False):
+    """
+    领取设备的待下发指令（按创建时间先后）
+
+    每条指令通过条件更新 state='pending' 抢占，并发轮询时同一指令只会被
+    一个请求领取。auto_ack=True 时领取即确认（用于不回传确认的旧版固件）。
+    """
+    now = timezone.now()
+    queryset = DeviceCommand.objects.filter(device=device, state='pending', expires_at__gt=now)
+    if command:
+        queryset = queryset.filter(command=command)
+    candidates = list(queryset.order_by('created_at')[:limit])
+
+    if auto_ack:
+        changes = {'state': 'acked', 'leased_at': now, 'acked_at': now}
+    else:
+        changes = {
+            'state': 'leased',
+            'leased_at': now,
+            'lease_expires_at': now + timedelta(seconds=lease_timeout()),
+        }
+
+    leased = []
+    for cmd in candidates:
+        if DeviceCommand.objects.filter(pk=cmd.pk, state='pending').update(**changes):
+            for field, value in changes.items():
+                setattr(cmd, field, value)
+            leased.append(cmd)
+    return leased
+
+
+def ack_commands(device, command_ids):
+    """确认设备已执行的指令，返回确认条数"""
+    if not command_ids:
+        return 0
+    return DeviceCommand.objects.filter(
+        device=device, pk__in=command_ids, state='leased'
+    ).update(state='acked', acked_at=timezone.now())
+
+
+def complete_command(device, command_id, result):
+    """
+    记录设备回传的 query_status 指令结果（同时视为确认），提交后唤醒等待该结果的请求
+
+    返回是否找到该设备的这条指令；其他类型的指令（如开柜）不会被状态上报覆盖结果。
+    """
+    now = timezone.now()
+    updated = DeviceCommand.objects.filter(device=device, pk=command_id, command='query_status').update(
+        result=result, state='acked', acked_at=Coalesce('acked_at', Value(now))
+    )
+    if updated:
+        transaction.on_commit(lambda: reply_notifier.notify(command_id))
+    return bool(updated)
+
+
+def expire_commands(device=None, now=None):
+    """将超时未下发、以及下发后超时未确认的指令标记为过期"""
+    now = now or timezone.now()
+    queryset = DeviceCommand.objects.all()
+    if device is not None:
+        queryset = queryset.filter(device=device)
+    expired = queryset.filter(state='pending', expires_at__lte=now).update(state='expired')
+    expired += queryset.filter(state='leased', lease_expires_at__lte=now).update(state='expired')
+    return expired
+
+
+def serialize_command(cmd):
+    """指令下发给设备的数据格式"""
+    return {
+        'id': cmd.pk,
+        'command': cmd.command,
+        **cmd.payload,
+        'timestamp': cmd.created_at.isoformat(),
+    }
@@ -0,0 +1,235 @@
+"""
+设备数据网关（UDP/TCP，由 manage.py device_gateway 启动）
+
+心跳和状态上报不经过 Django/DRF 请求栈，直接以 MessagePack 报文收发：
+
+    {"api_key": "...", "type": "heartbeat", "battery_level": 80, "seq": 1}
+    {"api_key": "...", "type": "status", "cabinet_status": {"A001": [true, 0, true, false]}, "seq": 2}
+
+回执为 {"code": 0, "seq": <原样返回>}，失败时 code 为 400/401。
+UDP 每个数据报一条消息；TCP 每帧为 2 字节大端长度前缀 + 报文，
+同一 TCP 连接认证成功后后续帧可省略 api_key。
+
+写库复用 HTTP 接口的逻辑：心跳进入 heartbeat_buffer，状态上报按
+DEVICE_GATEWAY_BATCH_INTERVAL 聚合后在一个事务内逐条 apply_status_report。
+回执在入队后立即返回（不等待落库），因此网关不回复 state_hash 校验结果，
+需要增量上报校验的设备应使用 HTTP 或 WebSocket 通道。
+所有数据库操作在单个专用线程中执行，事件循环只做解码、认证缓存查找和入队。
+"""
+import asyncio
+import copy
+import logging
+import struct
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .authentication import device_key_cache
+from .heartbeat import heartbeat_buffer
+from .protocol import MessagePackError, packb, unpackb, validate_status_report
+from .services import apply_status_report
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct('>H')
+MAX_FRAME_SIZE = 0xffff
+
+
+class DeviceGateway:
+    """报文处理与批量写库（UDP/TCP 共用）"""
+
+    def __init__(self, batch_interval=None, batch_size=None):
+        self.batch_interval = batch_interval if batch_interval is not None else getattr(
+            settings, 'DEVICE_GATEWAY_BATCH_INTERVAL', 0.05
+        )
+        self.batch_size = batch_size or getattr(settings, 'DEVICE_GATEWAY_BATCH_SIZE', 500)
+        self.stats = Counter()
+        self._reports = []
+        self._flush_wanted = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gateway-db')
+
+    async def run_db(self, func, *args):
+        """在数据库线程中执行"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def authenticate(self, api_key):
+        if not isinstance(api_key, str) or not api_key:
+            return None
+        # 心跳只用到主键，共享缓存实例以省去复制；需要修改设备的路径自行复制
+        device = device_key_cache.get_cached(api_key, shared=True)
+        if device is None:
+            device = await self.run_db(device_key_cache.get, api_key)
+        return device
+
+    async def handle(self, payload, device=None):
+        """
+        处理一条报文，返回 (回执, 设备)
+
+        device 为 TCP 连接上已认证的设备，报文中带 api_key 时以报文为准。
+        """
+        try:
+            message = unpackb(payload)
+        except MessagePackError:
+            self.stats['invalid'] += 1
+            return {'code': 400}, device
+        if not isinstance(message, dict):
+            self.stats['invalid'] += 1
+            return {'code': 400}, device
+
+        reply = {'code': 0}
+        if 'seq' in message:
+            reply['seq'] = message['seq']
+
+        if 'api_key' in message or device is None:
+            device = await self.authenticate(message.get('api_key'))
+            if device is None:
+                self.stats['unauthorized'] += 1
+                reply['code'] = 401
+                return reply, None
+
+        message_type = message.get('type')
+        if message_type == 'heartbeat':
+            battery_level = message.get('battery_level')
+            if battery_level is not None and (
+                isinstance(battery_level, bool) or not isinstance(battery_level, int) or not 0 <= battery_level <= 100
+            ):
+                self.stats['invalid'] += 1
+                reply['code'] = 400
+                return reply, device
+            heartbeat_buffer.record(device, battery_level, flush=False)
+            self.stats['heartbeat'] += 1
+        elif message_type == 'status':
+            validated, errors = validate_status_report(message)
+            if errors:
+                self.stats['invalid'] += 1
+                reply['code'] = 400
+                return reply, device
+            self._reports.append((copy.copy(device), validated))
+            self.stats['status'] += 1
+            if len(self._reports) >= self.batch_size and self._flush_wanted is not None:
+                self._flush_wanted.set()
+        else:
+            self.stats['invalid'] += 1
+            reply['code'] = 400
+        return reply, device
+
+    async def flush_loop(self):
+        """按间隔（或攒满 batch_size 时）批量写入状态上报"""
+        self._flush_wanted = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wanted.wait(), self.batch_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wanted.clear()
+            await self.flush()
+
+    async def flush(self):
+        reports, self._reports = self._reports, []
+        if reports:
+            await self.run_db(self._write_reports, reports)
+
+    def _write_reports(self, reports):
+        """一个事务内应用一批状态上报；每条在各自的保存点内执行，单条失败只回滚该条"""
+        close_old_connections()
+        failed = 0
+        try:
+            with transaction.atomic():
+                for device, validated in reports:
+                    try:
+                        with transaction.atomic():
+                            apply_status_report(
+                                device, validated['cabinet_status'], validated['battery_level'],
+                                query_id=validated['query_id']
+                            )
+                    except Exception:
+                        failed += 1
+                        logger.exception('网关状态上报写入失败: %s', device.device_id)
+        except Exception:
+            logger.exception('网关状态上报批量写入失败，丢弃 %d 条', len(reports))
+            failed = len(reports)
+        self.stats['status_written'] += len(reports) - failed
+        self.stats['status_failed'] += failed
+
+    def close(self):
+        """写完剩余数据（进程退出前调用）"""
+        reports, self._reports = self._reports, []
+        if reports:
+            self._executor.submit(self._write_reports, reports).result()
+        self._executor.submit(heartbeat_buffer.flush).result()
+        self._executor.shutdown()
+
+
+class GatewayDatagramProtocol(asyncio.DatagramProtocol):
+    """UDP：每个数据报一条消息，回执发回来源地址"""
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        asyncio.ensure_future(self._respond(data, addr))
+
+    async def _respond(self, data, addr):
+        reply, _ = await self.gateway.handle(data)
+        self.transport.sendto(packb(reply), addr)
+
+
+def tcp_handler(gateway):
+    """TCP：长度前缀分帧，连接内复用认证结果"""
+
+    async def handle_connection(reader, writer):
+        device = None
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                (size,) = FRAME_HEADER.unpack(header)
+                payload = await reader.readexactly(size)
+                reply, device = await gateway.handle(payload, device)
+                data = packb(reply)
+                writer.write(FRAME_HEADER.pack(len(data)) + data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return handle_connection
+
+
+async def serve(gateway, host, udp_port=None, tcp_port=None, ready=None):
+    """启动 UDP/TCP 监听并运行到被取消"""
+    loop = asyncio.get_running_loop()
+    transport = server = None
+    if udp_port:
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: GatewayDatagramProtocol(gateway), local_addr=(host, udp_port)
+        )
+    if tcp_port:
+        server = await asyncio.start_server(tcp_handler(gateway), host, tcp_port)
+    if ready is not None:
+        ready(transport, server)
+
+    flusher = asyncio.ensure_future(gateway.flush_loop())
+    try:
+        await asyncio.Event().wait()
+    finally:
+        flusher.cancel()
+        if transport is not None:
+            transport.close()
+        if server is not None:
+            server.close()
+        await gateway.flush()
+
+
+def frame(message):
+    """编码一帧 TCP 报文（供设备端/测试工具使用）"""
+    data = packb(message)
+    if len(data) > MAX_FRAME_SIZE:
+        raise ValueError('报文过长')
+    return FRAME_HEADER.pack(len(data)) + data
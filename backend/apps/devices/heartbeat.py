@@ -0,0 +1,346 @@
+"""
+设备心跳写缓冲（write-behind）
+
+ESP32 心跳先在进程内按设备合并，再由后台线程按固定间隔
+在一个事务内批量写回 last_heartbeat / battery_level / status，
+并把心跳合并进按小时汇总的 DeviceHeartbeatRollup。数据库中的心跳时间
+最多滞后 DEVICE_HEARTBEAT_FLUSH_INTERVAL 秒。
+
+心跳中断（间隔超过 DEVICE_HEARTBEAT_GAP）在写回时计算：同一设备的心跳可能落在不同工作进程，
+各进程只缓冲心跳时间，写回时与数据库中已合并的 last_heartbeat 一起排序后判断。
+
+逐条的心跳日志（DeviceLog）只对开启了 debug_heartbeat_log 的设备写入。
+电量同时记入遥测缓冲（见 telemetry.py），由写回线程按遥测写回间隔一并写入。
+心跳到达时同时写入共享内存在线状态表（见 presence.py），不等落库。
+"""
+import atexit
+import bisect
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FIELDS = (
+    'count', 'first_seen', 'last_seen', 'battery_min', 'battery_sum',
+    'battery_samples', 'battery_last', 'gap_count', 'gap_seconds',
+)
+
+
+def heartbeat_gap():
+    """两次心跳间隔超过该值（秒）视为中断"""
+    return getattr(settings, 'DEVICE_HEARTBEAT_GAP', 300)
+
+
+def floor_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def new_rollup():
+    return {
+        'count': 0, 'first_seen': None, 'last_seen': None,
+        'battery_min': None, 'battery_sum': 0, 'battery_samples': 0, 'battery_last': None,
+        'gap_count': 0, 'gap_seconds': 0.0,
+    }
+
+
+def add_gap(hours, previous, current):
+    """
+    previous -> current 的间隔超过阈值时记一次中断
+
+    中断区间为 [previous + 阈值, current)，按小时拆分计入 gap_seconds，
+    中断次数计在 current 所在小时。
+    """
+    gap_start = previous + timedelta(seconds=heartbeat_gap())
+    if gap_start >= current:
+        return
+    hours.setdefault(floor_hour(current), new_rollup())['gap_count'] += 1
+    moment = gap_start
+    while moment < current:
+        hour = floor_hour(moment)
+        boundary = min(hour + timedelta(hours=1), current)
+        hours.setdefault(hour, new_rollup())['gap_seconds'] += (boundary - moment).total_seconds()
+        moment = boundary
+
+
+def compact_beats(beats):
+    """
+    去掉不影响中断判断的心跳时间（beats 已排序）
+
+    前后两个保留点的间隔不超过阈值时，中间的点无论与哪个时间合并排序都不会产生中断。
+    """
+    if len(beats) <= 2:
+        return beats
+    threshold = timedelta(seconds=heartbeat_gap())
+    kept = [beats[0]]
+    for index in range(1, len(beats) - 1):
+        if beats[index + 1] - kept[-1] > threshold:
+            kept.append(beats[index])
+    kept.append(beats[-1])
+    return kept
+
+
+def merge_rollup(into, other):
+    """把同一小时的另一段汇总合并进 into"""
+    if other['count']:
+        if into['first_seen'] is None or other['first_seen'] < into['first_seen']:
+            into['first_seen'] = other['first_seen']
+        if into['last_seen'] is None or other['last_seen'] >= into['last_seen']:
+            into['last_seen'] = other['last_seen']
+            if other['battery_last'] is not None:
+                into['battery_last'] = other['battery_last']
+    if other['battery_min'] is not None and (into['battery_min'] is None or other['battery_min'] < into['battery_min']):
+        into['battery_min'] = other['battery_min']
+    for field in ('count', 'battery_sum', 'battery_samples', 'gap_count', 'gap_seconds'):
+        into[field] += other[field]
+
+
+class HeartbeatBuffer:
+    """心跳合并缓冲区（每个工作进程一个实例）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._logs = []
+        self._worker = None
+        self._worker_pid = None
+
+    @property
+    def flush_interval(self):
+        """最大写回延迟（秒），0 表示每次心跳立即写库"""
+        return getattr(settings, 'DEVICE_HEARTBEAT_FLUSH_INTERVAL', 5)
+
+    @property
+    def max_pending(self):
+        """缓冲设备数上限，超过后立即写回"""
+        return getattr(settings, 'DEVICE_HEARTBEAT_MAX_PENDING', 5000)
+
+    @property
+    def max_logs(self):
+        """缓冲的心跳日志条数上限，达到后立即写回；写回失败积压时丢弃最早的日志"""
+        return getattr(settings, 'DEVICE_HEARTBEAT_MAX_LOGS', 10000)
+
+    @property
+    def max_retries(self):
+        """随整批写回连续失败的次数上限，超过后该设备单独写回，仍失败则丢弃"""
+        return getattr(settings, 'DEVICE_HEARTBEAT_MAX_RETRIES', 3)
+
+    def record(self, device, battery_level=None, now=None, flush=True, log=True):
+        """
+        记录一次心跳
+
+        flush=False 时从不在调用线程中写库（供事件循环中的调用方使用），
+        写回完全交给后台线程。log=False 时即使设备开启了心跳明细也不写日志。
+        """
+        from .models import DeviceLog
+        from .presence import presence_table
+        from .telemetry import telemetry_buffer
+
+        now = now or timezone.now()
+        with self._lock:
+            entry = self._pending.get(device.pk)
+            if entry is None:
+                entry = self._pending[device.pk] = {'battery_level': None, 'beats': [], 'hours': {}, 'failures': 0}
+            bisect.insort(entry['beats'], now)
+            entry['beats'] = compact_beats(entry['beats'])
+            if battery_level is not None:
+                entry['battery_level'] = battery_level
+
+            merge_rollup(entry['hours'].setdefault(floor_hour(now), new_rollup()), {
+                'count': 1, 'first_seen': now, 'last_seen': now,
+                'battery_min': battery_level, 'battery_sum': battery_level or 0,
+                'battery_samples': 0 if battery_level is None else 1, 'battery_last': battery_level,
+                'gap_count': 0, 'gap_seconds': 0.0,
+            })
+
+            if log and getattr(device, 'debug_heartbeat_log', False):
+                self._logs.append(DeviceLog(
+                    device_id=device.pk,
+                    log_type='heartbeat',
+                    message='心跳上报',
+                    data={'battery_level': battery_level}
+                ))
+                if len(self._logs) > self.max_logs:
+                    del self._logs[:len(self._logs) - self.max_logs]
+            overflow = len(self._pending) >= self.max_pending or len(self._logs) >= self.max_logs
+        presence_table.beat(device.pk, now, battery_level)
+        telemetry_buffer.record('battery', device.pk, battery_level, now)
+
+        if flush and (self.flush_interval <= 0 or overflow):
+            self.flush()
+        else:
+            self._ensure_worker()
+
+    def flush(self):
+        """将缓冲的心跳批量写回数据库（到期的遥测采样另起事务写回），返回写回的设备数"""
+        from .telemetry import telemetry_buffer
+
+        telemetry_buffer.maybe_flush()
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            logs, self._logs = self._logs, []
+
+        if not pending:
+            return 0
+
+        # 多次随整批写回失败的设备逐台单独写回，一台设备的坏数据不会拖住整批
+        isolated = {pk: entry for pk, entry in pending.items() if entry['failures'] >= self.max_retries}
+        device_logs = {}
+        for log in logs:
+            device_logs.setdefault(log.device_id if log.device_id in isolated else None, []).append(log)
+
+        written = 0
+        if len(isolated) < len(pending):
+            batch = {pk: entry for pk, entry in pending.items() if pk not in isolated}
+            written += self._write(batch, device_logs.get(None, []))
+        for pk, entry in isolated.items():
+            written += self._write({pk: entry}, device_logs.get(pk, []), isolated=True)
+        return written
+
+    def _write(self, pending, logs, isolated=False):
+        """在一个事务内写回一批设备的心跳，返回写回的设备数；失败时放回缓冲区，单独写回仍失败的丢弃"""
+        from .models import Device, DeviceHeartbeatRollup, DeviceLog
+        from .services import record_status_transitions
+
+        try:
+            with transaction.atomic():
+                # 已写回的心跳时间（各工作进程合并后的最新值）用于判断中断，原状态用于记录上线；
+                # 加锁使并发的写回按顺序读到彼此的结果
+                previous = {}
+                came_online = []
+                for pk, last_heartbeat, status in Device.objects.select_for_update().filter(
+                    pk__in=list(pending)
+                ).values_list('pk', 'last_heartbeat', 'status'):
+                    previous[pk] = last_heartbeat
+                    if status != 'online':
+                        came_online.append(pk)
+
+                # 缓冲期间被删除的设备：丢弃其心跳和日志，否则写汇总时外键约束失败，整批永远重试
+                deleted = pending.keys() - previous.keys()
+                if deleted:
+                    logger.info('丢弃 %d 台已删除设备的缓冲心跳', len(deleted))
+                    pending = {pk: entry for pk, entry in pending.items() if pk in previous}
+                    logs = [log for log in logs if log.device_id in previous]
+
+                with_battery = []
+                without_battery = []
+                hours = {}
+                for pk, entry in pending.items():
+                    device_hours = {hour: dict(rollup) for hour, rollup in entry['hours'].items()}
+                    beats = entry['beats']
+                    last_heartbeat = beats[-1]
+                    if previous[pk] is not None:
+                        # 早于已写回心跳的部分由其他工作进程先写回，其前后的中断已按当时的时间线计算
+                        beats = [previous[pk]] + [beat for beat in beats if beat > previous[pk]]
+                        last_heartbeat = max(last_heartbeat, previous[pk])
+                    for earlier, later in zip(beats, beats[1:]):
+                        add_gap(device_hours, earlier, later)
+                    for hour, rollup in device_hours.items():
+                        hours[(pk, hour)] = rollup
+
+                    device = Device(pk=pk, last_heartbeat=last_heartbeat, status='online')
+                    if entry['battery_level'] is not None:
+                        device.battery_level = entry['battery_level']
+                        with_battery.append(device)
+                    else:
+                        without_battery.append(device)
+
+                if with_battery:
+                    Device.objects.bulk_update(with_battery, ['last_heartbeat', 'battery_level', 'status'])
+                if without_battery:
+                    Device.objects.bulk_update(without_battery, ['last_heartbeat', 'status'])
+                self._write_rollups(DeviceHeartbeatRollup, hours)
+                DeviceLog.objects.bulk_create(logs)
+                record_status_transitions(came_online, 'online')
+        except Exception:
+            if isolated:
+                pk, entry = next(iter(pending.items()))
+                logger.exception(
+                    '设备 %s 的心跳写回失败 %d 次，已丢弃 %d 次心跳和 %d 条日志',
+                    pk, entry['failures'] + 1, sum(rollup['count'] for rollup in entry['hours'].values()), len(logs)
+                )
+                return 0
+            logger.exception('心跳批量写回失败，%d 台设备将在下次重试', len(pending))
+            self._requeue(pending, logs)
+            return 0
+
+        return len(pending)
+
+    @staticmethod
+    def _write_rollups(model, hours):
+        """与已有的小时汇总合并后写回（一次查询 + bulk_update / bulk_create）"""
+        existing = {
+            (rollup.device_id, rollup.hour): rollup
+            for rollup in model.objects.select_for_update().filter(
+                device_id__in={pk for pk, _ in hours},
+                hour__in={hour for _, hour in hours},
+            )
+        }
+
+        to_update = []
+        to_create = []
+        for (pk, hour), values in hours.items():
+            rollup = existing.get((pk, hour))
+            if rollup is None:
+                to_create.append(model(device_id=pk, hour=hour, **values))
+                continue
+            merged = {field: getattr(rollup, field) for field in ROLLUP_FIELDS}
+            merge_rollup(merged, values)
+            for field, value in merged.items():
+                setattr(rollup, field, value)
+            to_update.append(rollup)
+
+        if to_update:
+            model.objects.bulk_update(to_update, ROLLUP_FIELDS)
+        if to_create:
+            model.objects.bulk_create(to_create)
+
+    def _requeue(self, pending, logs):
+        """写回失败时放回缓冲区（记一次失败），与期间到达的心跳合并"""
+        with self._lock:
+            for pk, entry in pending.items():
+                entry['failures'] += 1
+                newer = self._pending.get(pk)
+                if newer is not None:
+                    entry['beats'] = compact_beats(sorted(entry['beats'] + newer['beats']))
+                    for hour, rollup in newer['hours'].items():
+                        merge_rollup(entry['hours'].setdefault(hour, new_rollup()), rollup)
+                    if newer['battery_level'] is not None:
+                        entry['battery_level'] = newer['battery_level']
+                self._pending[pk] = entry
+            self._logs[:0] = logs
+            excess = len(self._logs) - self.max_logs
+            if excess > 0:
+                logger.warning('心跳日志积压超过 %d 条，丢弃最早的 %d 条', self.max_logs, excess)
+                del self._logs[:excess]
+
+    def _ensure_worker(self):
+        """按进程懒启动写回线程（gunicorn fork 后线程不会被继承）"""
+        pid = os.getpid()
+        if self._worker_pid == pid and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker_pid == pid and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name='heartbeat-flush', daemon=True)
+            self._worker_pid = pid
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(max(self.flush_interval, 0.1))
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('心跳写回线程异常')
+
+
+heartbeat_buffer = HeartbeatBuffer()
+atexit.register(heartbeat_buffer.flush)
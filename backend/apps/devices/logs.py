@@ -0,0 +1,132 @@
+"""
+设备日志查询（DeviceLogsView）
+
+日志按 (created_at, id) 倒序读取，先读数据库中的热数据，再接归档段中的冷数据
+（见 archive.py）。分页使用游标：游标编码上一页最后一条的 (created_at, id)，
+下一页只查询排在它之后的行，翻页深度不影响查询开销。
+"""
+import base64
+import json
+from itertools import chain
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import serializers
+from rest_framework.renderers import BaseRenderer
+
+from . import archive
+from .models import DeviceLog
+
+LOG_FIELDS = ('id', 'log_type', 'message', 'data', 'created_at')
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+def parse_log_time(value):
+    """解析日志查询时间参数，日期按本地时区当天零点处理"""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        return archive.day_bounds(day)[0]
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_log_types(value):
+    """解析逗号分隔的日志类型"""
+    if not value:
+        return None
+    log_types = {log_type.strip() for log_type in value.split(',') if log_type.strip()}
+    if not log_types <= set(dict(DeviceLog.LOG_TYPES)):
+        raise ValueError(value)
+    return log_types
+
+
+def encode_cursor(row):
+    raw = f"{row['created_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    """游标 -> (created_at, id)，格式错误时抛出 ValueError"""
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+        created_at, pk = raw.rsplit('|', 1)
+        parsed = parse_datetime(created_at)
+        pk = int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(value)
+    if parsed is None or timezone.is_naive(parsed):
+        raise ValueError(value)
+    return parsed, pk
+
+
+def iter_logs(device, log_types=None, start=None, end=None, before=None, include_archive=None):
+    """
+    按 (created_at, id) 倒序逐条返回设备日志 dict（LOG_FIELDS）
+
+    数据库部分使用服务端游标分块读取，不会一次载入全部结果。
+    include_archive 默认在指定了 start 时读取归档（避免无时间范围时扫描全部归档段）。
+    """
+    logs = DeviceLog.objects.filter(device=device)
+    if log_types:
+        logs = logs.filter(log_type__in=log_types)
+    if start is not None:
+        logs = logs.filter(created_at__gte=start)
+    if end is not None:
+        logs = logs.filter(created_at__lt=end)
+    if before is not None:
+        logs = logs.filter(Q(created_at__lt=before[0]) | Q(created_at=before[0], id__lt=before[1]))
+    hot = logs.order_by('-created_at', '-id').values(*LOG_FIELDS).iterator(chunk_size=2000)
+
+    if include_archive is None:
+        include_archive = start is not None
+    if not include_archive:
+        return hot
+    # 归档的都是更早的整天日志，接在热数据之后
+    return chain(hot, archive.iter_cold_logs(device, start, end, before, log_types))
+
+
+_created_at = serializers.DateTimeField()
+
+
+def format_log(device, row):
+    """与 DeviceLogSerializer 输出一致（设备编号直接取自 device，不逐行查询）"""
+    return {
+        'id': row['id'],
+        'device_id': device.device_id,
+        'log_type': row['log_type'],
+        'message': row['message'],
+        'data': row['data'],
+        'created_at': _created_at.to_representation(row['created_at']),
+    }
+
+
+def ndjson_lines(device, rows):
+    for row in rows:
+        yield json.dumps(format_log(device, row), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    ?format=ndjson 导出
+
+    正常结果由视图直接返回流式响应；此渲染器只用于把错误响应渲染成一行 JSON。
+    """
+    media_type = NDJSON_MEDIA_TYPE
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False).encode('utf-8') + b'\n'
@@ -0,0 +1,39 @@
+"""
+设备日志冷归档：把早于热数据窗口的 DeviceLog 移入压缩段文件（见 apps/devices/archive.py）
+
+建议每天低峰期执行一次：
+    python manage.py archive_device_logs
+    python manage.py archive_device_logs --hot-days 7 --vacuum
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.devices.archive import archive_logs, hot_cutoff, hot_days
+from apps.devices.models import DeviceLog
+
+
+class Command(BaseCommand):
+    help = '将过期设备日志按天归档到压缩段文件并从数据库删除'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hot-days', type=int, default=None, help='数据库中保留的天数（默认 DEVICE_LOG_HOT_DAYS）')
+        parser.add_argument('--dry-run', action='store_true', help='只统计待归档的日志条数')
+        parser.add_argument('--vacuum', action='store_true', help='归档后执行 VACUUM 回收 SQLite 文件空间')
+
+    def handle(self, *args, **options):
+        days = options['hot_days'] if options['hot_days'] is not None else hot_days()
+        cutoff = hot_cutoff(days=days)
+
+        if options['dry_run']:
+            count = DeviceLog.objects.filter(created_at__lt=cutoff).count()
+            self.stdout.write(f'早于 {cutoff:%Y-%m-%d %H:%M} 的日志 {count} 条待归档')
+            return
+
+        results = archive_logs(days=days)
+        for day, count in results:
+            self.stdout.write(f'{day}: 归档 {count} 条')
+        self.stdout.write(self.style.SUCCESS(f'归档完成，共 {sum(count for _, count in results)} 条'))
+
+        if options['vacuum'] and connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
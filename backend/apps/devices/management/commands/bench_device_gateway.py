@@ -0,0 +1,145 @@
+"""
+设备网关吞吐基准测试
+
+inprocess 模式（默认）在单核上对比同一批心跳经 DRF 视图和经网关报文处理的速率；
+udp 模式向运行中的 device_gateway 发送心跳并统计回执速率和延迟。
+两种模式都会为抽样设备真实记录心跳，请勿对生产库运行。
+
+    python manage.py bench_device_gateway --messages 20000
+    python manage.py bench_device_gateway --mode udp --port 9100 --messages 100000
+"""
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIRequestFactory
+
+from apps.devices.gateway import DeviceGateway
+from apps.devices.heartbeat import heartbeat_buffer
+from apps.devices.models import Device
+from apps.devices.protocol import packb, unpackb
+from apps.devices.views import DeviceHeartbeatView
+
+
+class Command(BaseCommand):
+    help = '测试设备网关的心跳吞吐（对比 HTTP 路径）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['inprocess', 'udp'], default='inprocess')
+        parser.add_argument('--messages', type=int, default=20000, help='心跳报文数')
+        parser.add_argument('--devices', type=int, default=100, help='参与测试的设备数（取已启用设备）')
+        parser.add_argument('--host', default='127.0.0.1', help='udp 模式的网关地址')
+        parser.add_argument('--port', type=int, default=9100, help='udp 模式的网关端口')
+        parser.add_argument('--window', type=int, default=256, help='udp 模式的在途报文上限')
+
+    def handle(self, *args, **options):
+        api_keys = list(
+            Device.objects.filter(is_active=True).values_list('api_key', flat=True)[:options['devices']]
+        )
+        if not api_keys:
+            raise CommandError('没有已启用的设备，请先创建设备')
+
+        if options['mode'] == 'udp':
+            asyncio.run(self.bench_udp(api_keys, options))
+        else:
+            self.bench_inprocess(api_keys, options['messages'])
+
+    def bench_inprocess(self, api_keys, count):
+        factory = APIRequestFactory()
+        view = DeviceHeartbeatView.as_view()
+        body = json.dumps({'battery_level': 80})
+
+        def http():
+            for i in range(count):
+                request = factory.post(
+                    '/api/devices/heartbeat/', body, content_type='application/json',
+                    HTTP_X_API_KEY=api_keys[i % len(api_keys)]
+                )
+                view(request)
+
+        payloads = [
+            packb({'api_key': api_keys[i % len(api_keys)], 'type': 'heartbeat', 'battery_level': 80, 'seq': i})
+            for i in range(count)
+        ]
+
+        gateway = DeviceGateway()
+
+        async def gateway_run():
+            for payload in payloads:
+                packb((await gateway.handle(payload))[0])
+
+        # 预热认证缓存，计时只包含稳态路径
+        for api_key in api_keys:
+            view(factory.post('/api/devices/heartbeat/', body, content_type='application/json', HTTP_X_API_KEY=api_key))
+        heartbeat_buffer.flush()
+
+        rows = [('DRF 视图', http), ('网关报文', lambda: asyncio.run(gateway_run()))]
+        results = []
+        for label, func in rows:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            heartbeat_buffer.flush()
+            results.append((label, count / elapsed))
+        gateway.close()
+
+        self.stdout.write(f'{"路径":<12}{"心跳/秒":>12}{"单条(us)":>12}')
+        for label, rate in results:
+            self.stdout.write(f'{label:<12}{rate:>12.0f}{1e6 / rate:>12.1f}')
+        self.stdout.write(f'网关/HTTP 吞吐比: {results[1][1] / results[0][1]:.1f}x')
+
+    async def bench_udp(self, api_keys, options):
+        count, window = options['messages'], options['window']
+        loop = asyncio.get_running_loop()
+        sent_at = {}
+        latencies = []
+        last_reply = [0.0]
+        slots = asyncio.Semaphore(window)
+        done = asyncio.Event()
+
+        class Client(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                seq = unpackb(data).get('seq')
+                started = sent_at.pop(seq, None)
+                if started is None:
+                    return
+                last_reply[0] = time.perf_counter()
+                latencies.append(last_reply[0] - started)
+                slots.release()
+                if len(latencies) == count:
+                    done.set()
+
+        transport, _ = await loop.create_datagram_endpoint(
+            Client, remote_addr=(options['host'], options['port'])
+        )
+        start = time.perf_counter()
+        for i in range(count):
+            try:
+                await asyncio.wait_for(slots.acquire(), 1.0)
+            except asyncio.TimeoutError:
+                # 回执丢失，释放最早的在途报文
+                sent_at.pop(next(iter(sent_at)), None)
+            sent_at[i] = time.perf_counter()
+            transport.sendto(packb({
+                'api_key': api_keys[i % len(api_keys)], 'type': 'heartbeat', 'battery_level': 80, 'seq': i
+            }))
+        try:
+            await asyncio.wait_for(done.wait(), 5.0)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = last_reply[0] - start
+        transport.close()
+
+        if not latencies:
+            raise CommandError('未收到回执，请确认 device_gateway 正在运行')
+        latencies.sort()
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(
+            f'发送 {count} 条，收到回执 {len(latencies)} 条（丢失 {count - len(latencies)}），'
+            f'{len(latencies) / elapsed:.0f} 条/秒'
+        )
+        self.stdout.write(f'延迟 p50 {percentile(0.5):.2f}ms  p95 {percentile(0.95):.2f}ms  p99 {percentile(0.99):.2f}ms')
@@ -0,0 +1,102 @@
+"""
+设备协议基准测试：JSON 与紧凑 MessagePack 的报文大小和解析/渲染开销
+
+    python manage.py bench_device_protocol --iterations 5000 --cabinets 8
+"""
+import io
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from apps.devices.protocol import MessagePackParser, MessagePackRenderer, packb, validate_status_report
+from apps.devices.serializers import DeviceHeartbeatSerializer, DeviceStatusReportSerializer
+
+
+class Command(BaseCommand):
+    help = '对比 JSON 与 MessagePack 设备协议的报文大小和处理耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000, help='每项测试的循环次数')
+        parser.add_argument('--cabinets', type=int, default=8, help='状态上报中的柜子数量')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        cabinet_ids = [f'A{i:03d}' for i in range(1, options['cabinets'] + 1)]
+
+        full_status = {
+            cabinet_id: {'door': True, 'lock_angle': 0, 'lock_locked': True, 'has_item': False}
+            for cabinet_id in cabinet_ids
+        }
+        compact_status = {cabinet_id: [True, 0, True, False] for cabinet_id in cabinet_ids}
+        command_response = {
+            'code': 0,
+            'message': '有待执行指令',
+            'data': {
+                'acked': 1,
+                'commands': [{
+                    'id': 1024, 'command': 'open_cabinet', 'cabinet_id': cabinet_ids[0],
+                    'order_id': 4096, 'timestamp': '2026-01-20T10:22:00.000000+08:00'
+                }]
+            }
+        }
+        cases = [
+            (
+                '心跳',
+                {'battery_level': 80},
+                {'battery_level': 80},
+                DeviceHeartbeatSerializer,
+                None,
+                {'code': 0, 'message': '心跳接收成功', 'data': {'device_id': 'ESP32-0001', 'status': 'online'}},
+            ),
+            (
+                f'状态上报({len(cabinet_ids)}柜)',
+                {'cabinet_status': full_status, 'battery_level': 80},
+                {'cabinet_status': compact_status, 'battery_level': 80},
+                DeviceStatusReportSerializer,
+                validate_status_report,
+                {'code': 0, 'message': '状态更新成功'},
+            ),
+            ('指令拉取', {'ack': [1023]}, {'ack': [1023]}, None, None, command_response),
+        ]
+
+        json_parser, json_renderer = JSONParser(), JSONRenderer()
+        msgpack_parser, msgpack_renderer = MessagePackParser(), MessagePackRenderer()
+
+        self.stdout.write(
+            f'{"场景":<16}{"格式":<10}{"请求字节":>10}{"响应字节":>10}{"解析+校验(us)":>16}{"渲染(us)":>12}'
+        )
+        for name, json_body, compact_body, serializer_class, fast_validator, response in cases:
+            json_bytes = json_renderer.render(json_body)
+            msgpack_bytes = packb(compact_body)
+
+            def parse_json():
+                data = json_parser.parse(io.BytesIO(json_bytes))
+                if serializer_class:
+                    serializer_class(data=data).is_valid()
+
+            def parse_msgpack():
+                data = msgpack_parser.parse(io.BytesIO(msgpack_bytes))
+                if fast_validator:
+                    fast_validator(data)
+                elif serializer_class:
+                    serializer_class(data=data).is_valid()
+
+            rows = [
+                ('JSON', json_bytes, parse_json, lambda: json_renderer.render(response)),
+                ('MsgPack', msgpack_bytes, parse_msgpack, lambda: msgpack_renderer.render(response)),
+            ]
+            for label, request_bytes, parse, render in rows:
+                self.stdout.write(
+                    f'{name:<16}{label:<10}{len(request_bytes):>10}{len(render()):>10}'
+                    f'{self.timeit(parse, iterations):>16.1f}{self.timeit(render, iterations):>12.1f}'
+                )
+
+    @staticmethod
+    def timeit(func, iterations):
+        """单次调用平均耗时（微秒）"""
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - start) / iterations * 1e6
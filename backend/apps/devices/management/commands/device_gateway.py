@@ -0,0 +1,36 @@
+"""
+设备数据网关：UDP/TCP 接收 MessagePack 心跳和状态上报（协议见 apps/devices/gateway.py）
+
+    python manage.py device_gateway --host 0.0.0.0 --udp-port 9100 --tcp-port 9101
+"""
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from apps.devices.gateway import DeviceGateway, serve
+
+
+class Command(BaseCommand):
+    help = '启动设备心跳/状态上报的 UDP/TCP 网关'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0', help='监听地址')
+        parser.add_argument('--udp-port', type=int, default=9100, help='UDP 端口，0 表示不监听')
+        parser.add_argument('--tcp-port', type=int, default=9101, help='TCP 端口，0 表示不监听')
+        parser.add_argument('--batch-interval', type=float, default=None, help='状态上报批量写入间隔（秒）')
+
+    def handle(self, *args, **options):
+        gateway = DeviceGateway(batch_interval=options['batch_interval'])
+
+        def ready(transport, server):
+            self.stdout.write(self.style.SUCCESS(
+                f'设备网关已启动: {options["host"]} UDP {options["udp_port"] or "-"} / TCP {options["tcp_port"] or "-"}'
+            ))
+
+        try:
+            asyncio.run(serve(gateway, options['host'], options['udp_port'], options['tcp_port'], ready))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            gateway.close()
+            self.stdout.write(f'已停止，累计: {dict(gateway.stats)}')
@@ -0,0 +1,84 @@
+"""
+从 CSV / JSON 文件批量开通设备（见 apps/devices/provisioning.py）
+
+JSON 文件格式与批量开通接口的请求体相同：
+    {"devices": [{"device_id": "...", "station": "...", "cabinet_ids": ["A001", ...]}, ...],
+     "cabinets": [{"cabinet_id": "A001", "size": "small", "location": "...", "station": "..."}, ...]}
+
+CSV 文件每行一台设备，表头: device_id,name,station,location,api_key,cabinet_ids
+（cabinet_ids 用分号分隔，api_key 留空则自动生成）；新柜子用 --cabinets 指定另一个 CSV，
+表头: cabinet_id,size,location,station,price_per_hour。
+
+    python manage.py import_devices station-12.csv --cabinets station-12-cabinets.csv --keys keys.csv
+    python manage.py import_devices station-12.json --dry-run
+"""
+import csv
+import json
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.devices.provisioning import ProvisioningError, provision
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as source:
+        return [
+            {field: value.strip() for field, value in row.items() if field and value is not None and value.strip()}
+            for row in csv.DictReader(source)
+        ]
+
+
+class Command(BaseCommand):
+    help = '从 CSV / JSON 文件批量开通设备并绑定柜子（整批校验，单个事务写入）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='设备文件（.csv 或 .json）')
+        parser.add_argument('--cabinets', help='新柜子 CSV 文件（设备文件为 CSV 时使用）')
+        parser.add_argument('--keys', help='把生成的 API 密钥写入该 CSV 文件（默认输出到标准输出）')
+        parser.add_argument('--dry-run', action='store_true', help='只校验，不写入')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        try:
+            if path.suffix.lower() == '.json':
+                with open(path, encoding='utf-8') as source:
+                    batch = json.load(source)
+                devices, cabinets = batch.get('devices', []), batch.get('cabinets', [])
+            else:
+                devices = read_csv(path)
+                for row in devices:
+                    row['cabinet_ids'] = [
+                        cabinet_id.strip() for cabinet_id in row.get('cabinet_ids', '').split(';') if cabinet_id.strip()
+                    ]
+                cabinets = read_csv(options['cabinets']) if options['cabinets'] else []
+        except (OSError, ValueError, AttributeError) as e:
+            raise CommandError(f'无法读取文件: {e}')
+
+        try:
+            result = provision(devices, cabinets, dry_run=options['dry_run'])
+        except ProvisioningError as e:
+            for error in e.errors:
+                # CSV 行号从表头之后的第 2 行开始
+                line = f'第 {error["index"] + 2} 行 ' if error['index'] is not None and path.suffix.lower() != '.json' else ''
+                self.stderr.write(f'[{error["type"]}] {line}{error["id"] or ""}: {error["errors"]}')
+            raise CommandError(f'校验失败 {len(e.errors)} 处，未写入任何数据')
+
+        action = '校验通过（未写入）' if options['dry_run'] else '已开通'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {len(result["devices"])} 台设备，新建 {result["cabinets"]} 个柜子，'
+            f'绑定 {result["bindings"]} 个柜子'
+        ))
+        if options['dry_run']:
+            return
+
+        output = open(options['keys'], 'w', newline='', encoding='utf-8') if options['keys'] else sys.stdout
+        try:
+            writer = csv.writer(output)
+            writer.writerow(['device_id', 'api_key'])
+            for device in result['devices']:
+                writer.writerow([device['device_id'], device['api_key']])
+        finally:
+            if output is not sys.stdout:
+                output.close()
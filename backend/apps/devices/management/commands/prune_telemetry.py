@@ -0,0 +1,50 @@
+"""
+删除过期的遥测数据块（见 apps/devices/telemetry.py）
+
+各层级按 DEVICE_TELEMETRY_RETENTION 保留；已删除的设备/柜子的数据块一并删除。
+建议每天低峰期执行一次：
+    python manage.py prune_telemetry
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.cabinets.models import Cabinet
+from apps.devices.models import Device, TelemetryBlock
+from apps.devices.telemetry import METRICS, TIERS, retention
+
+
+class Command(BaseCommand):
+    help = '按保留期删除过期的遥测数据块'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只统计待删除的数据块数')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = []
+        for resolution, width in TIERS:
+            keep = retention(resolution)
+            if keep is not None:
+                # 整个时间窗都已超出保留期的数据块
+                cutoff = int((now - keep).timestamp()) - resolution * width
+                expired.append(('过期', resolution, TelemetryBlock.objects.filter(tier=resolution, start__lt=cutoff)))
+
+        for metric, kind in METRICS.items():
+            model = Device if kind == 'device' else Cabinet
+            orphans = TelemetryBlock.objects.filter(metric=metric).exclude(
+                object_id__in=model.objects.values('pk')
+            )
+            expired.append(('已删除对象', metric, orphans))
+
+        total = 0
+        for reason, key, blocks in expired:
+            if options['dry_run']:
+                count = blocks.count()
+            else:
+                count, _ = blocks.delete()
+            total += count
+            if count:
+                self.stdout.write(f'{reason} {key}: {count} 个数据块')
+
+        action = '待删除' if options['dry_run'] else '已删除'
+        self.stdout.write(self.style.SUCCESS(f'{action} {total} 个数据块'))
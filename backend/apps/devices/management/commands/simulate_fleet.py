@@ -0,0 +1,469 @@
+"""
+ESP32 设备群模拟压测
+
+在本地数据库中准备一批模拟设备（编号带 --prefix 前缀）及其柜子和已支付订单，
+然后用 asyncio 模拟 N 台 ESP32 按固件的节奏访问运行中的服务：
+
+- 定时心跳、全量状态上报、指令轮询（确认已执行指令并领取新指令）；
+- 随机注入开关门、物品放入/取出事件（只上报变化的柜子）；
+- 模拟用户扫码开柜（OpenCabinetByCodeView），设备轮询到开柜指令后上报开门、关门。
+
+结束时按接口输出吞吐和 p50/p95/p99 延迟、5xx 响应数、数据库锁错误数，以及开柜指令
+从用户请求到设备领取的下发延迟。被测服务必须使用同一个数据库。请勿对生产库运行。
+
+数据库锁错误从被测服务的日志（--server-log，默认 logs/django.log）中统计运行期间新增的条数：
+关闭 DEBUG 时 500 响应不带异常信息，心跳等写缓冲在后台写回时的锁错误也不会出现在响应中。
+
+    python manage.py simulate_fleet --url http://127.0.0.1:8000 --devices 500 --duration 120
+    python manage.py simulate_fleet --cleanup
+"""
+import asyncio
+import json
+import random
+import time
+import zlib
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from apps.cabinets.availability import rebuild as rebuild_availability
+from apps.cabinets.models import Cabinet
+from apps.devices.models import Device
+from apps.orders.models import Order
+
+
+class HTTPClient:
+    """最小的 HTTP/1.1 客户端（每台模拟设备一个连接，支持 keep-alive 与服务端关闭连接）"""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def request(self, method, path, body=None, headers=None):
+        """返回 (状态码, 响应体)；同一连接上的请求依次发送"""
+        async with self._lock:
+            return await self._request(method, path, body, headers)
+
+    async def _request(self, method, path, body, headers):
+        payload = json.dumps(body).encode() if body is not None else b''
+        lines = [
+            f'{method} {path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            'Connection: keep-alive',
+            f'Content-Length: {len(payload)}',
+        ]
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+        message = ('\r\n'.join(lines) + '\r\n\r\n').encode() + payload
+
+        for attempt in range(2):
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout
+                )
+            try:
+                self._writer.write(message)
+                await self._writer.drain()
+                return await asyncio.wait_for(self._read_response(), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # 服务端已关闭空闲连接，重连后重发一次
+                self.close()
+                if attempt:
+                    raise
+            except BaseException:
+                self.close()
+                raise
+
+    async def _read_response(self):
+        status_line = await self._reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self._reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                chunk = await self._reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await self._reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self._reader.read()
+            headers['connection'] = 'close'
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, body
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+class Stats:
+    """按接口统计的请求结果"""
+
+    def __init__(self):
+        self.requests = {}
+        self.latencies = {}
+        self.errors = {}
+        self.server_errors = 0
+        self.delivery = []
+
+    async def call(self, label, client, method, path, body=None, headers=None):
+        """发送请求并记录延迟，失败（非 2xx 或连接异常）时返回 None"""
+        self.requests[label] = self.requests.get(label, 0) + 1
+        started = time.perf_counter()
+        try:
+            status, content = await client.request(method, path, body, headers)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            self.errors[label] = self.errors.get(label, 0) + 1
+            return None
+        self.latencies.setdefault(label, []).append(time.perf_counter() - started)
+        if status >= 300:
+            self.errors[label] = self.errors.get(label, 0) + 1
+            if status >= 500:
+                self.server_errors += 1
+            return None
+        try:
+            return json.loads(content)
+        except ValueError:
+            return {}
+
+
+class ServerLog:
+    """统计被测服务日志在运行期间新增的数据库锁错误（每个异常的回溯以一行 OperationalError 结尾）"""
+
+    MARKER = b'OperationalError: database is locked'
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.offset = self.path.stat().st_size if self.path.exists() else None
+
+    def count_locked(self):
+        """返回新增的锁错误数；日志不存在时返回 None"""
+        if self.offset is None or not self.path.exists():
+            return None
+        with self.path.open('rb') as log:
+            log.seek(self.offset if self.path.stat().st_size >= self.offset else 0)
+            # 链式异常的回溯中 sqlite3 原始异常与 Django 包装后的异常各有一行，只计后者
+            return sum(
+                1 for line in log
+                if line.startswith(b'django.db.utils.') and self.MARKER in line
+            )
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return 0.0, 0.0, 0.0
+    return tuple(values[min(len(values) - 1, int(len(values) * p))] * 1000 for p in (0.5, 0.95, 0.99))
+
+
+class VirtualDevice:
+    """一台模拟 ESP32"""
+
+    def __init__(self, fleet, api_key, cabinet_ids):
+        self.fleet = fleet
+        self.headers = {'X-API-Key': api_key}
+        self.client = HTTPClient(fleet.host, fleet.port, fleet.options['timeout'])
+        self.cabinets = {
+            cabinet_id: {'door': True, 'lock_angle': 0, 'lock_locked': True, 'has_item': False}
+            for cabinet_id in cabinet_ids
+        }
+        self.battery_level = random.randint(40, 100)
+        self.ack = []
+
+    async def run(self, deadline):
+        options = self.fleet.options
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # 各项任务错开启动，避免所有设备同时发起请求
+        schedule = {
+            'heartbeat': now + random.uniform(0, options['heartbeat_interval']),
+            'status': now + random.uniform(0, options['status_interval']),
+            'poll': now + random.uniform(0, options['poll_interval']),
+            'event': now + random.expovariate(1 / options['event_interval']),
+        }
+        try:
+            while True:
+                task, at = min(schedule.items(), key=lambda item: item[1])
+                if at >= deadline:
+                    break
+                await asyncio.sleep(max(at - loop.time(), 0))
+                if task == 'heartbeat':
+                    await self.heartbeat()
+                    schedule[task] = at + options['heartbeat_interval']
+                elif task == 'status':
+                    await self.report(self.cabinets)
+                    schedule[task] = at + options['status_interval']
+                elif task == 'poll':
+                    await self.poll()
+                    schedule[task] = at + options['poll_interval']
+                else:
+                    await self.inject_event()
+                    schedule[task] = at + random.expovariate(1 / options['event_interval'])
+        finally:
+            self.client.close()
+
+    async def heartbeat(self):
+        self.battery_level = max(self.battery_level - random.choice((0, 0, 0, 1)), 5)
+        await self.fleet.stats.call(
+            'heartbeat', self.client, 'POST', '/api/devices/heartbeat/',
+            {'battery_level': self.battery_level}, self.headers
+        )
+
+    async def report(self, cabinets):
+        await self.fleet.stats.call(
+            'status', self.client, 'POST', '/api/devices/status/',
+            {'cabinet_status': cabinets, 'battery_level': self.battery_level}, self.headers
+        )
+
+    async def poll(self):
+        result = await self.fleet.stats.call(
+            'poll', self.client, 'POST', '/api/devices/commands/poll/', {'ack': self.ack}, self.headers
+        )
+        if result is None:
+            return
+        self.ack = []
+        for command in result.get('data', {}).get('commands', []):
+            self.ack.append(command['id'])
+            if command['command'] == 'open_cabinet':
+                self.fleet.delivered(command.get('cabinet_id'), command.get('order_id'))
+                if command.get('cabinet_id') in self.cabinets:
+                    asyncio.ensure_future(self.open_door(command['cabinet_id']))
+
+    async def open_door(self, cabinet_id):
+        """执行开柜：上报开门，几秒后关门（物品状态随机变化）"""
+        state = self.cabinets[cabinet_id]
+        state.update(door=False, lock_angle=90, lock_locked=False)
+        await self.report({cabinet_id: state})
+        await asyncio.sleep(random.uniform(2, 6))
+        state.update(door=True, lock_angle=0, lock_locked=True, has_item=random.random() < 0.5)
+        await self.report({cabinet_id: state})
+
+    async def inject_event(self):
+        """随机的柜门或物品事件"""
+        cabinet_id = random.choice(list(self.cabinets))
+        state = self.cabinets[cabinet_id]
+        if random.random() < 0.5:
+            state['has_item'] = not state['has_item']
+            await self.report({cabinet_id: state})
+        else:
+            state['door'] = False
+            await self.report({cabinet_id: state})
+            state['door'] = True
+            await self.report({cabinet_id: state})
+
+
+class Fleet:
+    def __init__(self, options, devices, orders, token):
+        parts = urlsplit(options['url'])
+        if parts.scheme != 'http' or not parts.hostname:
+            raise CommandError('--url 只支持 http://host:port')
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.options = options
+        self.stats = Stats()
+        self.devices = [VirtualDevice(self, api_key, cabinet_ids) for api_key, cabinet_ids in devices]
+        self.orders = orders
+        self.user_headers = {'Authorization': f'Bearer {token}'}
+        self.pending_opens = {}
+        self.opens_sent = 0
+
+    def delivered(self, cabinet_id, order_id):
+        pending = self.pending_opens.get((cabinet_id, order_id))
+        if pending:
+            self.stats.delivery.append(time.perf_counter() - pending.pop(0))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.options['duration']
+        # 用户开柜先停止，设备多运行两个轮询周期以领取最后一批开柜指令
+        tasks = [
+            asyncio.ensure_future(device.run(deadline + 2 * self.options['poll_interval']))
+            for device in self.devices
+        ]
+        if self.options['open_rate'] > 0 and self.orders:
+            tasks.append(asyncio.ensure_future(self.users(deadline)))
+        await asyncio.gather(*tasks)
+
+    async def users(self, deadline):
+        """按泊松过程模拟用户扫码开柜"""
+        loop = asyncio.get_running_loop()
+        clients = [HTTPClient(self.host, self.port, self.options['timeout']) for _ in range(8)]
+        running = set()
+        while True:
+            await asyncio.sleep(random.expovariate(self.options['open_rate']))
+            if loop.time() >= deadline:
+                break
+            running.add(asyncio.ensure_future(self.open_by_code(clients[self.opens_sent % len(clients)])))
+            running = {task for task in running if not task.done()}
+        if running:
+            await asyncio.wait(running)
+        for client in clients:
+            client.close()
+
+    async def open_by_code(self, client):
+        cabinet_id, order_id, pickup_code = random.choice(self.orders)
+        self.opens_sent += 1
+        pending = self.pending_opens.setdefault((cabinet_id, order_id), [])
+        started = time.perf_counter()
+        pending.append(started)
+        result = await self.stats.call(
+            'open_by_code', client, 'POST', '/api/devices/open/by-code/',
+            {'cabinet_id': cabinet_id, 'pickup_code': pickup_code}, self.user_headers
+        )
+        if result is None and started in pending:
+            pending.remove(started)
+
+
+class Command(BaseCommand):
+    help = '模拟 ESP32 设备群访问设备接口并统计吞吐与延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='被测服务地址')
+        parser.add_argument('--devices', type=int, default=100, help='模拟设备数')
+        parser.add_argument('--cabinets', type=int, default=4, help='每台设备的柜子数')
+        parser.add_argument('--duration', type=float, default=60, help='运行时长（秒）')
+        parser.add_argument('--heartbeat-interval', type=float, default=30, help='心跳间隔（秒）')
+        parser.add_argument('--status-interval', type=float, default=300, help='全量状态上报间隔（秒）')
+        parser.add_argument('--poll-interval', type=float, default=5, help='指令轮询间隔（秒）')
+        parser.add_argument('--event-interval', type=float, default=120,
+                            help='每台设备柜门/物品事件的平均间隔（秒）')
+        parser.add_argument('--open-rate', type=float, default=1, help='全体用户每秒扫码开柜次数')
+        parser.add_argument('--timeout', type=float, default=10, help='单个请求超时（秒）')
+        parser.add_argument('--prefix', default='SIM', help='模拟数据的编号前缀')
+        parser.add_argument('--server-log', default=Path(settings.BASE_DIR) / 'logs' / 'django.log',
+                            help='被测服务的日志文件，用于统计数据库锁错误')
+        parser.add_argument('--cleanup', action='store_true', help='删除模拟数据后退出')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if options['cleanup']:
+            self.cleanup(prefix)
+            return
+        if options['devices'] < 1 or options['cabinets'] < 1:
+            raise CommandError('--devices 和 --cabinets 必须大于 0')
+
+        devices, orders, token = self.prepare(prefix, options['devices'], options['cabinets'])
+        self.stdout.write(
+            f'模拟 {len(devices)} 台设备（{len(devices) * options["cabinets"]} 个柜子）'
+            f'访问 {options["url"]}，持续 {options["duration"]:.0f} 秒...'
+        )
+        fleet = Fleet(options, devices, orders, token)
+        server_log = ServerLog(options['server_log'])
+        started = time.perf_counter()
+        asyncio.run(fleet.run())
+        self.report(fleet, time.perf_counter() - started, server_log)
+
+    @transaction.atomic
+    def prepare(self, prefix, device_count, cabinet_count):
+        """准备模拟设备、柜子、用户和已支付订单（已存在的直接复用）"""
+        User = get_user_model()
+        user, created = User.objects.get_or_create(
+            username=f'{prefix.lower()}-fleet-user', defaults={'phone': f'1990000{zlib.crc32(prefix.encode()) % 10000:04d}'}
+        )
+        if created:
+            user.set_unusable_password()
+            user.save()
+
+        device_ids = [f'{prefix}-{i:05d}' for i in range(device_count)]
+        existing = set(Device.objects.filter(device_id__in=device_ids).values_list('device_id', flat=True))
+        Device.objects.bulk_create([
+            Device(device_id=device_id, name='模拟设备', station=prefix, api_key=f'{prefix}-fleet-{device_id}')
+            for device_id in device_ids if device_id not in existing
+        ])
+
+        cabinet_ids = {
+            device_id: [f'{prefix}{i:05d}{j:02d}' for j in range(cabinet_count)]
+            for i, device_id in enumerate(device_ids)
+        }
+        all_cabinet_ids = [cabinet_id for ids in cabinet_ids.values() for cabinet_id in ids]
+        existing = set(Cabinet.objects.filter(cabinet_id__in=all_cabinet_ids).values_list('cabinet_id', flat=True))
+        Cabinet.objects.bulk_create([
+            Cabinet(cabinet_id=cabinet_id, size='medium', location='模拟', station=prefix)
+            for cabinet_id in all_cabinet_ids if cabinet_id not in existing
+        ])
+        rebuild_availability([prefix])
+
+        cabinets = {cabinet.cabinet_id: cabinet for cabinet in Cabinet.objects.filter(cabinet_id__in=all_cabinet_ids)}
+        devices = []
+        for device in Device.objects.filter(device_id__in=device_ids):
+            bound = [cabinets[cabinet_id] for cabinet_id in cabinet_ids[device.device_id]]
+            device.bound_cabinets.set(bound)
+            devices.append((device.api_key, cabinet_ids[device.device_id]))
+
+        # 每个柜子一笔已支付订单，开柜后订单变为使用中，取件码仍然有效
+        with_orders = set(
+            Order.objects.filter(user=user, status__in=['paid', 'in_use']).values_list('cabinet_id', flat=True)
+        )
+        for cabinet in cabinets.values():
+            if cabinet.pk not in with_orders:
+                Order.objects.create(user=user, cabinet=cabinet, status='paid', price_per_hour=cabinet.price_per_hour)
+        orders = list(
+            Order.objects.filter(user=user, status__in=['paid', 'in_use'], cabinet__in=cabinets.values())
+            .values_list('cabinet__cabinet_id', 'pk', 'pickup_code')
+        )
+        return devices, orders, str(RefreshToken.for_user(user).access_token)
+
+    @transaction.atomic
+    def cleanup(self, prefix):
+        User = get_user_model()
+        Order.objects.filter(user__username=f'{prefix.lower()}-fleet-user').delete()
+        devices = Device.objects.filter(station=prefix, api_key__startswith=f'{prefix}-fleet-')
+        cabinets = Cabinet.objects.filter(station=prefix, cabinet_id__startswith=prefix, location='模拟')
+        device_count = devices.delete()[1].get('devices.Device', 0)
+        cabinet_count = cabinets.delete()[1].get('cabinets.Cabinet', 0)
+        User.objects.filter(username=f'{prefix.lower()}-fleet-user').delete()
+        self.stdout.write(f'已删除 {device_count} 台模拟设备、{cabinet_count} 个模拟柜子')
+
+    def report(self, fleet, elapsed, server_log):
+        stats = fleet.stats
+        self.stdout.write(f'{"接口":<14}{"请求数":>8}{"失败":>6}{"请求/秒":>10}{"p50(ms)":>10}{"p95(ms)":>10}{"p99(ms)":>10}')
+        total = 0
+        for label in ('heartbeat', 'status', 'poll', 'open_by_code'):
+            latencies = stats.latencies.get(label, [])
+            errors = stats.errors.get(label, 0)
+            count = stats.requests.get(label, 0)
+            total += count
+            p50, p95, p99 = percentiles(latencies)
+            self.stdout.write(
+                f'{label:<14}{count:>8}{errors:>6}{len(latencies) / elapsed:>10.1f}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}'
+            )
+        completed = sum(len(values) for values in stats.latencies.values())
+        p50, p95, p99 = percentiles([value for values in stats.latencies.values() for value in values])
+        self.stdout.write(f'{"合计":<14}{total:>8}{sum(stats.errors.values()):>6}{completed / elapsed:>10.1f}'
+                          f'{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}')
+        self.stdout.write(f'服务端错误（5xx，可能由数据库锁引起）: {stats.server_errors}')
+        locked = server_log.count_locked()
+        if locked is None:
+            self.stdout.write(f'数据库锁错误: 未找到服务端日志 {server_log.path}，请用 --server-log 指定')
+        else:
+            self.stdout.write(f'数据库锁错误（database is locked，含后台写回）: {locked}')
+
+        p50, p95, p99 = percentiles(stats.delivery)
+        self.stdout.write(
+            f'开柜指令下发: 发出 {fleet.opens_sent}，设备领取 {len(stats.delivery)}，'
+            f'未领取 {sum(len(pending) for pending in fleet.pending_opens.values())}；延迟 p50 {p50:.0f}ms  p95 {p95:.0f}ms  p99 {p99:.0f}ms'
+        )
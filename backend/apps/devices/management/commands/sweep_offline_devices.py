@@ -0,0 +1,32 @@
+"""
+设备离线检测（见 apps/devices/sweeper.py）
+
+常驻运行（每台主机一个进程即可）：
+    python manage.py sweep_offline_devices
+或由定时任务单次执行：
+    python manage.py sweep_offline_devices --once
+"""
+from django.core.management.base import BaseCommand
+
+from apps.devices.sweeper import OfflineSweeper
+
+
+class Command(BaseCommand):
+    help = '按心跳超时把设备置为离线'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='只扫描一次后退出')
+        parser.add_argument('--timeout', type=int, default=None, help='离线超时（秒，默认 DEVICE_OFFLINE_TIMEOUT）')
+
+    def handle(self, *args, **options):
+        sweeper = OfflineSweeper(timeout=options['timeout'])
+        if options['once']:
+            offline = sweeper.run_once()
+            self.stdout.write(f'{len(offline)} 台设备离线')
+            return
+
+        self.stdout.write(self.style.SUCCESS(f'离线检测已启动，超时 {sweeper.timeout} 秒'))
+        try:
+            sweeper.run_forever(self.stdout)
+        except KeyboardInterrupt:
+            pass
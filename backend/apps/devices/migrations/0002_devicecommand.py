@@ -0,0 +1,35 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceCommand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(choices=[('open_cabinet', '开柜'), ('query_status', '查询状态')], max_length=20, verbose_name='指令类型')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='指令参数')),
+                ('state', models.CharField(choices=[('pending', '待下发'), ('leased', '已下发'), ('acked', '已确认'), ('expired', '已过期')], default='pending', max_length=20, verbose_name='状态')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('expires_at', models.DateTimeField(verbose_name='过期时间')),
+                ('leased_at', models.DateTimeField(blank=True, null=True, verbose_name='下发时间')),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True, verbose_name='确认截止时间')),
+                ('acked_at', models.DateTimeField(blank=True, null=True, verbose_name='确认时间')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='commands', to='devices.device', verbose_name='设备')),
+            ],
+            options={
+                'verbose_name': '设备指令',
+                'verbose_name_plural': '设备指令',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['device', 'state', 'created_at'], name='devicecmd_queue_idx')],
+            },
+        ),
+    ]
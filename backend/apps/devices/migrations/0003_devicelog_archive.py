@@ -0,0 +1,50 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0002_devicecommand'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceLogSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='日期')),
+                ('path', models.CharField(max_length=200, verbose_name='段文件')),
+                ('offset', models.BigIntegerField(verbose_name='偏移')),
+                ('length', models.IntegerField(verbose_name='长度')),
+                ('count', models.IntegerField(verbose_name='日志条数')),
+                ('first_at', models.DateTimeField(verbose_name='最早日志时间')),
+                ('last_at', models.DateTimeField(verbose_name='最晚日志时间')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='归档时间')),
+            ],
+            options={
+                'verbose_name': '设备日志归档段',
+                'verbose_name_plural': '设备日志归档段',
+                'ordering': ['-day', '-last_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='devicelog',
+            index=models.Index(fields=['device', 'created_at'], name='devicelog_device_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='devicelog',
+            index=models.Index(fields=['created_at'], name='devicelog_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='devicelogsegment',
+            name='device',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='log_segments', to='devices.device', verbose_name='设备'),
+        ),
+        migrations.AddIndex(
+            model_name='devicelogsegment',
+            index=models.Index(fields=['device', 'day'], name='devicelogseg_device_day_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0003_devicelog_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='debug_heartbeat_log',
+            field=models.BooleanField(default=False, verbose_name='记录心跳明细'),
+        ),
+        migrations.CreateModel(
+            name='DeviceHeartbeatRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='小时')),
+                ('count', models.IntegerField(default=0, verbose_name='心跳次数')),
+                ('first_seen', models.DateTimeField(blank=True, null=True, verbose_name='首次心跳')),
+                ('last_seen', models.DateTimeField(blank=True, null=True, verbose_name='最后心跳')),
+                ('battery_min', models.IntegerField(blank=True, null=True, verbose_name='最低电量')),
+                ('battery_sum', models.IntegerField(default=0, verbose_name='电量合计')),
+                ('battery_samples', models.IntegerField(default=0, verbose_name='电量样本数')),
+                ('battery_last', models.IntegerField(blank=True, null=True, verbose_name='最后电量')),
+                ('gap_count', models.IntegerField(default=0, verbose_name='中断次数')),
+                ('gap_seconds', models.FloatField(default=0, verbose_name='中断时长(秒)')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='heartbeat_rollups', to='devices.device', verbose_name='设备')),
+            ],
+            options={
+                'verbose_name': '设备心跳汇总',
+                'verbose_name_plural': '设备心跳汇总',
+                'ordering': ['-hour'],
+                'indexes': [models.Index(fields=['hour'], name='heartbeat_rollup_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('device', 'hour'), name='heartbeat_rollup_device_hour')],
+            },
+        ),
+    ]
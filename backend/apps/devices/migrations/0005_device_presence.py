@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinets', '0002_cabinet_has_item_cabinet_item_detected_at_and_more'),
+        ('devices', '0004_heartbeat_rollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='devicelog',
+            name='log_type',
+            field=models.CharField(choices=[('open', '开柜'), ('close', '关柜'), ('heartbeat', '心跳'), ('status', '状态上报'), ('error', '错误'), ('online', '上线'), ('offline', '离线')], max_length=20, verbose_name='日志类型'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['status', 'last_heartbeat'], name='device_presence_idx'),
+        ),
+    ]
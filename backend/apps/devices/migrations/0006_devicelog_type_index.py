@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0005_device_presence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='devicelog',
+            index=models.Index(fields=['device', 'log_type', 'created_at'], name='devicelog_device_type_time_idx'),
+        ),
+    ]
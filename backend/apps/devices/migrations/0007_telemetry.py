@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0006_devicelog_type_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelemetryBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(choices=[('battery', '电量'), ('lock_angle', '锁角度'), ('lock_locked', '锁状态'), ('has_item', '物品检测')], max_length=20, verbose_name='指标')),
+                ('object_id', models.BigIntegerField(verbose_name='设备/柜子主键')),
+                ('tier', models.IntegerField(verbose_name='分辨率(秒)')),
+                ('start', models.BigIntegerField(verbose_name='起始时间')),
+                ('data', models.BinaryField(verbose_name='数据')),
+            ],
+            options={
+                'verbose_name': '遥测数据块',
+                'verbose_name_plural': '遥测数据块',
+                'indexes': [models.Index(fields=['tier', 'start'], name='telemetry_block_tier_idx')],
+                'constraints': [models.UniqueConstraint(fields=('metric', 'object_id', 'tier', 'start'), name='telemetry_block_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0007_telemetry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devicecommand',
+            name='result',
+            field=models.JSONField(blank=True, null=True, verbose_name='执行结果'),
+        ),
+    ]
@@ -1,4 +1,9 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 
 
 class Device(models.Model):
@@ -32,6 +37,9 @@ class Device(models.Model):
     # 电量（如果有电池供电）
     battery_level = models.IntegerField(null=True, blank=True, verbose_name='电量百分比')
 
+    # 调试：逐条记录心跳日志（默认只写入按小时汇总的 DeviceHeartbeatRollup）
+    debug_heartbeat_log = models.BooleanField(default=False, verbose_name='记录心跳明细')
+
     # 时间戳
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
@@ -40,17 +48,39 @@ class Device(models.Model):
         verbose_name = '设备'
         verbose_name_plural = verbose_name
         ordering = ['station', 'device_id']
+        indexes = [
+            models.Index(fields=['status', 'last_heartbeat'], name='device_presence_idx'),
+        ]
 
     def __str__(self):
         return f"{self.device_id} ({self.station}) - {self.get_status_display()}"
 
+    @staticmethod
+    def heartbeat_cutoff():
+        """心跳早于该时间的设备视为离线（即使离线检测进程尚未把 status 置为 offline）"""
+        return timezone.now() - timedelta(seconds=getattr(settings, 'DEVICE_OFFLINE_TIMEOUT', 600))
+
+    @classmethod
+    def online_q(cls):
+        """在线设备的查询条件：status 为 online 且心跳未超时"""
+        return Q(status='online', last_heartbeat__gte=cls.heartbeat_cutoff())
+
+    @classmethod
+    def offline_q(cls):
+        """离线设备的查询条件：status 为 offline，或 status 为 online 但心跳已超时"""
+        return Q(status='offline') | (Q(status='online') & ~cls.online_q())
+
     def is_online(self):
-        """检查设备是否在线（5分钟内有心跳）"""
-        from django.utils import timezone
-        if not self.last_heartbeat:
-            return False
-        from datetime import timedelta
-        return timezone.now() - self.last_heartbeat < timedelta(minutes=5)
+        """检查设备是否在线（读共享内存在线状态表，表中无记录时按 status 和心跳时间判断）"""
+        from .presence import presence_table
+        online = presence_table.is_online(self.pk)
+        if online is not None:
+            return online
+        return (
+            self.status == 'online'
+            and self.last_heartbeat is not None
+            and self.last_heartbeat >= self.heartbeat_cutoff()
+        )
 
 
 class DeviceLog(models.Model):
@@ -62,6 +92,8 @@ class DeviceLog(models.Model):
         ('heartbeat', '心跳'),
         ('status', '状态上报'),
         ('error', '错误'),
+        ('online', '上线'),
+        ('offline', '离线'),
     ]
 
     device = models.ForeignKey(Device, on_delete=models.CASCADE, verbose_name='设备')
@@ -74,6 +106,166 @@ class DeviceLog(models.Model):
         verbose_name = '设备日志'
         verbose_name_plural = verbose_name
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['device', 'created_at'], name='devicelog_device_time_idx'),
+            models.Index(fields=['device', 'log_type', 'created_at'], name='devicelog_device_type_time_idx'),
+            models.Index(fields=['created_at'], name='devicelog_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.device.device_id} - {self.log_type} - {self.created_at}"
+
+
+class DeviceHeartbeatRollup(models.Model):
+    """
+    设备心跳小时汇总
+
+    由心跳写缓冲在每次写回时增量合并。两次心跳间隔超过 DEVICE_HEARTBEAT_GAP
+    秒记为一次中断，中断时长（上次心跳 + DEVICE_HEARTBEAT_GAP 到本次心跳）
+    按小时拆分计入 gap_seconds，完全无心跳的小时也会有一行（count 为 0）。
+    """
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='heartbeat_rollups', verbose_name='设备')
+    hour = models.DateTimeField(verbose_name='小时')
+    count = models.IntegerField(default=0, verbose_name='心跳次数')
+    first_seen = models.DateTimeField(null=True, blank=True, verbose_name='首次心跳')
+    last_seen = models.DateTimeField(null=True, blank=True, verbose_name='最后心跳')
+
+    # 电量
+    battery_min = models.IntegerField(null=True, blank=True, verbose_name='最低电量')
+    battery_sum = models.IntegerField(default=0, verbose_name='电量合计')
+    battery_samples = models.IntegerField(default=0, verbose_name='电量样本数')
+    battery_last = models.IntegerField(null=True, blank=True, verbose_name='最后电量')
+
+    # 中断
+    gap_count = models.IntegerField(default=0, verbose_name='中断次数')
+    gap_seconds = models.FloatField(default=0, verbose_name='中断时长(秒)')
+
+    class Meta:
+        verbose_name = '设备心跳汇总'
+        verbose_name_plural = verbose_name
+        ordering = ['-hour']
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'hour'], name='heartbeat_rollup_device_hour'),
+        ]
+        indexes = [
+            models.Index(fields=['hour'], name='heartbeat_rollup_hour_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.device.device_id} - {self.hour} ({self.count})"
+
+    @property
+    def battery_avg(self):
+        if not self.battery_samples:
+            return None
+        return round(self.battery_sum / self.battery_samples, 1)
+
+
+class DeviceLogSegment(models.Model):
+    """
+    已归档设备日志的索引
+
+    超过 DEVICE_LOG_HOT_DAYS 的日志按天移出数据库，写入 gzip 压缩的 JSON Lines
+    段文件（见 apps/devices/archive.py）。每台设备每次归档一天的日志为段文件中
+    一个独立的 gzip 成员，本表记录其位置和时间范围。
+    """
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='log_segments', verbose_name='设备')
+    day = models.DateField(verbose_name='日期')
+    path = models.CharField(max_length=200, verbose_name='段文件')
+    offset = models.BigIntegerField(verbose_name='偏移')
+    length = models.IntegerField(verbose_name='长度')
+    count = models.IntegerField(verbose_name='日志条数')
+    first_at = models.DateTimeField(verbose_name='最早日志时间')
+    last_at = models.DateTimeField(verbose_name='最晚日志时间')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='归档时间')
+
+    class Meta:
+        verbose_name = '设备日志归档段'
+        verbose_name_plural = verbose_name
+        ordering = ['-day', '-last_at']
+        indexes = [
+            models.Index(fields=['device', 'day'], name='devicelogseg_device_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.device.device_id} - {self.day} ({self.count})"
+
+
+class DeviceCommand(models.Model):
+    """设备指令队列（开柜、状态查询等待下发指令）"""
+
+    COMMAND_TYPES = [
+        ('open_cabinet', '开柜'),
+        ('query_status', '查询状态'),
+    ]
+
+    STATE_CHOICES = [
+        ('pending', '待下发'),
+        ('leased', '已下发'),
+        ('acked', '已确认'),
+        ('expired', '已过期'),
+    ]
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='commands', verbose_name='设备')
+    command = models.CharField(max_length=20, choices=COMMAND_TYPES, verbose_name='指令类型')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='指令参数')
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='pending', verbose_name='状态')
+
+    # 时间信息
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    expires_at = models.DateTimeField(verbose_name='过期时间')
+    leased_at = models.DateTimeField(null=True, blank=True, verbose_name='下发时间')
+    lease_expires_at = models.DateTimeField(null=True, blank=True, verbose_name='确认截止时间')
+    acked_at = models.DateTimeField(null=True, blank=True, verbose_name='确认时间')
+
+    # 设备回传的执行结果（状态查询：携带 query_id 的状态上报到达时写入）
+    result = models.JSONField(null=True, blank=True, verbose_name='执行结果')
+
+    class Meta:
+        verbose_name = '设备指令'
+        verbose_name_plural = verbose_name
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['device', 'state', 'created_at'], name='devicecmd_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.device.device_id} - {self.command} - {self.get_state_display()}"
+
+
+class TelemetryBlock(models.Model):
+    """
+    遥测数据块（定长数组，见 apps/devices/telemetry.py）
+
+    一个序列（指标 + 设备/柜子主键）在一个层级的一段时间窗：tier 为 0 时是最近
+    采样点的环形缓冲区（start 固定为 0），否则为分辨率 tier 秒的降采样桶，
+    start 为时间窗起点（Unix 时间，按本地时区对齐）。
+    """
+
+    METRIC_CHOICES = [
+        ('battery', '电量'),
+        ('lock_angle', '锁角度'),
+        ('lock_locked', '锁状态'),
+        ('has_item', '物品检测'),
+    ]
+
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES, verbose_name='指标')
+    object_id = models.BigIntegerField(verbose_name='设备/柜子主键')
+    tier = models.IntegerField(verbose_name='分辨率(秒)')
+    start = models.BigIntegerField(verbose_name='起始时间')
+    data = models.BinaryField(verbose_name='数据')
+
+    class Meta:
+        verbose_name = '遥测数据块'
+        verbose_name_plural = verbose_name
+        constraints = [
+            models.UniqueConstraint(fields=['metric', 'object_id', 'tier', 'start'], name='telemetry_block_key'),
+        ]
+        indexes = [
+            models.Index(fields=['tier', 'start'], name='telemetry_block_tier_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.metric} #{self.object_id} - {self.tier}s @ {self.start}"
@@ -0,0 +1,166 @@
+"""
+设备指令到达 / 指令结果回传通知
+
+长轮询请求和设备 WebSocket 连接按设备订阅。指令入队后通过消息代理
+（见 broker.py）广播，持有该设备等待者的进程立即唤醒对应请求/连接。
+代理投递失败时，由后台线程定期批量检查（一次查询覆盖本进程所有
+等待中的设备）兜底，延迟不超过 DEVICE_LONGPOLL_RECHECK_INTERVAL 秒。
+
+等待状态查询结果的管理员请求按指令ID订阅 reply_notifier，设备回传结果后
+同样经消息代理唤醒；兜底检查由等待方自己按 DEVICE_LONGPOLL_RECHECK_INTERVAL 进行。
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .broker import get_broker
+
+logger = logging.getLogger(__name__)
+
+COMMAND_CHANNEL = 'device-commands'
+REPLY_CHANNEL = 'device-command-replies'
+
+
+class CommandNotifier:
+    """按设备唤醒等待中的长轮询请求和 WebSocket 连接"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._watcher = None
+        self._watcher_pid = None
+
+    @property
+    def recheck_interval(self):
+        return getattr(settings, 'DEVICE_LONGPOLL_RECHECK_INTERVAL', 0.5)
+
+    @contextmanager
+    def subscribe(self, device_pk):
+        """在当前事件循环中订阅设备指令，返回 asyncio.Event"""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.setdefault(device_pk, set()).add(waiter)
+        self._ensure_watcher()
+        try:
+            yield waiter[1]
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(device_pk)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[device_pk]
+
+    def notify(self, device_pk):
+        """广播设备有新指令（可在任意进程、任意线程调用）"""
+        get_broker().publish(COMMAND_CHANNEL, {'device': device_pk})
+
+    def _on_message(self, message):
+        self.wake(message.get('device'))
+
+    def wake(self, device_pk):
+        """唤醒本进程内等待该设备指令的请求"""
+        with self._lock:
+            waiters = list(self._waiters.get(device_pk, ()))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # 事件循环已关闭，订阅方会在退出时自行清理
+                pass
+
+    def waiting_devices(self):
+        with self._lock:
+            return list(self._waiters)
+
+    def _ensure_watcher(self):
+        pid = os.getpid()
+        if self._watcher_pid == pid and self._watcher.is_alive():
+            return
+        with self._lock:
+            if self._watcher_pid == pid and self._watcher.is_alive():
+                return
+            get_broker().subscribe(COMMAND_CHANNEL, self._on_message)
+            self._watcher = threading.Thread(target=self._watch, name='command-watcher', daemon=True)
+            self._watcher_pid = pid
+            self._watcher.start()
+
+    def _watch(self):
+        """批量检查等待中设备是否有其他进程入队的指令"""
+        from .models import DeviceCommand
+
+        while True:
+            time.sleep(self.recheck_interval)
+            device_pks = self.waiting_devices()
+            if not device_pks:
+                continue
+            try:
+                close_old_connections()
+                ready = set(DeviceCommand.objects.filter(
+                    device_id__in=device_pks, state='pending', expires_at__gt=timezone.now()
+                ).values_list('device_id', flat=True))
+            except Exception:
+                logger.exception('指令检查失败')
+                continue
+            for device_pk in ready:
+                self.wake(device_pk)
+
+
+command_notifier = CommandNotifier()
+
+
+class ReplyNotifier:
+    """按指令ID唤醒等待设备回传结果的请求"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._subscribed_pid = None
+
+    @contextmanager
+    def subscribe(self, command_id):
+        """在当前事件循环中订阅指令结果，返回 asyncio.Event"""
+        self._ensure_subscribed()
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.setdefault(command_id, set()).add(waiter)
+        try:
+            yield waiter[1]
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(command_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[command_id]
+
+    def notify(self, command_id):
+        """广播指令已有结果（可在任意进程、任意线程调用）"""
+        get_broker().publish(REPLY_CHANNEL, {'command': command_id})
+
+    def _on_message(self, message):
+        with self._lock:
+            waiters = list(self._waiters.get(message.get('command'), ()))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass
+
+    def _ensure_subscribed(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._subscribed_pid == pid:
+                return
+            self._subscribed_pid = pid
+        get_broker().subscribe(REPLY_CHANNEL, self._on_message)
+
+
+reply_notifier = ReplyNotifier()
@@ -0,0 +1,461 @@
+"""
+设备在线状态共享内存表（同一主机上的所有工作进程共享）
+
+表是一个 mmap 映射的定长文件（DEVICE_PRESENCE_PATH），文件头之后是
+DEVICE_PRESENCE_SLOTS 个定长槽位，设备主键 N 固定占用第 N-1 个槽位：
+
+    seq(uint32) pk(uint32) last_heartbeat(double) battery(int16) status(uint8) is_active(uint8)
+
+读取无锁：每个槽位用序号锁（seqlock）保护，写入前后各把 seq 加一，
+读到奇数 seq 或前后 seq 不一致时重读。
+
+写入（包括每次心跳的 beat()）不是无锁的，而是串行执行：先取进程内的线程锁
+（整个进程共用一把，同一进程内的所有写入依次进行），再对该槽位加 fcntl 记录锁
+（不同进程写不同设备时互不等待，写同一设备时依次进行）。seqlock 要求每个槽位
+只有一个写者，而 Python 无法对共享内存做原子比较交换，只能由锁来保证。
+每次写入因此多两次 fcntl 系统调用，槽位锁只在写入期间持有，不跨越 I/O。
+
+数据来源：
+- 心跳到达时立即写入（不等写缓冲落库）；
+- 设备上线/离线事件（device_status_changed 信号、其他主机经消息代理广播）；
+- 设备在后台被修改或删除（signals.py）；
+- 首次读取时从数据库全量初始化；gunicorn 主进程启动时清空，使每次部署重新初始化。
+
+读取时心跳已超过 DEVICE_OFFLINE_TIMEOUT 的在线记录按离线返回，离线检测进程
+（sweep_offline_devices）尚未运行或落后时读取方也不会把失联设备当作在线。
+
+表不可用（未配置路径、平台不支持 fcntl）、设备主键超出槽位数时，
+读取接口返回 None，调用方回退到数据库查询。
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'WLPR'
+VERSION = 1
+
+# magic, version, 保留, 槽位数, 已初始化, 最高使用槽位+1, 存在超出槽位的设备, 初始化时间
+HEADER = struct.Struct('<4sHHIIIId')
+HEADER_SIZE = 64
+SLOT = struct.Struct('<IIdhBB4x')
+
+STATUS_CODES = {'online': 1, 'offline': 2, 'error': 3}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+
+def presence_path():
+    path = getattr(settings, 'DEVICE_PRESENCE_PATH', Path(settings.BASE_DIR) / 'run' / 'presence.bin')
+    return Path(path) if path else None
+
+
+def _battery(value):
+    """电量转换为槽位中的 int16（-1 表示未知），无法转换的值视为未知"""
+    if value is None or isinstance(value, bool):
+        return -1
+    try:
+        return max(min(int(value), 32767), -1)
+    except (TypeError, ValueError, OverflowError):
+        return -1
+
+
+def _stale_before():
+    """心跳早于该时间戳的在线记录视为离线"""
+    return time.time() - getattr(settings, 'DEVICE_OFFLINE_TIMEOUT', 600)
+
+
+def _effective_status(status, last_heartbeat, stale_before):
+    """心跳超时的在线记录按离线处理（离线检测进程尚未写入离线状态）"""
+    if status == STATUS_CODES['online'] and last_heartbeat < stale_before:
+        return STATUS_CODES['offline']
+    return status
+
+
+def _to_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc) if timestamp else None
+
+
+class PresenceTable:
+    """设备在线状态表"""
+
+    def __init__(self, path=None, slots=None):
+        self._path = path
+        self._slots = slots
+        self._lock = threading.RLock()
+        self._pid = None
+        self._fd = None
+        self._mm = None
+        self._subscribed_pid = None
+
+    @property
+    def slots(self):
+        return self._slots or getattr(settings, 'DEVICE_PRESENCE_SLOTS', 65536)
+
+    @property
+    def size(self):
+        return HEADER_SIZE + self.slots * SLOT.size
+
+    # ---- 写入 ----
+
+    def beat(self, device_pk, at, battery_level=None):
+        """记录一次心跳：置为在线并更新心跳时间、电量"""
+        index = self._index(device_pk)
+        if index is None:
+            return
+        timestamp = at.timestamp()
+        level = _battery(battery_level)
+        with self._slot_locked(index):
+            _, pk, last_heartbeat, battery, _, is_active = self._read_raw(index)
+            if pk != device_pk:
+                last_heartbeat, battery, is_active = 0.0, -1, 1
+            self._write(index, device_pk, max(last_heartbeat, timestamp),
+                        battery if level < 0 else level, STATUS_CODES['online'], is_active)
+        self._touch(index)
+
+    def set_status(self, device_pks, status, at=None):
+        """
+        批量设置在线状态
+
+        置为离线时跳过在 at - DEVICE_OFFLINE_TIMEOUT 之后（按本表）仍有心跳的设备，
+        避免离线检测基于已落后的数据库心跳时间覆盖刚到达的心跳。
+        """
+        if self._open() is None:
+            return
+        code = STATUS_CODES[status]
+        stale_before = None
+        if status == 'offline':
+            at = at.timestamp() if at is not None else time.time()
+            stale_before = at - getattr(settings, 'DEVICE_OFFLINE_TIMEOUT', 600)
+        for device_pk in device_pks:
+            index = self._index(device_pk)
+            if index is None:
+                continue
+            with self._slot_locked(index):
+                _, pk, last_heartbeat, battery, _, is_active = self._read_raw(index)
+                if pk != device_pk:
+                    # 尚未登记的设备等待初始化或下一次同步
+                    continue
+                if stale_before is not None and last_heartbeat >= stale_before:
+                    continue
+                self._write(index, pk, last_heartbeat, battery, code, is_active)
+
+    def sync(self, device):
+        """按设备对象写入完整记录（后台修改设备后调用）"""
+        index = self._index(device.pk)
+        if index is None:
+            return
+        timestamp = device.last_heartbeat.timestamp() if device.last_heartbeat else 0.0
+        code = STATUS_CODES.get(device.status, STATUS_CODES['offline'])
+        battery = _battery(device.battery_level)
+        with self._slot_locked(index):
+            _, pk, last_heartbeat, _, status, _ = self._read_raw(index)
+            if pk == device.pk and last_heartbeat > timestamp:
+                # 本表中有尚未写回数据库的心跳
+                timestamp, code = last_heartbeat, status
+            self._write(index, device.pk, timestamp, battery, code, int(device.is_active))
+        self._touch(index)
+
+    def discard(self, device_pk):
+        index = self._index(device_pk)
+        if index is None:
+            return
+        with self._slot_locked(index):
+            if self._read_raw(index)[1] == device_pk:
+                self._write(index, 0, 0.0, -1, 0, 0)
+
+    def seed(self, force=False):
+        """从数据库初始化（已初始化且 force=False 时跳过），返回写入的设备数"""
+        from .models import Device
+
+        mm = self._open()
+        if mm is None:
+            return 0
+        with self._header_locked():
+            header = self._header()
+            if header['seeded'] and not force:
+                return 0
+            count = 0
+            high = header['high']
+            overflow = False
+            for pk, last_heartbeat, battery_level, status, is_active in Device.objects.values_list(
+                'pk', 'last_heartbeat', 'battery_level', 'status', 'is_active'
+            ).iterator():
+                index = pk - 1
+                if index >= self.slots:
+                    overflow = True
+                    continue
+                timestamp = last_heartbeat.timestamp() if last_heartbeat else 0.0
+                code = STATUS_CODES.get(status, STATUS_CODES['offline'])
+                with self._slot_locked(index):
+                    _, current_pk, current_heartbeat, _, current_status, _ = self._read_raw(index)
+                    if current_pk == pk and current_heartbeat > timestamp:
+                        # 初始化期间到达的心跳
+                        timestamp, code = current_heartbeat, current_status
+                    self._write(index, pk, timestamp, _battery(battery_level), code, int(is_active))
+                high = max(high, index + 1)
+                count += 1
+            self._write_header(seeded=1, high=high, overflow=int(overflow or header['overflow']),
+                               seeded_at=time.time())
+        return count
+
+    def reset(self):
+        """清空整张表（下一次读取时重新初始化）"""
+        mm = self._open(subscribe=False)
+        if mm is None:
+            return
+        with self._header_locked():
+            mm[HEADER_SIZE:self.size] = bytes(self.size - HEADER_SIZE)
+            self._write_header(seeded=0, high=0, overflow=0, seeded_at=0.0)
+
+    # ---- 读取 ----
+
+    def get(self, device_pk):
+        """返回设备记录 dict；表不可用或设备未登记时返回 None"""
+        index = self._index(device_pk)
+        if index is None or not self._ensure_seeded():
+            return None
+        _, pk, last_heartbeat, battery, status, is_active = self._read(index)
+        if pk != device_pk:
+            return None
+        status = _effective_status(status, last_heartbeat, _stale_before())
+        return {
+            'status': STATUS_NAMES.get(status),
+            'last_heartbeat': _to_datetime(last_heartbeat),
+            'battery_level': None if battery < 0 else battery,
+            'is_active': bool(is_active),
+        }
+
+    def is_online(self, device_pk):
+        """设备是否在线；无法从本表判断时返回 None"""
+        entry = self.get(device_pk)
+        return None if entry is None else entry['status'] == 'online'
+
+    def counts(self, active_only=False):
+        """各状态设备数 {'total', 'online', 'offline', 'error'}；表不完整时返回 None"""
+        records = self._scan()
+        if records is None:
+            return None
+        stale_before = _stale_before()
+        counts = {'total': 0, 'online': 0, 'offline': 0, 'error': 0}
+        for _, last_heartbeat, _, status, is_active in records:
+            if active_only and not is_active:
+                continue
+            counts['total'] += 1
+            counts[STATUS_NAMES[_effective_status(status, last_heartbeat, stale_before)]] += 1
+        return counts
+
+    def select(self, status=None, battery_below=None, active_only=True):
+        """按状态或电量筛选设备主键；表不完整时返回 None"""
+        records = self._scan()
+        if records is None:
+            return None
+        code = STATUS_CODES[status] if status else None
+        stale_before = _stale_before()
+        return [
+            pk for pk, last_heartbeat, battery, record_status, is_active in records
+            if (not active_only or is_active)
+            and (code is None or _effective_status(record_status, last_heartbeat, stale_before) == code)
+            and (battery_below is None or 0 <= battery < battery_below)
+        ]
+
+    # ---- 内部实现 ----
+
+    def _index(self, device_pk):
+        if device_pk is None or self._open() is None:
+            return None
+        index = device_pk - 1
+        if not 0 <= index < self.slots:
+            self._mark_overflow()
+            return None
+        return index
+
+    def _offset(self, index):
+        return HEADER_SIZE + index * SLOT.size
+
+    def _read_raw(self, index):
+        return SLOT.unpack_from(self._mm, self._offset(index))
+
+    def _read(self, index):
+        """按 seqlock 读取一个槽位"""
+        offset = self._offset(index)
+        while True:
+            record = SLOT.unpack_from(self._mm, offset)
+            if record[0] % 2 == 0 and struct.unpack_from('<I', self._mm, offset)[0] == record[0]:
+                return record
+            time.sleep(0)
+
+    def _write(self, index, pk, last_heartbeat, battery, status, is_active):
+        """写入一个槽位（调用方持有该槽位的锁）"""
+        # 先打包再改 seq：打包失败时槽位保持原样，不会留下奇数 seq
+        data = SLOT.pack(0, pk, last_heartbeat, _battery(battery), status, is_active)[4:]
+        offset = self._offset(index)
+        seq = struct.unpack_from('<I', self._mm, offset)[0]
+        struct.pack_into('<I', self._mm, offset, (seq + 1) & 0xFFFFFFFF)
+        self._mm[offset + 4:offset + SLOT.size] = data
+        struct.pack_into('<I', self._mm, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def _scan(self):
+        """读取所有已使用槽位，返回 [(pk, last_heartbeat, battery, status, is_active), ...]"""
+        if self._open() is None or not self._ensure_seeded():
+            return None
+        header = self._header()
+        if header['overflow']:
+            return None
+        end = HEADER_SIZE + header['high'] * SLOT.size
+        snapshot = self._mm[HEADER_SIZE:end]
+        # 复制期间有写入的槽位（两次复制不一致或 seq 为奇数）单独重读
+        changed = snapshot != self._mm[HEADER_SIZE:end]
+        records = []
+        for index, record in enumerate(SLOT.iter_unpack(snapshot)):
+            if record[0] % 2 or changed:
+                record = self._read(index)
+            if record[1]:
+                records.append(record[1:])
+        return records
+
+    def _ensure_seeded(self):
+        if not self._header()['seeded']:
+            try:
+                self.seed()
+            except Exception:
+                logger.exception('设备在线状态表初始化失败')
+                return False
+        return True
+
+    def _touch(self, index):
+        """记录最高使用槽位，供扫描时截断"""
+        if index < self._header()['high']:
+            return
+        with self._header_locked():
+            header = self._header()
+            if index >= header['high']:
+                self._write_header(high=index + 1)
+
+    def _mark_overflow(self):
+        if self._header()['overflow']:
+            return
+        with self._header_locked():
+            self._write_header(overflow=1)
+
+    def _header(self):
+        magic, version, _, slots, seeded, high, overflow, seeded_at = HEADER.unpack_from(self._mm, 0)
+        return {'seeded': seeded, 'high': high, 'overflow': overflow, 'seeded_at': seeded_at}
+
+    def _write_header(self, **values):
+        header = self._header()
+        header.update(values)
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, 0, self.slots,
+                         header['seeded'], header['high'], header['overflow'], header['seeded_at'])
+
+    def _header_locked(self):
+        return _RangeLock(self, 0, HEADER_SIZE)
+
+    def _slot_locked(self, index):
+        return _RangeLock(self, self._offset(index), SLOT.size)
+
+    def _open(self, subscribe=True):
+        """按进程打开并映射表文件；表不可用时返回 None"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._mm
+        with self._lock:
+            if self._pid == pid:
+                return self._mm
+            self._mm = None
+            path = self._path or presence_path()
+            if path is not None and fcntl is not None:
+                try:
+                    self._mm = self._map(Path(path))
+                except OSError:
+                    logger.exception('无法打开设备在线状态表: %s', path)
+            self._pid = pid
+        if self._mm is not None and subscribe:
+            self._ensure_subscribed()
+        return self._mm
+
+    def _map(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+            try:
+                header = os.pread(fd, HEADER.size, 0)
+                valid = (
+                    len(header) == HEADER.size
+                    and HEADER.unpack(header)[:2] == (MAGIC, VERSION)
+                    and HEADER.unpack(header)[3] == self.slots
+                    and os.fstat(fd).st_size == self.size
+                )
+                if not valid:
+                    # 新文件或槽位数变化：重建（未初始化状态）
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self.size)
+                    os.pwrite(fd, HEADER.pack(MAGIC, VERSION, 0, self.slots, 0, 0, 0, 0.0), 0)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+            mm = mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        except Exception:
+            os.close(fd)
+            raise
+        if self._fd is not None:
+            # fork 前父进程打开的描述符
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+        self._fd = fd
+        return mm
+
+    def _ensure_subscribed(self):
+        """订阅其他主机的上线/离线广播（本主机的事件已经直接写入，重复写入无副作用）"""
+        from .broker import get_broker
+        from .services import STATUS_CHANNEL
+
+        pid = os.getpid()
+        with self._lock:
+            if self._subscribed_pid == pid:
+                return
+            self._subscribed_pid = pid
+        get_broker().subscribe(STATUS_CHANNEL, self._on_message)
+
+    def _on_message(self, message):
+        self.set_status(message.get('devices', ()), message['status'])
+
+
+class _RangeLock:
+    """进程内线程锁 + 文件区间的 fcntl 记录锁"""
+
+    def __init__(self, table, offset, length):
+        self.table = table
+        self.offset = offset
+        self.length = length
+
+    def __enter__(self):
+        self.table._lock.acquire()
+        try:
+            fcntl.lockf(self.table._fd, fcntl.LOCK_EX, self.length, self.offset)
+        except BaseException:
+            self.table._lock.release()
+            raise
+
+    def __exit__(self, *exc_info):
+        try:
+            fcntl.lockf(self.table._fd, fcntl.LOCK_UN, self.length, self.offset)
+        finally:
+            self.table._lock.release()
+
+
+presence_table = PresenceTable()
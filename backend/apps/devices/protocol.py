@@ -0,0 +1,345 @@
+"""
+ESP32 紧凑二进制协议（MessagePack）
+
+设备接口除 JSON 外支持 application/msgpack：
+- 请求体 Content-Type: application/msgpack 时按 MessagePack 解析；
+- Accept: application/msgpack 时以 MessagePack 返回，并使用紧凑响应
+  格式（去掉设备端不使用的 message 文本）。
+
+状态上报的柜子状态在紧凑格式下可写成定长数组
+[door, lock_angle, lock_locked, has_item]，并跳过 DRF 嵌套序列化器，
+由 validate_status_report 直接校验。
+
+编解码器为 MessagePack 规范的子集实现（nil/bool/int/float/str/bin/array/map），
+不依赖第三方库。
+"""
+import datetime
+import decimal
+import struct
+import uuid
+
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+
+MEDIA_TYPE = 'application/msgpack'
+
+
+class MessagePackError(ValueError):
+    pass
+
+
+# ============================================
+# 编解码
+# ============================================
+
+def _default(obj):
+    """与 DRF JSONEncoder 一致的类型转换"""
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    raise MessagePackError(f'无法编码的类型: {type(obj).__name__}')
+
+
+def _pack(obj, out):
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -32 <= obj < 0:
+            out.append(obj & 0xff)
+        elif 0 <= obj <= 0xff:
+            out += struct.pack('>BB', 0xcc, obj)
+        elif 0 <= obj <= 0xffff:
+            out += struct.pack('>BH', 0xcd, obj)
+        elif 0 <= obj <= 0xffffffff:
+            out += struct.pack('>BI', 0xce, obj)
+        elif 0 <= obj <= 0xffffffffffffffff:
+            out += struct.pack('>BQ', 0xcf, obj)
+        elif -0x80 <= obj < 0:
+            out += struct.pack('>Bb', 0xd0, obj)
+        elif -0x8000 <= obj < 0:
+            out += struct.pack('>Bh', 0xd1, obj)
+        elif -0x80000000 <= obj < 0:
+            out += struct.pack('>Bi', 0xd2, obj)
+        elif -0x8000000000000000 <= obj < 0:
+            out += struct.pack('>Bq', 0xd3, obj)
+        else:
+            raise MessagePackError('整数超出范围')
+    elif isinstance(obj, float):
+        out += struct.pack('>Bd', 0xcb, obj)
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8')
+        size = len(data)
+        if size < 32:
+            out.append(0xa0 | size)
+        elif size <= 0xff:
+            out += struct.pack('>BB', 0xd9, size)
+        elif size <= 0xffff:
+            out += struct.pack('>BH', 0xda, size)
+        else:
+            out += struct.pack('>BI', 0xdb, size)
+        out += data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        data = bytes(obj)
+        size = len(data)
+        if size <= 0xff:
+            out += struct.pack('>BB', 0xc4, size)
+        elif size <= 0xffff:
+            out += struct.pack('>BH', 0xc5, size)
+        else:
+            out += struct.pack('>BI', 0xc6, size)
+        out += data
+    elif isinstance(obj, (list, tuple)):
+        size = len(obj)
+        if size < 16:
+            out.append(0x90 | size)
+        elif size <= 0xffff:
+            out += struct.pack('>BH', 0xdc, size)
+        else:
+            out += struct.pack('>BI', 0xdd, size)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        size = len(obj)
+        if size < 16:
+            out.append(0x80 | size)
+        elif size <= 0xffff:
+            out += struct.pack('>BH', 0xde, size)
+        else:
+            out += struct.pack('>BI', 0xdf, size)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        _pack(_default(obj), out)
+
+
+def packb(obj):
+    """编码为 MessagePack 字节串"""
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+# 定长类型: 标记字节 -> (struct 格式, 字节数)
+_FIXED = {
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+}
+# 变长类型的长度前缀: 标记字节 -> (struct 格式, 字节数)
+_STR = {0xd9: ('>B', 1), 0xda: ('>H', 2), 0xdb: ('>I', 4)}
+_BIN = {0xc4: ('>B', 1), 0xc5: ('>H', 2), 0xc6: ('>I', 4)}
+_ARRAY = {0xdc: ('>H', 2), 0xdd: ('>I', 4)}
+_MAP = {0xde: ('>H', 2), 0xdf: ('>I', 4)}
+
+
+def _unpack(data, pos, depth):
+    if depth > 32:
+        raise MessagePackError('嵌套层级过深')
+    try:
+        marker = data[pos]
+    except IndexError:
+        raise MessagePackError('数据不完整')
+    pos += 1
+
+    if marker < 0x80:
+        return marker, pos
+    if marker >= 0xe0:
+        return marker - 0x100, pos
+    if 0xa0 <= marker <= 0xbf:
+        return _read_str(data, pos, marker & 0x1f)
+    if 0x90 <= marker <= 0x9f:
+        return _read_array(data, pos, marker & 0x0f, depth)
+    if 0x80 <= marker <= 0x8f:
+        return _read_map(data, pos, marker & 0x0f, depth)
+    if marker == 0xc0:
+        return None, pos
+    if marker == 0xc2:
+        return False, pos
+    if marker == 0xc3:
+        return True, pos
+    if marker in _FIXED:
+        fmt, size = _FIXED[marker]
+        return _read(data, pos, fmt, size)
+    if marker in _STR:
+        size, pos = _read(data, pos, *_STR[marker])
+        return _read_str(data, pos, size)
+    if marker in _BIN:
+        size, pos = _read(data, pos, *_BIN[marker])
+        end = pos + size
+        if end > len(data):
+            raise MessagePackError('数据不完整')
+        return bytes(data[pos:end]), end
+    if marker in _ARRAY:
+        size, pos = _read(data, pos, *_ARRAY[marker])
+        return _read_array(data, pos, size, depth)
+    if marker in _MAP:
+        size, pos = _read(data, pos, *_MAP[marker])
+        return _read_map(data, pos, size, depth)
+    raise MessagePackError(f'不支持的类型标记: 0x{marker:02x}')
+
+
+def _read(data, pos, fmt, size):
+    end = pos + size
+    if end > len(data):
+        raise MessagePackError('数据不完整')
+    return struct.unpack_from(fmt, data, pos)[0], end
+
+
+def _read_str(data, pos, size):
+    end = pos + size
+    if end > len(data):
+        raise MessagePackError('数据不完整')
+    try:
+        return bytes(data[pos:end]).decode('utf-8'), end
+    except UnicodeDecodeError:
+        raise MessagePackError('字符串不是有效的 UTF-8')
+
+
+def _read_array(data, pos, size, depth):
+    items = []
+    for _ in range(size):
+        item, pos = _unpack(data, pos, depth + 1)
+        items.append(item)
+    return items, pos
+
+
+def _read_map(data, pos, size, depth):
+    result = {}
+    for _ in range(size):
+        key, pos = _unpack(data, pos, depth + 1)
+        value, pos = _unpack(data, pos, depth + 1)
+        if isinstance(key, (list, dict)):
+            raise MessagePackError('键类型无效')
+        result[key] = value
+    return result, pos
+
+
+def unpackb(data):
+    """解码 MessagePack 字节串"""
+    value, pos = _unpack(data, 0, 0)
+    if pos != len(data):
+        raise MessagePackError('数据末尾有多余字节')
+    return value
+
+
+# ============================================
+# DRF 解析器 / 渲染器
+# ============================================
+
+class MessagePackParser(BaseParser):
+    """application/msgpack 请求体解析"""
+    media_type = MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return unpackb(stream.read())
+        except MessagePackError as exc:
+            raise ParseError(f'MessagePack 解析失败: {exc}')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """application/msgpack 紧凑响应（不含 message 文本）"""
+    media_type = MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return packb(compact_response(data))
+
+
+def compact_response(data):
+    """紧凑响应格式：去掉顶层面向人的 message 文本"""
+    if isinstance(data, dict) and 'message' in data:
+        return {key: value for key, value in data.items() if key != 'message'}
+    return data
+
+
+def is_msgpack_request(request):
+    return (request.content_type or '').split(';')[0].strip() == MEDIA_TYPE
+
+
+# ============================================
+# 紧凑状态上报校验
+# ============================================
+
+CABINET_FIELDS = ('door', 'lock_angle', 'lock_locked', 'has_item')
+
+
+def validate_status_report(data):
+    """
+    校验状态上报（规则与 DeviceStatusReportSerializer 一致，不经过 DRF 字段）
+
+    柜子状态既可以是 {"door": ..., ...} 也可以是 [door, lock_angle, lock_locked, has_item]。
+    返回 (validated_data, errors)，校验通过时 errors 为 None。
+    """
+    if not isinstance(data, dict):
+        return None, {'non_field_errors': ['数据格式错误']}
+
+    errors = {}
+    cabinet_status = data.get('cabinet_status')
+    validated_status = {}
+    if not isinstance(cabinet_status, dict):
+        errors['cabinet_status'] = ['该字段是必填项。' if cabinet_status is None else '需要字典类型']
+    else:
+        for cabinet_id, entry in cabinet_status.items():
+            if isinstance(entry, (list, tuple)):
+                entry = dict(zip(CABINET_FIELDS, entry)) if len(entry) == len(CABINET_FIELDS) else None
+            if not isinstance(entry, dict):
+                errors.setdefault('cabinet_status', {})[cabinet_id] = ['柜子状态格式错误']
+                continue
+            entry_errors = {}
+            for field in ('door', 'lock_locked', 'has_item'):
+                if not isinstance(entry.get(field), bool):
+                    entry_errors[field] = ['必须是布尔值']
+            angle = entry.get('lock_angle')
+            if isinstance(angle, bool) or not isinstance(angle, int) or not 0 <= angle <= 360:
+                entry_errors['lock_angle'] = ['必须是 0-360 的整数']
+            if entry_errors:
+                errors.setdefault('cabinet_status', {})[cabinet_id] = entry_errors
+            else:
+                validated_status[str(cabinet_id)] = {field: entry[field] for field in CABINET_FIELDS}
+
+    battery_level = data.get('battery_level')
+    if battery_level is not None and (
+        isinstance(battery_level, bool) or not isinstance(battery_level, int) or not 0 <= battery_level <= 100
+    ):
+        errors['battery_level'] = ['必须是 0-100 的整数']
+
+    reported_hash = data.get('state_hash')
+    if reported_hash is not None and not (
+        isinstance(reported_hash, str) and len(reported_hash) == 8 and all(c in '0123456789abcdef' for c in reported_hash)
+    ):
+        errors['state_hash'] = ['必须是 8 位小写十六进制']
+
+    query_id = data.get('query_id')
+    if query_id is not None and (isinstance(query_id, bool) or not isinstance(query_id, int) or query_id < 1):
+        errors['query_id'] = ['必须是正整数']
+
+    if errors:
+        return None, errors
+    return {
+        'cabinet_status': validated_status, 'battery_level': battery_level,
+        'state_hash': reported_hash, 'query_id': query_id,
+    }, None
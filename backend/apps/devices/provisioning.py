@@ -0,0 +1,203 @@
+"""
+设备批量开通（DeviceViewSet.bulk 与 manage.py import_devices 共用）
+
+一批数据包含新设备及其绑定柜子编号，以及可选的新柜子。整批先在内存中校验
+（唯一性只用每类一条 IN 查询核对数据库），有任何一行出错则整批不写入并返回
+逐行错误；全部通过后在一个事务内 bulk_create 柜子（及其初始状态事件、快照）、
+设备和绑定关系（中间表）。
+"""
+import uuid
+
+from django.db import IntegrityError, transaction
+from rest_framework import serializers
+
+from apps.cabinets import history
+from apps.cabinets.availability import rebuild as rebuild_availability
+from apps.cabinets.models import Cabinet
+from apps.cabinets.stations import ensure_stations
+from waylink.responsecache import purge_on_commit
+
+from .models import Device
+from .presence import presence_table
+
+MAX_ROWS = 5000
+
+
+def generate_api_key():
+    return uuid.uuid4().hex
+
+
+class ProvisioningError(Exception):
+    """批量开通校验失败，errors 为逐行错误列表"""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+class DeviceRowSerializer(serializers.ModelSerializer):
+    """批量开通的设备行（唯一性整批核对，不逐行查询）"""
+    cabinet_ids = serializers.ListField(child=serializers.CharField(max_length=20), required=False)
+
+    class Meta:
+        model = Device
+        fields = ('device_id', 'name', 'station', 'location', 'api_key', 'cabinet_ids')
+        extra_kwargs = {
+            'device_id': {'validators': []},
+            'api_key': {'validators': [], 'required': False, 'allow_blank': True},
+        }
+
+
+class CabinetRowSerializer(serializers.ModelSerializer):
+    """批量开通的柜子行"""
+
+    class Meta:
+        model = Cabinet
+        fields = ('cabinet_id', 'size', 'location', 'station', 'price_per_hour')
+        extra_kwargs = {'cabinet_id': {'validators': []}}
+
+
+def _row_error(errors, kind, index, key, detail):
+    errors.append({'type': kind, 'index': index, 'id': key, 'errors': detail})
+
+
+def _validate_rows(rows, serializer_class, kind, key_field, errors):
+    valid = []
+    for index, row in enumerate(rows):
+        serializer = serializer_class(data=row)
+        if serializer.is_valid():
+            valid.append((index, dict(serializer.validated_data)))
+        else:
+            key = row.get(key_field) if isinstance(row, dict) else None
+            _row_error(errors, kind, index, key, serializer.errors)
+    return valid
+
+
+def _check_unique(rows, field, existing, kind, key_field, errors, message):
+    """批内重复或与数据库已有值冲突的行记为错误，返回通过的行"""
+    seen = set()
+    passed = []
+    for index, data in rows:
+        value = data.get(field)
+        if value and (value in existing or value in seen):
+            _row_error(errors, kind, index, data[key_field], {field: [message]})
+            continue
+        if value:
+            seen.add(value)
+        passed.append((index, data))
+    return passed
+
+
+def validate_batch(devices, cabinets=()):
+    """校验一批数据，返回 (设备行, 柜子行, 逐行错误)"""
+    errors = []
+    if len(devices) + len(cabinets) > MAX_ROWS:
+        return [], [], [{'type': 'batch', 'index': None, 'id': None, 'errors': [f'单批最多 {MAX_ROWS} 行']}]
+
+    device_rows = _validate_rows(devices, DeviceRowSerializer, 'device', 'device_id', errors)
+    cabinet_rows = _validate_rows(cabinets, CabinetRowSerializer, 'cabinet', 'cabinet_id', errors)
+
+    existing = set(Cabinet.objects.filter(
+        cabinet_id__in=[data['cabinet_id'] for _, data in cabinet_rows]
+    ).values_list('cabinet_id', flat=True))
+    cabinet_rows = _check_unique(cabinet_rows, 'cabinet_id', existing, 'cabinet', 'cabinet_id', errors, '柜子编号已存在')
+
+    existing = set(Device.objects.filter(
+        device_id__in=[data['device_id'] for _, data in device_rows]
+    ).values_list('device_id', flat=True))
+    device_rows = _check_unique(device_rows, 'device_id', existing, 'device', 'device_id', errors, '设备ID已存在')
+    existing = set(Device.objects.filter(
+        api_key__in=[data['api_key'] for _, data in device_rows if data.get('api_key')]
+    ).values_list('api_key', flat=True))
+    device_rows = _check_unique(device_rows, 'api_key', existing, 'device', 'device_id', errors, 'API密钥已存在')
+
+    # 绑定的柜子须已存在或在本批中创建
+    referenced = {cabinet_id for _, data in device_rows for cabinet_id in data.get('cabinet_ids', ())}
+    known = {data['cabinet_id'] for _, data in cabinet_rows}
+    known.update(Cabinet.objects.filter(cabinet_id__in=referenced - known).values_list('cabinet_id', flat=True))
+    for index, data in device_rows:
+        missing = [cabinet_id for cabinet_id in data.get('cabinet_ids', ()) if cabinet_id not in known]
+        if missing:
+            _row_error(errors, 'device', index, data['device_id'], {'cabinet_ids': [f'柜子不存在: {", ".join(missing)}']})
+
+    errors.sort(key=lambda error: (error['type'], error['index'] if error['index'] is not None else -1))
+    return device_rows, cabinet_rows, errors
+
+
+def provision(devices, cabinets=(), dry_run=False):
+    """
+    批量开通设备，返回 {'devices': [...], 'cabinets': 新建柜子数, 'bindings': 绑定数}
+
+    devices 中未提供 api_key 的设备自动生成密钥；结果中包含每台设备的密钥。
+    任一行校验失败时抛出 ProvisioningError，数据库不做任何修改。
+    """
+    device_rows, cabinet_rows, errors = validate_batch(devices, cabinets)
+    if errors:
+        raise ProvisioningError(errors)
+
+    new_devices = []
+    cabinet_ids = {}
+    for _, data in device_rows:
+        cabinet_ids[data['device_id']] = list(dict.fromkeys(data.pop('cabinet_ids', [])))
+        data['api_key'] = data.get('api_key') or generate_api_key()
+        new_devices.append(Device(**data))
+    new_cabinets = [Cabinet(**data) for _, data in cabinet_rows]
+
+    result = {
+        'devices': [
+            {'device_id': device.device_id, 'api_key': device.api_key, 'cabinet_ids': cabinet_ids[device.device_id]}
+            for device in new_devices
+        ],
+        'cabinets': len(new_cabinets),
+        'bindings': sum(len(ids) for ids in cabinet_ids.values()),
+    }
+    if dry_run:
+        return result
+
+    try:
+        with transaction.atomic():
+            if new_cabinets:
+                Cabinet.objects.bulk_create(new_cabinets, batch_size=500)
+                created_pks = dict(Cabinet.objects.filter(
+                    cabinet_id__in=[cabinet.cabinet_id for cabinet in new_cabinets]
+                ).values_list('cabinet_id', 'pk'))
+                for cabinet in new_cabinets:
+                    cabinet.pk = created_pks[cabinet.cabinet_id]
+                # bulk_create 不触发信号：在此记录状态历史；重建可用性索引时同时清除响应缓存，
+                # 并在提交后向受影响站点的事件流推送 reset 事件（events.reset_event）
+                history.record_created(new_cabinets)
+                rebuild_availability({cabinet.station for cabinet in new_cabinets})
+            ensure_stations({cabinet.station for cabinet in new_cabinets} | {device.station for device in new_devices})
+            Device.objects.bulk_create(new_devices, batch_size=500)
+            if new_devices:
+                # bulk_create 不触发信号，在此清除设备列表的响应缓存
+                purge_on_commit(['devices'])
+
+            device_pks = dict(Device.objects.filter(
+                device_id__in=cabinet_ids
+            ).values_list('device_id', 'pk'))
+            cabinet_pks = dict(Cabinet.objects.filter(
+                cabinet_id__in={cabinet_id for ids in cabinet_ids.values() for cabinet_id in ids}
+            ).values_list('cabinet_id', 'pk'))
+            through = Device.bound_cabinets.through
+            through.objects.bulk_create([
+                through(device_id=device_pks[device_id], cabinet_id=cabinet_pks[cabinet_id])
+                for device_id, ids in cabinet_ids.items() for cabinet_id in ids
+            ], batch_size=1000)
+
+            for device in new_devices:
+                device.pk = device_pks[device.device_id]
+
+            def register():
+                # bulk_create 不触发 post_save，直接登记到在线状态表
+                for device in new_devices:
+                    presence_table.sync(device)
+            # 在事务内注册：外层有事务时随外层提交执行，回滚时不登记
+            transaction.on_commit(register)
+    except IntegrityError as e:
+        # 校验后、写入前被并发请求占用了编号或密钥
+        raise ProvisioningError([{'type': 'batch', 'index': None, 'id': None, 'errors': [f'数据冲突，请重试: {e}']}])
+
+    for row in result['devices']:
+        row['id'] = device_pks[row['device_id']]
+    return result
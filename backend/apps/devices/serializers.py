@@ -13,12 +13,13 @@ class DeviceSerializer(serializers.ModelSerializer):
             'id', 'device_id', 'name', 'station', 'location',
             'status', 'status_display', 'is_active',
             'bound_cabinet_ids', 'last_heartbeat', 'battery_level',
-            'created_at', 'updated_at'
+            'debug_heartbeat_log', 'created_at', 'updated_at'
         )
         read_only_fields = ('status', 'last_heartbeat', 'battery_level')
 
     def get_bound_cabinet_ids(self, obj):
-        return list(obj.bound_cabinets.values_list('cabinet_id', flat=True))
+        # 使用 prefetch_related('bound_cabinets') 的结果，列表接口不逐台查询
+        return [cabinet.cabinet_id for cabinet in obj.bound_cabinets.all()]
 
 
 class DeviceListSerializer(serializers.ModelSerializer):
@@ -58,7 +59,7 @@ class DeviceCreateSerializer(serializers.ModelSerializer):
 
 class DeviceHeartbeatSerializer(serializers.Serializer):
     """心跳上报序列化器"""
-    battery_level = serializers.IntegerField(required=False, min_value=0, max_value=100, label='电量')
+    battery_level = serializers.IntegerField(required=False, allow_null=True, min_value=0, max_value=100, label='电量')
 
 
 class CabinetStatusSerializer(serializers.Serializer):
@@ -91,6 +92,18 @@ class DeviceStatusReportSerializer(serializers.Serializer):
         help_text='{"A001": {"door": true, "lock_angle": 0, "lock_locked": true, "has_item": false}}'
     )
     battery_level = serializers.IntegerField(required=False, min_value=0, max_value=100, label='电量')
+    state_hash = serializers.RegexField(
+        r'^[0-9a-f]{8}$',
+        required=False,
+        label='全量状态校验值',
+        help_text='设备端全部柜子状态的 CRC32（见 apps/devices/state.py），提供时可只上报有变化的柜子'
+    )
+    query_id = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        label='状态查询指令ID',
+        help_text='响应 query_status 指令时回传该指令的 id'
+    )
 
 
 class OpenCabinetSerializer(serializers.Serializer):
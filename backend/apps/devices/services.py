@@ -0,0 +1,172 @@
+"""
+设备上报处理逻辑
+
+HTTP 视图和其他设备接入方式共用，保证同一份上报数据写库行为一致。
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from waylink.responsecache import purge_on_commit
+
+from .commands import complete_command
+from .heartbeat import heartbeat_buffer
+from .models import Device, DeviceLog
+from .state import cabinet_state_cache, reported_form, state_hash
+from .telemetry import telemetry_buffer
+
+
+def apply_status_report(device, cabinet_status, battery_level=None, reported_hash=None, query_id=None):
+    """
+    应用一次柜子状态上报（可以只包含有变化的柜子）
+
+    与柜子状态指纹比对做变化检测：未变化的柜子不写库，变化的柜子只
+    bulk_update 变化的字段；item_detected_at 只在 has_item 真正变化时更新。
+    状态日志只记录变化量（{柜子ID: {字段: [旧值, 新值]}}），没有变化时不写。
+    未绑定/不存在的柜子ID汇总为一条错误日志。设备在线状态和电量经心跳缓冲写回。
+    柜门、电机锁和物品检测的变化在同一事务内记入柜子状态历史（见 apps/cabinets/history.py），
+    提交后推送到柜子事件流（见 apps/cabinets/events.py）。
+    每个已知柜子的传感器读数（无论是否变化）都记入遥测缓冲。
+
+    reported_hash 为设备端全量状态的 state_hash，提供时与服务器端状态比对，
+    不一致则返回 resync=True，设备应改为上报全量状态。
+
+    query_id 为设备所响应的 query_status 指令ID，写库后记录为该指令的结果，
+    唤醒等待该查询的管理员请求（见 CabinetStatusQueryView）。
+
+    返回 {'updated': [...], 'unknown': [...], 'state_hash': ..., 'resync': bool}
+    """
+    from apps.cabinets.events import cabinet_event, cabinet_events
+    from apps.cabinets.history import record_device_changes
+    from apps.cabinets.models import Cabinet
+    from apps.cabinets.versions import cabinet_versions
+
+    now = timezone.now()
+    states = cabinet_state_cache.get(device)
+
+    changes = {}
+    changed_fields = set()
+    unknown = {}
+    for cabinet_id, status_data in cabinet_status.items():
+        state = states.get(cabinet_id)
+        if state is None:
+            unknown[cabinet_id] = status_data
+            continue
+
+        values = {
+            'lock_angle': status_data['lock_angle'],
+            'lock_locked': status_data['lock_locked'],
+            'has_item': status_data['has_item'],
+            # 柜门关闭时锁定，开启时解锁
+            'is_locked': not status_data['door'],
+        }
+        for metric in ('lock_angle', 'lock_locked', 'has_item'):
+            telemetry_buffer.record(metric, state['pk'], values[metric], now)
+        diff = {field: [state[field], value] for field, value in values.items() if state[field] != value}
+        if not diff:
+            continue
+        # 物品状态变化时更新检测时间
+        if 'has_item' in diff:
+            state['item_detected_at'] = now
+            changed_fields.add('item_detected_at')
+        state.update(values)
+        changes[cabinet_id] = diff
+        changed_fields.update(diff)
+
+    # bulk_update 按字段并集写入，每个对象都带上这些字段的当前值，并递增版本号
+    cabinets = [
+        Cabinet(pk=states[cabinet_id]['pk'], updated_at=now, version=F('version') + 1,
+                **{field: states[cabinet_id][field] for field in changed_fields})
+        for cabinet_id in changes
+    ]
+
+    logs = []
+    if changes:
+        logs.append(DeviceLog(
+            device=device,
+            log_type='status',
+            message='状态变化',
+            data={'changes': changes, 'battery_level': battery_level}
+        ))
+    if unknown:
+        logs.append(DeviceLog(
+            device=device,
+            log_type='error',
+            message=f'更新柜子状态失败: 未绑定的柜子 {", ".join(unknown)}',
+            data={'unknown_cabinets': unknown}
+        ))
+
+    if cabinets or logs:
+        with transaction.atomic():
+            if cabinets:
+                Cabinet.objects.bulk_update(cabinets, sorted(changed_fields) + ['updated_at', 'version'])
+                record_device_changes({states[cabinet_id]['pk']: diff for cabinet_id, diff in changes.items()}, now)
+            DeviceLog.objects.bulk_create(logs)
+            if cabinets:
+                transaction.on_commit(lambda: cabinet_state_cache.update(device.pk, states))
+                transaction.on_commit(lambda: cabinet_versions.invalidate_cabinets(changes))
+                purge_on_commit([f'cabinet:{cabinet_id}' for cabinet_id in changes])
+                cabinet_events.publish_on_commit([
+                    cabinet_event(cabinet_id, states[cabinet_id]['station'], diff) for cabinet_id, diff in changes.items()
+                ])
+
+    if query_id is not None:
+        complete_command(device, query_id, {
+            'reported_at': now.isoformat(),
+            'cabinets': list(cabinet_status),
+            'updated': list(changes),
+            'unknown': list(unknown),
+        })
+
+    # 状态上报同时视为一次心跳
+    heartbeat_buffer.record(device, battery_level, now=now, log=False)
+
+    result = {
+        'updated': list(changes),
+        'unknown': list(unknown),
+        'state_hash': None,
+        'resync': False,
+    }
+    if reported_hash is not None:
+        server_hash = full_state_hash(states)
+        if server_hash != reported_hash:
+            # 指纹可能已过期，以数据库为准再比对一次
+            cabinet_state_cache.invalidate_device(device.pk, broadcast=False)
+            server_hash = full_state_hash(cabinet_state_cache.get(device))
+        result['state_hash'] = server_hash
+        result['resync'] = server_hash != reported_hash
+    return result
+
+
+def full_state_hash(states):
+    """服务器端记录的设备全量状态校验值"""
+    return state_hash({cabinet_id: reported_form(state) for cabinet_id, state in states.items()})
+
+
+STATUS_CHANNEL = 'device-status'
+
+
+def record_status_transitions(device_pks, status, now=None):
+    """
+    记录设备在线状态变化（需在写入状态的同一事务内调用）
+
+    写入 online/offline 日志；事务提交后发送 device_status_changed 信号，
+    并通过消息代理广播 {"devices": [...], "status": ...}。
+    """
+    from .broker import get_broker
+    from .signals import device_status_changed
+
+    if not device_pks:
+        return
+    now = now or timezone.now()
+    message = '设备上线' if status == 'online' else '设备离线'
+    DeviceLog.objects.bulk_create([
+        DeviceLog(device_id=pk, log_type=status, message=message, data={'at': now.isoformat()})
+        for pk in device_pks
+    ])
+
+    def notify():
+        device_status_changed.send(sender=Device, device_pks=list(device_pks), status=status, at=now)
+        get_broker().publish(STATUS_CHANNEL, {'devices': list(device_pks), 'status': status})
+    transaction.on_commit(notify)
+    purge_on_commit(['devices'])
@@ -0,0 +1,83 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from apps.cabinets.models import Cabinet
+from waylink.responsecache import purge_on_commit
+
+from .authentication import device_key_cache
+from .models import Device
+from .presence import presence_table
+from .state import cabinet_state_cache
+
+# 设备在线状态变化（参数: device_pks, status, at），见 services.record_status_transitions
+device_status_changed = Signal()
+
+# 影响设备认证结果（及认证缓存中设备对象）的字段
+AUTH_FIELDS = {'api_key', 'is_active', 'debug_heartbeat_log'}
+
+
+@receiver(post_save, sender=Device)
+def invalidate_device_auth_on_save(sender, instance, update_fields=None, **kwargs):
+    """设备密钥、启用状态或心跳明细开关变更时清除认证缓存"""
+    if update_fields is not None and not AUTH_FIELDS.intersection(update_fields):
+        return
+    device_pk = instance.pk
+    # 本进程立即清除；提交后再清除一次并通知其他工作进程（提交前它们可能读到旧数据回填）
+    device_key_cache.invalidate_device(device_pk, broadcast=False)
+    transaction.on_commit(lambda: device_key_cache.invalidate_device(device_pk))
+
+
+@receiver(post_delete, sender=Device)
+def invalidate_device_auth_on_delete(sender, instance, **kwargs):
+    device_pk = instance.pk
+    device_key_cache.invalidate_device(device_pk, broadcast=False)
+    transaction.on_commit(lambda: device_key_cache.invalidate_device(device_pk))
+    transaction.on_commit(lambda: cabinet_state_cache.invalidate_device(device_pk))
+
+
+@receiver(device_status_changed)
+def update_presence_on_transition(sender, device_pks, status, at, **kwargs):
+    presence_table.set_status(device_pks, status, at=at)
+
+
+@receiver(post_save, sender=Device)
+def update_presence_on_save(sender, instance, **kwargs):
+    transaction.on_commit(lambda: presence_table.sync(instance))
+
+
+@receiver(post_delete, sender=Device)
+def update_presence_on_delete(sender, instance, **kwargs):
+    device_pk = instance.pk
+    transaction.on_commit(lambda: presence_table.discard(device_pk))
+
+
+@receiver(m2m_changed, sender=Device.bound_cabinets.through)
+def invalidate_cabinet_state_on_bind(sender, instance, action, pk_set=None, **kwargs):
+    """设备绑定柜子变化时清除状态指纹"""
+    if not action.startswith('post_'):
+        return
+    if not isinstance(instance, Device):
+        # 从柜子一侧修改绑定
+        cabinet_pk = instance.pk
+        transaction.on_commit(lambda: cabinet_state_cache.invalidate_cabinet(cabinet_pk))
+        for device_pk in pk_set or ():
+            transaction.on_commit(lambda device_pk=device_pk: cabinet_state_cache.invalidate_device(device_pk))
+        return
+    device_pk = instance.pk
+    transaction.on_commit(lambda: cabinet_state_cache.invalidate_device(device_pk))
+
+
+@receiver(post_save, sender=Cabinet)
+@receiver(post_delete, sender=Cabinet)
+def invalidate_cabinet_state(sender, instance, **kwargs):
+    """柜子经状态上报以外的途径保存时清除状态指纹（状态上报使用 bulk_update，不触发此信号）"""
+    cabinet_pk = instance.pk
+    transaction.on_commit(lambda: cabinet_state_cache.invalidate_cabinet(cabinet_pk))
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def purge_device_responses(sender, instance, **kwargs):
+    """设备变化时清除仪表盘等响应缓存"""
+    purge_on_commit(['devices', f'device:{instance.device_id}'])
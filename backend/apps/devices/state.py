@@ -0,0 +1,164 @@
+"""
+柜子状态指纹缓存
+
+记录每台设备所绑定柜子最近一次写入的传感器状态，状态上报据此做变化检测：
+与指纹一致的柜子不查询也不写库，只有真正变化的字段才执行 UPDATE。
+
+指纹在本进程内缓存 DEVICE_STATE_CACHE_TTL 秒。柜子被其他途径保存（开柜、
+后台修改等）或设备绑定关系变化时由信号清除，并通过消息代理通知其他工作进程；
+状态上报写库后本进程直接更新指纹，其他工作进程的同一设备指纹同样经消息代理清除。
+"""
+import os
+import threading
+import time
+import uuid
+import zlib
+
+from django.conf import settings
+
+from .broker import get_broker
+
+STATE_CHANNEL = 'cabinet-state'
+
+# 参与变化检测的柜子字段（item_detected_at 随 has_item 变化而更新）
+TRACKED_FIELDS = ('is_locked', 'lock_angle', 'lock_locked', 'has_item')
+
+
+def state_hash(cabinet_status):
+    """
+    设备全量状态的校验值（CRC32，8 位小写十六进制）
+
+    cabinet_status 为 {柜子ID: {"door", "lock_angle", "lock_locked", "has_item"}}，
+    规范串为按柜子ID排序的 "A001:1,0,1,0;A002:..."，布尔值写作 1/0，未知写作 -。
+    """
+    def encode(value):
+        if value is None:
+            return '-'
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        return str(value)
+
+    canonical = ';'.join(
+        f'{cabinet_id}:' + ','.join(
+            encode(entry[field]) for field in ('door', 'lock_angle', 'lock_locked', 'has_item')
+        )
+        for cabinet_id, entry in sorted(cabinet_status.items())
+    )
+    return f'{zlib.crc32(canonical.encode("utf-8")):08x}'
+
+
+def reported_form(state):
+    """指纹 -> 设备上报格式"""
+    return {
+        'door': not state['is_locked'],
+        'lock_angle': state['lock_angle'],
+        'lock_locked': state['lock_locked'],
+        'has_item': state['has_item'],
+    }
+
+
+class CabinetStateCache:
+    """设备 -> {柜子ID: 指纹} 缓存（每个工作进程一个实例）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._devices_by_cabinet = {}
+        self._generation = 0
+        self._subscribed_pid = None
+        self._origin = None
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'DEVICE_STATE_CACHE_TTL', 30)
+
+    def get(self, device):
+        """返回设备所有绑定柜子的指纹 {柜子ID: {...}}（调用方可修改返回值）"""
+        self._ensure_subscribed()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(device.pk)
+            if entry is not None and entry[1] > now:
+                return {cabinet_id: dict(state) for cabinet_id, state in entry[0].items()}
+            generation = self._generation
+
+        states = {
+            row.pop('cabinet_id'): row
+            for row in device.bound_cabinets.values('pk', 'cabinet_id', 'station', 'item_detected_at', *TRACKED_FIELDS)
+        }
+        with self._lock:
+            if generation == self._generation:
+                self._store(device.pk, states, now + self.ttl)
+        return {cabinet_id: dict(state) for cabinet_id, state in states.items()}
+
+    def update(self, device_pk, states):
+        """
+        写库成功后更新指纹（states 为 get() 返回并修改后的完整字典）
+
+        同时通知其他工作进程清除该设备的指纹，否则它们会按旧指纹把真实变化当作无变化跳过。
+        """
+        self._ensure_subscribed()
+        with self._lock:
+            if device_pk in self._entries:
+                self._store(device_pk, states, self._entries[device_pk][1])
+        get_broker().publish(STATE_CHANNEL, {'device': device_pk, 'origin': self._origin})
+
+    def invalidate_device(self, device_pk, broadcast=True):
+        with self._lock:
+            self._generation += 1
+            self._drop(device_pk)
+        if broadcast:
+            get_broker().publish(STATE_CHANNEL, {'device': device_pk})
+
+    def invalidate_cabinet(self, cabinet_pk, broadcast=True):
+        with self._lock:
+            self._generation += 1
+            for device_pk in list(self._devices_by_cabinet.get(cabinet_pk, ())):
+                self._drop(device_pk)
+        if broadcast:
+            get_broker().publish(STATE_CHANNEL, {'cabinet': cabinet_pk})
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._devices_by_cabinet.clear()
+
+    def _store(self, device_pk, states, expires_at):
+        self._drop(device_pk)
+        self._entries[device_pk] = (states, expires_at)
+        for state in states.values():
+            self._devices_by_cabinet.setdefault(state['pk'], set()).add(device_pk)
+
+    def _drop(self, device_pk):
+        entry = self._entries.pop(device_pk, None)
+        if entry is None:
+            return
+        for state in entry[0].values():
+            devices = self._devices_by_cabinet.get(state['pk'])
+            if devices is not None:
+                devices.discard(device_pk)
+                if not devices:
+                    del self._devices_by_cabinet[state['pk']]
+
+    def _ensure_subscribed(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._subscribed_pid == pid:
+                return
+            self._subscribed_pid = pid
+            # 区分本进程发布的 update 通知（fork 后重新生成）
+            self._origin = uuid.uuid4().hex
+        get_broker().subscribe(STATE_CHANNEL, self._on_message)
+
+    def _on_message(self, message):
+        """其他进程的失效通知（本进程发布的也会收到，重复清除无副作用；本进程 update 的通知跳过）"""
+        if message.get('origin') is not None and message['origin'] == self._origin:
+            return
+        if message.get('device') is not None:
+            self.invalidate_device(message['device'], broadcast=False)
+        if message.get('cabinet') is not None:
+            self.invalidate_cabinet(message['cabinet'], broadcast=False)
+
+
+cabinet_state_cache = CabinetStateCache()
@@ -0,0 +1,163 @@
+"""
+设备离线检测（由 manage.py sweep_offline_devices 运行）
+
+心跳写回时把设备置为 online；本模块负责在心跳超时后置为 offline 并记录
+状态变化。需要作为常驻进程部署（每台主机一个）；未运行时 Device.status
+不会变为 offline，读取在线状态的一方（Device.is_online、presence 表、
+运维统计）按心跳时间兜底。
+
+每台在线设备的心跳截止时间（last_heartbeat + DEVICE_OFFLINE_TIMEOUT）
+放在哈希时间轮中。每个 tick：
+1. 增量读取上次扫描以来有新心跳的在线设备，重新登记截止时间；
+2. 推进时间轮，取出到期设备，按批次用一条条件 UPDATE 置为 offline
+   （条件中再次校验 last_heartbeat，期间收到心跳的设备不受影响），
+   并记录状态变化（见 services.record_status_transitions）。
+"""
+import logging
+import math
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Device
+from .services import record_status_transitions
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def offline_timeout():
+    """超过该时长（秒）无心跳视为离线"""
+    return getattr(settings, 'DEVICE_OFFLINE_TIMEOUT', 600)
+
+
+class TimingWheel:
+    """
+    哈希时间轮
+
+    截止时间按 tick 粒度映射到槽位，推进时只检查已完整经过的 tick 对应的槽位
+    （当前 tick 未结束时其槽位中可能还有未到期的键），到期最多延迟一个 tick。
+    同一个键重新登记时旧槽位中的记录按需惰性清理；超过一圈的截止时间
+    留在槽位中等待后续圈次。
+    """
+
+    def __init__(self, tick, size, now):
+        self.tick = tick
+        self._slots = [set() for _ in range(size)]
+        self._deadlines = {}
+        # 最后一个已检查的槽位（当前 tick 尚未结束）
+        self._cursor = int(now // tick) - 1
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, key, deadline):
+        """登记（或更新）键的截止时间（时间戳，秒）"""
+        self._deadlines[key] = deadline
+        # 已经过去的截止时间放到下一个要检查的槽位
+        index = max(int(deadline // self.tick), self._cursor + 1)
+        self._slots[index % len(self._slots)].add(key)
+
+    def cancel(self, key):
+        self._deadlines.pop(key, None)
+
+    def advance(self, now):
+        """推进到 now，返回已到期（并移出时间轮）的键"""
+        target = int(now // self.tick) - 1
+        steps = min(target - self._cursor, len(self._slots))
+        expired = []
+        for offset in range(1, steps + 1):
+            slot = self._slots[(self._cursor + offset) % len(self._slots)]
+            for key in list(slot):
+                deadline = self._deadlines.get(key)
+                if deadline is None:
+                    slot.discard(key)
+                elif deadline <= now:
+                    slot.discard(key)
+                    del self._deadlines[key]
+                    expired.append(key)
+                elif int(deadline // self.tick) % len(self._slots) != (self._cursor + offset) % len(self._slots):
+                    # 已重新登记到其他槽位
+                    slot.discard(key)
+        self._cursor = max(self._cursor, target)
+        return expired
+
+
+class OfflineSweeper:
+    """离线检测器"""
+
+    def __init__(self, timeout=None, tick=None):
+        self.timeout = timeout or offline_timeout()
+        self.tick = tick or getattr(settings, 'DEVICE_SWEEPER_TICK', 1)
+        size = math.ceil(self.timeout / self.tick) + 1
+        self.wheel = TimingWheel(self.tick, size, time.time())
+        self._watermark = None
+
+    @property
+    def scan_lag(self):
+        """增量扫描的回看时长：心跳经写缓冲落库，last_heartbeat 可能早于落库时间"""
+        return getattr(settings, 'DEVICE_HEARTBEAT_FLUSH_INTERVAL', 5) + 5
+
+    def scan(self, now):
+        """读取上次扫描以来有新心跳的在线设备并登记截止时间"""
+        devices = Device.objects.filter(status='online')
+        if self._watermark is not None:
+            devices = devices.filter(last_heartbeat__gte=self._watermark)
+        self._watermark = now - timedelta(seconds=self.scan_lag)
+
+        count = 0
+        for pk, last_heartbeat in devices.values_list('pk', 'last_heartbeat').iterator():
+            deadline = last_heartbeat.timestamp() + self.timeout if last_heartbeat else 0
+            self.wheel.schedule(pk, deadline)
+            count += 1
+        return count
+
+    def sweep(self, now):
+        """把到期设备置为离线，返回置为离线的设备主键"""
+        expired = self.wheel.advance(now.timestamp())
+        cutoff = now - timedelta(seconds=self.timeout)
+        stale = Q(last_heartbeat__lt=cutoff) | Q(last_heartbeat__isnull=True)
+
+        offline = []
+        for start in range(0, len(expired), BATCH_SIZE):
+            batch = expired[start:start + BATCH_SIZE]
+            with transaction.atomic():
+                pks = list(
+                    Device.objects.filter(stale, pk__in=batch, status='online').values_list('pk', flat=True)
+                )
+                if pks:
+                    Device.objects.filter(stale, pk__in=pks, status='online').update(status='offline', updated_at=now)
+                    record_status_transitions(pks, 'offline', now)
+            offline.extend(pks)
+
+            # 到期前收到了心跳（尚未被扫描到）的设备按最新心跳重新登记
+            flipped = set(pks)
+            remaining = [pk for pk in batch if pk not in flipped]
+            if remaining:
+                for pk, last_heartbeat in Device.objects.filter(
+                    pk__in=remaining, status='online', last_heartbeat__isnull=False
+                ).values_list('pk', 'last_heartbeat'):
+                    self.wheel.schedule(pk, last_heartbeat.timestamp() + self.timeout)
+        return offline
+
+    def run_once(self):
+        now = timezone.now()
+        self.scan(now)
+        return self.sweep(now)
+
+    def run_forever(self, stdout=None):
+        while True:
+            started = time.monotonic()
+            try:
+                offline = self.run_once()
+                if offline and stdout is not None:
+                    stdout.write(f'{timezone.localtime():%Y-%m-%d %H:%M:%S} {len(offline)} 台设备离线')
+            except Exception:
+                logger.exception('离线检测失败')
+                close_old_connections()
+            time.sleep(max(self.tick - (time.monotonic() - started), 0))
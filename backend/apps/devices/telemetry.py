@@ -0,0 +1,370 @@
+"""
+设备遥测时间序列
+
+电量（按设备）与柜锁传感器读数（lock_angle / lock_locked / has_item，按柜子，
+布尔值记为 1/0）保存在 TelemetryBlock 的定长数组中，每个序列包含：
+
+- 原始环形缓冲区（tier=0）：最近 RING_SIZE 个采样点 (Unix 时间, 值)；
+- 降采样层级（TIERS）：固定分辨率的桶，每桶记录采样数、最小、最大、合计；
+  一个数据块覆盖 分辨率 × 桶数 秒，按本地时区对齐（日桶从本地零点开始）。
+
+采样先在进程内缓冲，由心跳写回线程（见 heartbeat.py）每 DEVICE_TELEMETRY_FLUSH_INTERVAL
+秒批量合并进数据块：一条查询读出涉及的数据块，再 bulk_update / bulk_create。
+范围查询按桶宽选择最粗的可用层级，对数组切片逐桶归约（切片和内置 min/max/sum
+在 C 层完成）；空桶的最小/最大值存为 ±inf，归约时无需逐个判断。
+过期数据块由 manage.py prune_telemetry 删除（保留期见 DEVICE_TELEMETRY_RETENTION）。
+"""
+import atexit
+import logging
+import math
+import struct
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+from operator import add
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# 指标 -> 序列所属对象
+METRICS = {
+    'battery': 'device',
+    'lock_angle': 'cabinet',
+    'lock_locked': 'cabinet',
+    'has_item': 'cabinet',
+}
+
+RING_SIZE = 256
+RING_HEADER = struct.Struct('<II')
+
+# (分辨率秒, 每块桶数)：5 分钟 × 1 天、1 小时 × 30 天、1 天 × 366 天
+TIERS = ((300, 288), (3600, 720), (86400, 366))
+WIDTHS = dict(TIERS)
+
+# 单个序列缓冲的采样数上限（写回持续失败时丢弃最早的采样）
+MAX_PENDING_SAMPLES = 4 * RING_SIZE
+
+# 分辨率 -> 保留天数（None 为永久保留），可由 DEVICE_TELEMETRY_RETENTION 覆盖
+DEFAULT_RETENTION = {300: 7, 3600: 180, 86400: None}
+
+
+def retention(resolution):
+    """层级保留期（timedelta），None 表示永久保留"""
+    days = getattr(settings, 'DEVICE_TELEMETRY_RETENTION', DEFAULT_RETENTION).get(resolution)
+    return None if days is None else timedelta(days=days)
+
+
+def origin():
+    """对齐偏移（秒）：本地时区的 UTC 偏移，使日桶从本地零点开始"""
+    return int(datetime(2000, 1, 1, tzinfo=timezone.get_default_timezone()).utcoffset().total_seconds())
+
+
+def align(ts, span, offset):
+    """ts 所在的 span 秒时间窗起点"""
+    return ts - (ts + offset) % span
+
+
+def _load(typecode, data, offset, count):
+    values = array(typecode)
+    end = offset + values.itemsize * count
+    values.frombytes(data[offset:end])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, end
+
+
+def _dump(*arrays):
+    """数组按小端序拼接"""
+    parts = []
+    for values in arrays:
+        if sys.byteorder == 'big':
+            values = array(values.typecode, values)
+            values.byteswap()
+        parts.append(values.tobytes())
+    return b''.join(parts)
+
+
+class Ring:
+    """原始采样环形缓冲区：写入位置、采样数，以及定长的时间、值数组"""
+
+    def __init__(self, data=None):
+        if data:
+            self.head, self.count = RING_HEADER.unpack_from(data)
+            self.times, offset = _load('I', data, RING_HEADER.size, RING_SIZE)
+            self.values, _ = _load('f', data, offset, RING_SIZE)
+        else:
+            self.head = self.count = 0
+            self.times = array('I', bytes(4 * RING_SIZE))
+            self.values = array('f', bytes(4 * RING_SIZE))
+
+    def append(self, at, value):
+        self.times[self.head] = at
+        self.values[self.head] = value
+        self.head = (self.head + 1) % RING_SIZE
+        self.count = min(self.count + 1, RING_SIZE)
+
+    def samples(self):
+        """按写入顺序返回 [(时间, 值)]"""
+        start = (self.head - self.count) % RING_SIZE
+        times = (self.times[start:] + self.times[:start])[:self.count]
+        values = (self.values[start:] + self.values[:start])[:self.count]
+        return list(zip(times, values))
+
+    def to_bytes(self):
+        return RING_HEADER.pack(self.head, self.count) + _dump(self.times, self.values)
+
+
+class Buckets:
+    """降采样数据块：width 个桶的采样数、最小、最大、合计"""
+
+    def __init__(self, width, data=None):
+        if data:
+            self.counts, offset = _load('I', data, 0, width)
+            self.mins, offset = _load('f', data, offset, width)
+            self.maxs, offset = _load('f', data, offset, width)
+            self.sums, _ = _load('d', data, offset, width)
+        else:
+            self.counts = array('I', bytes(4 * width))
+            self.mins = array('f', [math.inf]) * width
+            self.maxs = array('f', [-math.inf]) * width
+            self.sums = array('d', bytes(8 * width))
+
+    def add(self, index, value):
+        self.counts[index] += 1
+        self.sums[index] += value
+        if value < self.mins[index]:
+            self.mins[index] = value
+        if value > self.maxs[index]:
+            self.maxs[index] = value
+
+    def to_bytes(self):
+        return _dump(self.counts, self.mins, self.maxs, self.sums)
+
+
+class TelemetryBuffer:
+    """遥测采样缓冲区（每个工作进程一个实例），由心跳写回线程按间隔写回"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushed_at = 0.0
+
+    @property
+    def flush_interval(self):
+        """写回间隔（秒）：每次写回整块改写数据块，间隔越长合并的采样越多；0 表示随心跳每次写回"""
+        return getattr(settings, 'DEVICE_TELEMETRY_FLUSH_INTERVAL', 60)
+
+    def record(self, metric, object_id, value, at=None):
+        if value is None:
+            return
+        at = int((at or timezone.now()).timestamp())
+        with self._lock:
+            samples = self._pending.setdefault((metric, object_id), [])
+            samples.append((at, float(value)))
+            if len(samples) > MAX_PENDING_SAMPLES:
+                del samples[:len(samples) - MAX_PENDING_SAMPLES]
+
+    def maybe_flush(self):
+        """距上次写回超过 flush_interval 时写回"""
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """把缓冲的采样合并进数据块，返回写回的采样数"""
+        with self._lock:
+            self._flushed_at = time.monotonic()
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        try:
+            with transaction.atomic():
+                self._write(pending)
+        except Exception:
+            logger.exception('遥测数据写回失败，%d 个序列将在下次重试', len(pending))
+            with self._lock:
+                for key, samples in pending.items():
+                    newer = self._pending.get(key, [])
+                    self._pending[key] = (samples + newer)[-MAX_PENDING_SAMPLES:]
+            return 0
+        return sum(len(samples) for samples in pending.values())
+
+    @staticmethod
+    def _write(pending):
+        from .models import TelemetryBlock
+
+        offset = origin()
+        wanted = set()
+        for (metric, object_id), samples in pending.items():
+            wanted.add((metric, object_id, 0, 0))
+            for at, _ in samples:
+                for resolution, width in TIERS:
+                    wanted.add((metric, object_id, resolution, align(at, resolution * width, offset)))
+
+        existing = {}
+        for block in TelemetryBlock.objects.select_for_update().filter(
+            metric__in={key[0] for key in wanted},
+            object_id__in={key[1] for key in wanted},
+            tier__in={key[2] for key in wanted},
+            start__in={key[3] for key in wanted},
+        ):
+            key = (block.metric, block.object_id, block.tier, block.start)
+            if key in wanted:
+                existing[key] = block
+
+        arrays = {}
+        for key in wanted:
+            data = bytes(existing[key].data) if key in existing else None
+            arrays[key] = Ring(data) if key[2] == 0 else Buckets(WIDTHS[key[2]], data)
+
+        for (metric, object_id), samples in pending.items():
+            ring = arrays[(metric, object_id, 0, 0)]
+            for at, value in samples:
+                ring.append(at, value)
+                for resolution, width in TIERS:
+                    start = align(at, resolution * width, offset)
+                    arrays[(metric, object_id, resolution, start)].add((at - start) // resolution, value)
+
+        to_update = []
+        to_create = []
+        for key, values in arrays.items():
+            block = existing.get(key)
+            if block is None:
+                metric, object_id, tier, start = key
+                to_create.append(TelemetryBlock(
+                    metric=metric, object_id=object_id, tier=tier, start=start, data=values.to_bytes()
+                ))
+            else:
+                block.data = values.to_bytes()
+                to_update.append(block)
+        if to_update:
+            TelemetryBlock.objects.bulk_update(to_update, ['data'], batch_size=500)
+        if to_create:
+            TelemetryBlock.objects.bulk_create(to_create, batch_size=500)
+
+
+telemetry_buffer = TelemetryBuffer()
+atexit.register(telemetry_buffer.flush)
+
+
+# 未指定桶宽时按时间范围选择，使桶数不超过 AUTO_POINTS
+AUTO_BUCKETS = (60, 300, 900, 3600, 6 * 3600, 86400, 7 * 86400)
+AUTO_POINTS = 300
+MAX_BUCKETS = 1000
+
+
+def auto_bucket(seconds):
+    for bucket in AUTO_BUCKETS:
+        if seconds <= bucket * AUTO_POINTS:
+            return bucket
+    return AUTO_BUCKETS[-1]
+
+
+def choose_tier(bucket, start, now):
+    """
+    桶宽对应的层级：小于最细分辨率时用原始采样，否则取能整除桶宽、
+    且保留期覆盖 start 的最粗层级（都不覆盖时取能整除的最粗层级）
+    """
+    if bucket < TIERS[0][0]:
+        return 0
+    candidates = [resolution for resolution, _ in reversed(TIERS) if bucket % resolution == 0]
+    if not candidates:
+        raise ValueError(bucket)
+    for resolution in candidates:
+        keep = retention(resolution)
+        if keep is None or start >= (now - keep).timestamp():
+            return resolution
+    return candidates[0]
+
+
+def empty_stats(n):
+    return {'count': [0] * n, 'min': [math.inf] * n, 'max': [-math.inf] * n, 'sum': [0.0] * n}
+
+
+def query(metric, object_ids, start, end, bucket):
+    """
+    按桶聚合 [start, end) 内的数据
+
+    start / end 为 Unix 时间，先按桶宽（本地时区对齐）扩展到整桶。
+    返回 (层级, 首桶起点, 桶数, {对象主键: {'count', 'min', 'max', 'sum'}})，
+    每项为逐桶列表，无数据的对象不出现在结果中。
+    """
+    from .models import TelemetryBlock
+
+    offset = origin()
+    first = align(start, bucket, offset)
+    n = -((first - end) // bucket)
+    last = first + n * bucket
+    tier = choose_tier(bucket, first, timezone.now())
+    blocks = TelemetryBlock.objects.filter(metric=metric, tier=tier, object_id__in=object_ids)
+    results = {}
+
+    if tier == 0:
+        for object_id, data in blocks.values_list('object_id', 'data').iterator():
+            stats = results.setdefault(object_id, empty_stats(n))
+            for at, value in Ring(bytes(data)).samples():
+                if first <= at < last:
+                    index = (at - first) // bucket
+                    stats['count'][index] += 1
+                    stats['sum'][index] += value
+                    stats['min'][index] = min(stats['min'][index], value)
+                    stats['max'][index] = max(stats['max'][index], value)
+        return tier, first, n, results
+
+    span = tier * WIDTHS[tier]
+    blocks = blocks.filter(start__gte=align(first, span, offset), start__lt=last)
+    for object_id, block_start, data in blocks.values_list('object_id', 'start', 'data').iterator():
+        stats = results.setdefault(object_id, empty_stats(n))
+        values = Buckets(WIDTHS[tier], bytes(data))
+        low, high = max(block_start, first), min(block_start + span, last)
+        if bucket == tier:
+            # 桶宽等于层级分辨率：整段切片逐元素合并
+            out = slice((low - first) // tier, (high - first) // tier)
+            block = slice((low - block_start) // tier, (high - block_start) // tier)
+            stats['count'][out] = map(add, stats['count'][out], values.counts[block])
+            stats['sum'][out] = map(add, stats['sum'][out], values.sums[block])
+            stats['min'][out] = map(min, stats['min'][out], values.mins[block])
+            stats['max'][out] = map(max, stats['max'][out], values.maxs[block])
+            continue
+        # 与数据块重叠的每个输出桶：对块内对应的切片归约
+        for index in range((low - first) // bucket, -((first - high) // bucket)):
+            lo = (max(first + index * bucket, low) - block_start) // tier
+            hi = (min(first + (index + 1) * bucket, high) - block_start) // tier
+            count = sum(values.counts[lo:hi])
+            if not count:
+                continue
+            stats['count'][index] += count
+            stats['sum'][index] += sum(values.sums[lo:hi])
+            stats['min'][index] = min(stats['min'][index], min(values.mins[lo:hi]))
+            stats['max'][index] = max(stats['max'][index], max(values.maxs[lo:hi]))
+    return tier, first, n, results
+
+
+def combine(stats_list, n):
+    """多个序列逐桶合并（用于按站点 / 全部设备汇总）"""
+    if not stats_list:
+        return empty_stats(n)
+    # 按列逐桶归约（不能用 reduce 嵌套 map：迭代时逐层递归，序列数多时栈溢出）
+    return {
+        'count': [sum(column) for column in zip(*(stats['count'] for stats in stats_list))],
+        'sum': [sum(column) for column in zip(*(stats['sum'] for stats in stats_list))],
+        'min': [min(column) for column in zip(*(stats['min'] for stats in stats_list))],
+        'max': [max(column) for column in zip(*(stats['max'] for stats in stats_list))],
+    }
+
+
+def format_stats(stats, digits=2):
+    """逐桶统计 -> {'min', 'max', 'avg', 'count'}，空桶为 None"""
+    counts = stats['count']
+    return {
+        'min': [round(value, digits) if count else None for value, count in zip(stats['min'], counts)],
+        'max': [round(value, digits) if count else None for value, count in zip(stats['max'], counts)],
+        'avg': [round(total / count, digits) if count else None for total, count in zip(stats['sum'], counts)],
+        'count': counts,
+    }
@@ -0,0 +1,64 @@
+"""
+设备可用率报表（基于 DeviceHeartbeatRollup）
+
+一次聚合查询按设备汇总时间范围内的小时汇总，不扫描心跳日志。
+停机时长 = 范围内各小时的 gap_seconds + 最后一次心跳之后仍在持续的中断；
+gap_seconds 按小时粒度统计，范围两端不足一小时的部分按整小时计入。
+"""
+from datetime import timedelta
+
+from django.db.models import Max, Min, Sum
+from django.utils import timezone
+
+from .heartbeat import floor_hour, heartbeat_gap
+from .models import DeviceHeartbeatRollup
+
+
+def uptime_report(devices, start, end=None):
+    """返回 devices（查询集）中每台设备在 [start, end) 内的心跳与可用率统计"""
+    now = timezone.now()
+    end = min(end or now, now)
+    gap = timedelta(seconds=heartbeat_gap())
+
+    totals = {
+        row['device']: row
+        for row in DeviceHeartbeatRollup.objects.filter(
+            device__in=devices, hour__gte=floor_hour(start), hour__lt=end
+        ).values('device').annotate(
+            heartbeats=Sum('count'),
+            gap_count=Sum('gap_count'),
+            gap_seconds=Sum('gap_seconds'),
+            battery_min=Min('battery_min'),
+            battery_sum=Sum('battery_sum'),
+            battery_samples=Sum('battery_samples'),
+            last_seen=Max('last_seen'),
+        )
+    }
+
+    results = []
+    for device in devices.only('pk', 'device_id', 'station', 'created_at', 'last_heartbeat', 'battery_level'):
+        row = totals.get(device.pk, {})
+        period_start = max(start, device.created_at)
+        period = (end - period_start).total_seconds()
+
+        downtime = row.get('gap_seconds') or 0
+        # 最后一次心跳之后仍在持续的中断（尚未被下一次心跳记入汇总）
+        silent_since = max(device.last_heartbeat + gap, period_start) if device.last_heartbeat else period_start
+        if silent_since < end:
+            downtime += (end - silent_since).total_seconds()
+        downtime = min(downtime, max(period, 0))
+
+        samples = row.get('battery_samples') or 0
+        results.append({
+            'device_id': device.device_id,
+            'station': device.station,
+            'heartbeats': row.get('heartbeats') or 0,
+            'gap_count': row.get('gap_count') or 0,
+            'downtime_seconds': round(downtime),
+            'uptime': round(1 - downtime / period, 4) if period > 0 else None,
+            'last_seen': device.last_heartbeat.isoformat() if device.last_heartbeat else None,
+            'battery_min': row.get('battery_min'),
+            'battery_avg': round(row['battery_sum'] / samples, 1) if samples else None,
+            'battery_last': device.battery_level,
+        })
+    return results
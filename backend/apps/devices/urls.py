@@ -1,8 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
-    DeviceViewSet, DeviceLogsView,
-    DeviceHeartbeatView, DeviceStatusReportView, DeviceOpenCabinetView, OpenCabinetByCodeView,
+    DeviceViewSet, DeviceLogsView, DeviceTelemetryView,
+    DeviceHeartbeatView, DeviceStatusReportView, DeviceCommandPollView, DeviceCommandWaitView,
+    DeviceOpenCabinetView, OpenCabinetByCodeView,
     DeviceStatusQueryView, CabinetStatusQueryView
 )
 
@@ -13,10 +14,13 @@ urlpatterns = [
     # ESP32 设备通信接口
     path('heartbeat/', DeviceHeartbeatView.as_view(), name='device-heartbeat'),
     path('status/', DeviceStatusReportView.as_view(), name='device-status'),
+    path('commands/poll/', DeviceCommandPollView.as_view(), name='device-command-poll'),
+    path('commands/wait/', DeviceCommandWaitView.as_view(), name='device-command-wait'),
     path('status/query/<str:device_id>/', DeviceStatusQueryView.as_view(), name='device-status-query'),
     path('open/by-code/', OpenCabinetByCodeView.as_view(), name='open-by-code'),
     path('<str:device_id>/open/', DeviceOpenCabinetView.as_view(), name='device-open'),
     path('<str:device_id>/logs/', DeviceLogsView.as_view(), name='device-logs'),
+    path('telemetry/', DeviceTelemetryView.as_view(), name='device-telemetry'),
 
     # 管理员查询接口
     path('query/<str:device_id>/', CabinetStatusQueryView.as_view(), name='cabinet-status-query'),
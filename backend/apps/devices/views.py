@@ -1,62 +1,111 @@
-import uuid
+import asyncio
+import json
+import math
+from datetime import timedelta
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.utils.decorators import method_decorator
+from django.views import View
 from django.views.decorators.csrf import csrf_exempt
-from rest_framework import viewsets, status
+from rest_framework import exceptions, serializers, viewsets, status
+from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
-
-from .models import Device, DeviceLog
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .authentication import DeviceAPIKeyAuthentication, IsDevice, device_key_cache
+from .commands import ack_commands, enqueue_command, lease_commands, serialize_command
+from .heartbeat import heartbeat_buffer
+from .logs import (
+    NDJSON_MEDIA_TYPE, NDJSONRenderer, decode_cursor, encode_cursor, format_log, iter_logs,
+    ndjson_lines, parse_log_time, parse_log_types
+)
+from .models import Device, DeviceCommand, DeviceLog
+from .notify import command_notifier, reply_notifier
+from .provisioning import ProvisioningError, generate_api_key, provision
+from .protocol import (
+    MEDIA_TYPE as MSGPACK_MEDIA_TYPE, MessagePackError, MessagePackParser, MessagePackRenderer,
+    compact_response, is_msgpack_request, packb, unpackb, validate_status_report
+)
 from .serializers import (
     DeviceSerializer, DeviceListSerializer, DeviceCreateSerializer,
     DeviceHeartbeatSerializer, DeviceStatusReportSerializer,
-    OpenCabinetSerializer, DeviceLogSerializer
+    OpenCabinetSerializer
 )
+from .services import apply_status_report
+from .telemetry import MAX_BUCKETS, METRICS, auto_bucket, combine, format_stats, query as query_telemetry
 
 
 # ============================================
-# ESP32 设备通信接口（无需认证）
+# ESP32 设备通信接口（API密钥认证）
 # ============================================
 
-@method_decorator(csrf_exempt, name='dispatch')
-class DeviceHeartbeatView(APIView):
-    """设备心跳上报"""
-    permission_classes = [AllowAny]
-
-    def post(self, request):
-        """ESP32 定期调用此接口上报心跳"""
-        api_key = request.headers.get('X-API-Key') or request.data.get('api_key')
+class DeviceAPIView(APIView):
+    """ESP32 设备接口基类（X-API-Key 认证，结果经进程内缓存解析；支持 JSON 与 MessagePack）"""
+    authentication_classes = [DeviceAPIKeyAuthentication]
+    permission_classes = [IsDevice]
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + [MessagePackParser]
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [MessagePackRenderer]
 
-        if not api_key:
+    def handle_exception(self, exc):
+        # 保持设备端约定的 {code, message} 响应格式
+        if isinstance(exc, exceptions.NotAuthenticated):
             return Response({
                 'code': 400,
                 'message': '缺少API密钥'
             }, status=status.HTTP_400_BAD_REQUEST)
+        if isinstance(exc, exceptions.AuthenticationFailed):
+            return Response({
+                'code': 401,
+                'message': str(exc.detail)
+            }, status=status.HTTP_401_UNAUTHORIZED)
+        return super().handle_exception(exc)
+
+    def get_polling_device(self, request, device_id):
+        """轮询接口的设备解析：提供了密钥时走认证缓存，否则按设备ID查库（向后兼容）"""
+        if request.auth is not None:
+            if request.auth.device_id != device_id:
+                return None, Response({
+                    'code': 401,
+                    'message': 'API密钥验证失败'
+                }, status=status.HTTP_401_UNAUTHORIZED)
+            return request.auth, None
 
         try:
-            device = Device.objects.get(api_key=api_key, is_active=True)
+            return Device.objects.get(device_id=device_id), None
         except Device.DoesNotExist:
+            return None, Response({
+                'code': 404,
+                'message': '设备不存在'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class DeviceHeartbeatView(DeviceAPIView):
+    """设备心跳上报"""
+    query_budget = 12
+
+    def post(self, request):
+        """ESP32 定期调用此接口上报心跳"""
+        device = request.auth
+
+        serializer = DeviceHeartbeatSerializer(data=request.data)
+        if not serializer.is_valid():
             return Response({
-                'code': 401,
-                'message': '无效的API密钥'
-            }, status=status.HTTP_401_UNAUTHORIZED)
+                'code': 400,
+                'message': '数据格式错误',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
 
-        # 更新心跳时间
-        battery_level = request.data.get('battery_level')
-        device.last_heartbeat = timezone.now()
+        # 更新心跳时间（写入缓冲区，由后台批量写回）
+        heartbeat_buffer.record(device, serializer.validated_data.get('battery_level'))
         device.status = 'online'
-        if battery_level is not None:
-            device.battery_level = battery_level
-        device.save()
-
-        # 记录日志
-        DeviceLog.objects.create(
-            device=device,
-            log_type='heartbeat',
-            message='心跳上报',
-            data={'battery_level': battery_level}
-        )
 
         return Response({
             'code': 0,
@@ -69,127 +118,198 @@ class DeviceHeartbeatView(APIView):
 
 
 @method_decorator(csrf_exempt, name='dispatch')
-class DeviceStatusReportView(APIView):
+class DeviceStatusReportView(DeviceAPIView):
     """设备状态上报"""
-    permission_classes = [AllowAny]
+    query_budget = 18
 
     def post(self, request):
         """ESP32 上报柜子状态变化"""
-        api_key = request.headers.get('X-API-Key') or request.data.get('api_key')
+        device = request.auth
 
-        if not api_key:
+        # 紧凑格式（MessagePack）跳过 DRF 嵌套序列化器，直接校验
+        if is_msgpack_request(request):
+            validated_data, errors = validate_status_report(request.data)
+        else:
+            serializer = DeviceStatusReportSerializer(data=request.data)
+            if serializer.is_valid():
+                validated_data, errors = serializer.validated_data, None
+            else:
+                validated_data, errors = None, serializer.errors
+
+        if errors:
             return Response({
                 'code': 400,
-                'message': '缺少API密钥'
+                'message': '数据格式错误',
+                'errors': errors
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            device = Device.objects.get(api_key=api_key, is_active=True)
-        except Device.DoesNotExist:
+        # 只写入有变化的柜子，并记录变化量日志
+        result = apply_status_report(
+            device,
+            validated_data['cabinet_status'],
+            validated_data.get('battery_level'),
+            validated_data.get('state_hash'),
+            validated_data.get('query_id')
+        )
+
+        if validated_data.get('state_hash') is None:
             return Response({
-                'code': 401,
-                'message': '无效的API密钥'
-            }, status=status.HTTP_401_UNAUTHORIZED)
+                'code': 0,
+                'message': '状态更新成功'
+            })
 
-        serializer = DeviceStatusReportSerializer(data=request.data)
-        if not serializer.is_valid():
+        # 增量上报：返回服务器端全量状态校验值，不一致时要求设备重发全量状态
+        return Response({
+            'code': 0,
+            'message': '状态不一致，请上报全量状态' if result['resync'] else '状态更新成功',
+            'data': {
+                'state_hash': result['state_hash'],
+                'resync': result['resync']
+            }
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class DeviceCommandPollView(DeviceAPIView):
+    """设备指令轮询（确认已执行指令并领取新指令，一次往返）"""
+    query_budget = 3
+
+    def get(self, request):
+        return self.poll(request, [])
+
+    def post(self, request):
+        """
+        请求体: {"ack": [已执行的指令ID], "limit": 10}
+        领取的指令需在确认时限内通过下一次轮询的 ack 回传，超时视为未执行
+        """
+        try:
+            ack_ids = [int(command_id) for command_id in request.data.get('ack') or []]
+        except (TypeError, ValueError):
             return Response({
                 'code': 400,
-                'message': '数据格式错误',
-                'errors': serializer.errors
+                'message': 'ack 必须是指令ID列表'
             }, status=status.HTTP_400_BAD_REQUEST)
+        return self.poll(request, ack_ids)
 
-        # 更新柜子状态
-        cabinet_status = serializer.validated_data['cabinet_status']
-        for cabinet_id, status_data in cabinet_status.items():
-            try:
-                cabinet = device.bound_cabinets.get(cabinet_id=cabinet_id)
-                door_closed = status_data['door']
-                cabinet.lock_angle = status_data['lock_angle']
-                cabinet.lock_locked = status_data['lock_locked']
-                cabinet.has_item = status_data['has_item']
-
-                # 柜门关闭时锁定，开启时解锁
-                cabinet.is_locked = not door_closed
-
-                # 更新物品检测时间
-                if cabinet.has_item is not None:
-                    from django.utils import timezone
-                    cabinet.item_detected_at = timezone.now()
-
-                cabinet.save()
-            except Exception as e:
-                # 记录错误日志
-                DeviceLog.objects.create(
-                    device=device,
-                    log_type='error',
-                    message=f'更新柜子状态失败: {str(e)}',
-                    data={'cabinet_id': cabinet_id, 'status_data': status_data}
-                )
-
-        # 更新电量
-        battery_level = serializer.validated_data.get('battery_level')
-        if battery_level is not None:
-            device.battery_level = battery_level
-        device.last_heartbeat = timezone.now()
-        device.status = 'online'
-        device.save()
+    def poll(self, request, ack_ids):
+        device = request.auth
+        try:
+            limit = min(int(request.data.get('limit') or request.query_params.get('limit') or 10), 50)
+        except (TypeError, ValueError):
+            limit = 10
 
-        # 记录日志
-        DeviceLog.objects.create(
-            device=device,
-            log_type='status',
-            message='状态上报',
-            data={'cabinet_status': cabinet_status, 'battery_level': battery_level}
-        )
+        acked = ack_commands(device, ack_ids)
+        commands = lease_commands(device, limit=limit)
 
         return Response({
             'code': 0,
-            'message': '状态更新成功'
+            'message': '有待执行指令' if commands else '无待执行指令',
+            'data': {
+                'acked': acked,
+                'commands': [serialize_command(cmd) for cmd in commands]
+            }
         })
 
 
 @method_decorator(csrf_exempt, name='dispatch')
-class DeviceOpenCabinetView(APIView):
+class DeviceCommandWaitView(View):
+    """
+    设备指令长轮询（异步视图，需通过 ASGI 部署）
+
+    请求挂起直到有该设备的指令入队或超时，等待期间不占用同步工作进程。
+    请求/响应格式与 DeviceCommandPollView 相同，另支持 ?timeout=秒。
+    """
+
+    async def get(self, request):
+        return await self.wait(request, [])
+
+    async def post(self, request):
+        try:
+            if request.content_type == MSGPACK_MEDIA_TYPE:
+                body = unpackb(request.body) if request.body else {}
+            else:
+                body = json.loads(request.body or b'{}')
+            ack_ids = [int(command_id) for command_id in body.get('ack') or []]
+        except (TypeError, ValueError, AttributeError, MessagePackError):
+            return self.error(request, 400, 'ack 必须是指令ID列表')
+        return await self.wait(request, ack_ids)
+
+    async def wait(self, request, ack_ids):
+        api_key = request.headers.get('X-API-Key')
+        if not api_key:
+            return self.error(request, 400, '缺少API密钥')
+
+        # ORM 调用放到线程池执行，避免所有长轮询串行在同一个线程上
+        device = await sync_to_async(device_key_cache.get, thread_sensitive=False)(api_key)
+        if device is None:
+            return self.error(request, 401, '无效的API密钥')
+
+        max_timeout = getattr(settings, 'DEVICE_LONGPOLL_TIMEOUT', 25)
+        try:
+            timeout = float(request.GET.get('timeout', max_timeout))
+        except ValueError:
+            timeout = max_timeout
+        # nan 与任何数比较都为假，夹取后仍是 nan，等待循环永远不会到期
+        timeout = min(max(timeout, 0), max_timeout) if math.isfinite(timeout) else max_timeout
+
+        acked = 0
+        if ack_ids:
+            acked = await sync_to_async(ack_commands, thread_sensitive=False)(device, ack_ids)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        with command_notifier.subscribe(device.pk) as arrived:
+            while True:
+                arrived.clear()
+                commands = await sync_to_async(lease_commands, thread_sensitive=False)(device)
+                remaining = deadline - loop.time()
+                if commands or remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+        return self.respond(request, {
+            'code': 0,
+            'message': '有待执行指令' if commands else '无待执行指令',
+            'data': {
+                'acked': acked,
+                'commands': [serialize_command(cmd) for cmd in commands]
+            }
+        })
+
+    def error(self, request, code, message):
+        return self.respond(request, {'code': code, 'message': message}, status=code)
+
+    def respond(self, request, data, status=200):
+        """按 Accept 返回 JSON 或紧凑 MessagePack"""
+        if MSGPACK_MEDIA_TYPE in request.headers.get('Accept', ''):
+            return HttpResponse(packb(compact_response(data)), content_type=MSGPACK_MEDIA_TYPE, status=status)
+        return JsonResponse(data, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class DeviceOpenCabinetView(DeviceAPIView):
     """开柜指令接口（供ESP32轮询获取）"""
     permission_classes = [AllowAny]
 
     def get(self, request, device_id):
         """ESP32 轮询此接口获取待执行的指令"""
-        # 获取并验证API密钥（可选，支持向后兼容）
-        api_key = request.headers.get('X-API-Key') or request.data.get('api_key')
-
-        try:
-            device = Device.objects.get(device_id=device_id)
-            # 验证API密钥（如果提供了）
-            if api_key and device.api_key != api_key:
-                return Response({
-                    'code': 401,
-                    'message': 'API密钥验证失败'
-                }, status=status.HTTP_401_UNAUTHORIZED)
-        except Device.DoesNotExist:
-            return Response({
-                'code': 404,
-                'message': '设备不存在'
-            }, status=status.HTTP_404_NOT_FOUND)
+        # API密钥可选，支持向后兼容
+        device, error_response = self.get_polling_device(request, device_id)
+        if error_response:
+            return error_response
 
-        # 检查是否有待执行的开柜指令
-        pending_commands = DeviceLog.objects.filter(
-            device=device,
-            log_type='open',
-            created_at__gte=device.last_heartbeat or timezone.now() - timezone.timedelta(minutes=1)
-        ).order_by('-created_at')[:1]
+        # 领取最早一条待执行的开柜指令（旧版固件不回传确认，领取即确认）
+        pending_commands = lease_commands(device, 'open_cabinet', limit=1, auto_ack=True)
 
         if pending_commands:
             cmd = pending_commands[0]
             return Response({
                 'code': 0,
                 'message': '有待执行指令',
-                'data': {
-                    'command': 'open_cabinet',
-                    'cabinet_id': cmd.data.get('cabinet_id'),
-                    'timestamp': cmd.created_at.isoformat()
-                }
+                'data': serialize_command(cmd)
             })
 
         return Response({
@@ -200,8 +320,6 @@ class DeviceOpenCabinetView(APIView):
 
     def post(self, request, device_id):
         """后端发送开柜指令到设备（通过WebSocket或轮询机制）"""
-        api_key = request.headers.get('X-API-Key') or request.data.get('api_key')
-
         try:
             device = Device.objects.get(device_id=device_id, is_active=True)
         except Device.DoesNotExist:
@@ -210,7 +328,7 @@ class DeviceOpenCabinetView(APIView):
                 'message': '设备不存在'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        if api_key and device.api_key != api_key:
+        if request.auth is not None and request.auth.pk != device.pk:
             return Response({
                 'code': 401,
                 'message': 'API密钥验证失败'
@@ -241,7 +359,8 @@ class DeviceOpenCabinetView(APIView):
                 'message': '无效的取件码或订单已过期'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # 记录开柜指令（ESP32轮询获取）
+        # 下发开柜指令（ESP32轮询获取）并记录日志
+        enqueue_command(device, 'open_cabinet', {'cabinet_id': cabinet_id, 'order_id': order.id})
         DeviceLog.objects.create(
             device=device,
             log_type='open',
@@ -309,7 +428,8 @@ class OpenCabinetByCodeView(APIView):
                 'message': '柜子未绑定设备'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # 记录开柜指令
+        # 下发开柜指令并记录日志
+        enqueue_command(device, 'open_cabinet', {'cabinet_id': cabinet_id, 'order_id': order.id})
         DeviceLog.objects.create(
             device=device,
             log_type='open',
@@ -317,15 +437,16 @@ class OpenCabinetByCodeView(APIView):
             data={'cabinet_id': cabinet_id, 'pickup_code': pickup_code, 'order_id': order.id}
         )
 
-        # 更新订单状态
-        if order.status == 'paid':
-            order.status = 'in_use'
-            order.save()
+        with transaction.atomic():
+            # 更新订单状态
+            if order.status == 'paid':
+                order.status = 'in_use'
+                order.save()
 
-        # 更新柜子状态
-        cabinet.is_locked = False
-        cabinet.status = 'in_use'
-        cabinet.save()
+            # 更新柜子状态（同一事务内更新站点可用性索引）
+            cabinet.is_locked = False
+            cabinet.status = 'in_use'
+            cabinet.save(event_source='order', order_id=order.id)
 
         return Response({
             'code': 0,
@@ -346,6 +467,7 @@ class DeviceViewSet(viewsets.ModelViewSet):
     """设备管理视图集"""
     queryset = Device.objects.all()
     permission_classes = [IsAdminUser]
+    query_budget = {'list': 4, 'retrieve': 5}
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -370,16 +492,73 @@ class DeviceViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         # 自动生成API密钥
         if not serializer.validated_data.get('api_key'):
-            serializer.save(api_key=str(uuid.uuid4()).replace('-', ''))
+            serializer.save(api_key=generate_api_key())
         else:
             serializer.save()
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        批量开通设备（整批校验，单个事务写入）
+
+        请求体: {"devices": [{"device_id", "name", "station", "location", "api_key"（可选）,
+                              "cabinet_ids": [...]}],
+                 "cabinets": [{"cabinet_id", "size", "location", "station", "price_per_hour"}],
+                 "dry_run": false}
+        返回每台设备的 API 密钥；任一行校验失败时不写入，errors 中给出逐行错误。
+        """
+        if not isinstance(request.data, dict):
+            return Response({
+                'code': 400,
+                'message': '请求体必须是 JSON 对象'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # 与序列化器的布尔字段一致："false"、"0" 等字符串为假
+            dry_run = serializers.BooleanField().to_internal_value(request.data.get('dry_run', False))
+        except serializers.ValidationError:
+            return Response({
+                'code': 400,
+                'message': 'dry_run 必须是布尔值'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        devices = request.data.get('devices') or []
+        cabinets = request.data.get('cabinets') or []
+        if not isinstance(devices, list) or not isinstance(cabinets, list) or not devices + cabinets:
+            return Response({
+                'code': 400,
+                'message': 'devices / cabinets 必须是非空列表'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            result = provision(devices, cabinets, dry_run=dry_run)
+        except ProvisioningError as e:
+            return Response({
+                'code': 400,
+                'message': '数据校验失败',
+                'errors': e.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'code': 0,
+            'message': '校验通过' if dry_run else '批量开通成功',
+            'data': result
+        }, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)
+
 
 class DeviceLogsView(APIView):
     """设备日志查询"""
     permission_classes = [IsAdminUser]
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [NDJSONRenderer]
+    query_budget = 5
 
     def get(self, request, device_id):
+        """
+        查询参数:
+        - log_type: 日志类型，多个用逗号分隔
+        - start / end: ISO 8601 时间或日期（start 含、end 不含）；指定 start 时包含归档日志
+        - limit: 每页条数（默认100，最大1000）；cursor: 上一页返回的 next_cursor
+        - format=ndjson: 以 NDJSON 流式导出全部匹配的日志（忽略 limit / cursor）
+        """
         try:
             device = Device.objects.get(device_id=device_id)
         except Device.DoesNotExist:
@@ -388,58 +567,155 @@ class DeviceLogsView(APIView):
                 'message': '设备不存在'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        logs = DeviceLog.objects.filter(device=device)[:100]
-        serializer = DeviceLogSerializer(logs, many=True)
+        try:
+            log_types = parse_log_types(request.query_params.get('log_type'))
+            start = parse_log_time(request.query_params.get('start'))
+            end = parse_log_time(request.query_params.get('end'))
+            before = decode_cursor(request.query_params.get('cursor'))
+            limit = min(max(int(request.query_params.get('limit', 100)), 1), 1000)
+        except ValueError:
+            return Response({
+                'code': 400,
+                'message': '参数格式错误'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.accepted_renderer.format == 'ndjson':
+            rows = iter_logs(device, log_types, start, end)
+            response = StreamingHttpResponse(ndjson_lines(device, rows), content_type=NDJSON_MEDIA_TYPE)
+            response['Content-Disposition'] = f'attachment; filename="{device.device_id}-logs.ndjson"'
+            return response
+
+        rows = list(islice(iter_logs(device, log_types, start, end, before), limit + 1))
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
         return Response({
             'code': 0,
             'message': 'success',
-            'data': serializer.data
+            'data': [format_log(device, row) for row in rows[:limit]],
+            'next_cursor': next_cursor,
+        })
+
+
+class DeviceTelemetryView(APIView):
+    """设备遥测时间序列（电量、柜锁传感器读数，按桶聚合）"""
+    permission_classes = [IsAdminUser]
+    query_budget = 5
+
+    def get(self, request):
+        """
+        查询参数:
+        - metric: battery（按设备）/ lock_angle / lock_locked / has_item（按柜子）
+        - start / end: ISO 8601 时间或日期（默认最近 24 小时）
+        - bucket: 桶宽（秒），小于 300 时使用原始采样，否则须为 300 的整数倍；默认按时间范围选择
+        - device / cabinet / station: 过滤条件，多个用逗号分隔（柜子指标的 device 表示其绑定的柜子）
+        - group: object（每台设备/每个柜子一条序列，默认）/ station / fleet
+        返回共用的桶起始时间 timestamps（Unix 时间）和每条序列逐桶的 min / max / avg / count
+        """
+        from apps.cabinets.models import Cabinet
+
+        params = request.query_params
+        metric = params.get('metric')
+        group = params.get('group', 'object')
+        if metric not in METRICS or group not in ('object', 'station', 'fleet'):
+            return Response({
+                'code': 400,
+                'message': '参数格式错误'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            end = parse_log_time(params.get('end')) or timezone.now()
+            start = parse_log_time(params.get('start')) or end - timedelta(days=1)
+            start_ts, end_ts = int(start.timestamp()), int(end.timestamp())
+            bucket = int(params['bucket']) if params.get('bucket') else auto_bucket(end_ts - start_ts)
+            if start_ts >= end_ts or bucket <= 0:
+                raise ValueError
+        except ValueError:
+            return Response({
+                'code': 400,
+                'message': '参数格式错误'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if (end_ts - start_ts) // bucket >= MAX_BUCKETS:
+            return Response({
+                'code': 400,
+                'message': f'桶数超过 {MAX_BUCKETS}，请缩小时间范围或增大 bucket'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        def split(name):
+            return [value.strip() for value in params.get(name, '').split(',') if value.strip()]
+
+        if METRICS[metric] == 'device':
+            objects = Device.objects.all()
+            label = 'device_id'
+            if split('device'):
+                objects = objects.filter(device_id__in=split('device'))
+        else:
+            objects = Cabinet.objects.all()
+            label = 'cabinet_id'
+            if split('cabinet'):
+                objects = objects.filter(cabinet_id__in=split('cabinet'))
+            if split('device'):
+                objects = objects.filter(devices__device_id__in=split('device')).distinct()
+        if split('station'):
+            objects = objects.filter(station__in=split('station'))
+        labels = {pk: (name, station) for pk, name, station in objects.values_list('pk', label, 'station')}
+
+        try:
+            tier, first, n, results = query_telemetry(metric, list(labels), start_ts, end_ts, bucket)
+        except ValueError:
+            return Response({
+                'code': 400,
+                'message': 'bucket 须小于 300 或为 300 的整数倍'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if group == 'object':
+            series = [
+                {'id': labels[pk][0], 'station': labels[pk][1], **format_stats(stats)}
+                for pk, stats in sorted(results.items(), key=lambda item: labels[item[0]])
+            ]
+        elif group == 'station':
+            stations = {}
+            for pk, stats in results.items():
+                stations.setdefault(labels[pk][1], []).append(stats)
+            series = [
+                {'id': station, 'station': station, 'objects': len(stats_list), **format_stats(combine(stats_list, n))}
+                for station, stats_list in sorted(stations.items())
+            ]
+        else:
+            series = [{'id': 'fleet', 'objects': len(results), **format_stats(combine(list(results.values()), n))}]
+
+        return Response({
+            'code': 0,
+            'message': 'success',
+            'data': {
+                'metric': metric,
+                'bucket': bucket,
+                'tier': tier,
+                'timestamps': [first + index * bucket for index in range(n)],
+                'series': series,
+            }
         })
 
 
 @method_decorator(csrf_exempt, name='dispatch')
-class DeviceStatusQueryView(APIView):
+class DeviceStatusQueryView(DeviceAPIView):
     """服务器主动查询柜子状态（ESP32响应）"""
     permission_classes = [AllowAny]
 
     def get(self, request, device_id):
         """ESP32 轮询获取服务器下发的状态查询指令"""
-        # 获取并验证API密钥（可选，支持向后兼容）
-        api_key = request.headers.get('X-API-Key') or request.data.get('api_key')
+        # API密钥可选，支持向后兼容
+        device, error_response = self.get_polling_device(request, device_id)
+        if error_response:
+            return error_response
 
-        try:
-            device = Device.objects.get(device_id=device_id)
-            # 验证API密钥（如果提供了）
-            if api_key and device.api_key != api_key:
-                return Response({
-                    'code': 401,
-                    'message': 'API密钥验证失败'
-                }, status=status.HTTP_401_UNAUTHORIZED)
-        except Device.DoesNotExist:
-            return Response({
-                'code': 404,
-                'message': '设备不存在'
-            }, status=status.HTTP_404_NOT_FOUND)
-
-        # 检查是否有待执行的查询指令
-        pending_query = DeviceLog.objects.filter(
-            device=device,
-            log_type='status_query',
-            created_at__gte=device.last_heartbeat or timezone.now() - timezone.timedelta(minutes=1)
-        ).order_by('-created_at')[:1]
+        # 领取待执行的查询指令（返回需要查询的柜子ID列表）
+        pending_query = lease_commands(device, 'query_status', limit=1, auto_ack=True)
 
         if pending_query:
-            query_log = pending_query[0]
-            # 返回需要查询的柜子ID列表
-            cabinet_ids = query_log.data.get('cabinet_ids', [])
             return Response({
                 'code': 0,
                 'message': '有待查询指令',
-                'data': {
-                    'command': 'query_status',
-                    'cabinet_ids': cabinet_ids,
-                    'timestamp': query_log.created_at.isoformat()
-                }
+                'data': serialize_command(pending_query[0])
             })
 
         return Response({
@@ -449,44 +725,117 @@ class DeviceStatusQueryView(APIView):
         })
 
 
-class CabinetStatusQueryView(APIView):
-    """服务器主动查询柜子状态（管理员调用）"""
-    permission_classes = [IsAdminUser]
+class CabinetStatusQueryView(View):
+    """
+    服务器主动查询柜子状态（管理员调用，异步视图，需通过 ASGI 部署）
 
-    def get(self, request, device_id):
+    下发 query_status 指令，指令ID即本次查询的 query_id，设备响应时在状态上报中回传。
+    指定 ?wait_ms= 时请求挂起直到设备回传或超时（最长 DEVICE_STATUS_QUERY_MAX_WAIT 秒），
+    一次往返即可拿到设备刚上报的状态，等待期间不占用同步工作进程。
+    指定 ?query_id= 时不再下发新指令，只查询（或继续等待）该次查询的结果。
+    """
+
+    async def get(self, request, device_id):
         """查询指定设备的柜子状态"""
+        try:
+            user = await sync_to_async(self.authenticate)(request)
+        except exceptions.AuthenticationFailed as e:
+            return self.respond({'code': 401, 'message': str(e.detail)}, status=401)
+        if not user.is_authenticated:
+            return self.respond({'code': 401, 'message': '身份认证信息未提供'}, status=401)
+        if not user.is_staff:
+            return self.respond({'code': 403, 'message': '您没有执行该操作的权限'}, status=403)
+
+        max_wait = getattr(settings, 'DEVICE_STATUS_QUERY_MAX_WAIT', 10)
+        try:
+            wait = min(max(int(request.GET.get('wait_ms', 0)), 0) / 1000, max_wait)
+            query_id = int(request.GET['query_id']) if request.GET.get('query_id') else None
+        except ValueError:
+            return self.respond({'code': 400, 'message': '参数格式错误'}, status=400)
+
+        # ORM 调用放到线程池执行
+        device, command, error = await sync_to_async(self.start_query, thread_sensitive=False)(device_id, query_id)
+        if error:
+            return self.respond({'code': error[0], 'message': error[1]}, status=error[0])
+
+        # 先订阅再查库：订阅前已回传的结果由首次查库取得；代理通知丢失时按间隔查库兜底
+        recheck = getattr(settings, 'DEVICE_LONGPOLL_RECHECK_INTERVAL', 0.5)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        with reply_notifier.subscribe(command.pk) as replied:
+            while True:
+                replied.clear()
+                result = await sync_to_async(self.query_result, thread_sensitive=False)(command.pk)
+                remaining = deadline - loop.time()
+                if result is not None or remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(replied.wait(), min(remaining, recheck))
+                except asyncio.TimeoutError:
+                    pass
+
+        cabinet_data = await sync_to_async(self.cabinet_states, thread_sensitive=False)(device)
+        return self.respond({
+            'code': 0,
+            'message': '设备已响应' if result is not None else '查询指令已下发，请等待设备响应',
+            'data': {
+                'device_id': device.device_id,
+                'status': device.status,
+                'last_heartbeat': device.last_heartbeat.isoformat() if device.last_heartbeat else None,
+                'query_id': command.pk,
+                'answered': result is not None,
+                'result': result,
+                'cabinets': cabinet_data
+            }
+        })
+
+    @staticmethod
+    def authenticate(request):
+        """按 DRF 默认认证方式（JWT / Session）解析用户"""
+        drf_request = Request(request, authenticators=[
+            authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        ])
+        return drf_request.user
+
+    @staticmethod
+    def start_query(device_id, query_id):
+        """返回 (设备, 查询指令, 错误)；未指定 query_id 时下发新的查询指令"""
         try:
             device = Device.objects.get(device_id=device_id)
         except Device.DoesNotExist:
-            return Response({
-                'code': 404,
-                'message': '设备不存在'
-            }, status=status.HTTP_404_NOT_FOUND)
+            return None, None, (404, '设备不存在')
+
+        if query_id is not None:
+            command = DeviceCommand.objects.filter(pk=query_id, device=device, command='query_status').first()
+            if command is None:
+                return device, None, (404, '查询不存在')
+            return device, command, None
 
         # 检查设备是否在线
         if not device.is_online():
-            return Response({
-                'code': 400,
-                'message': '设备离线，无法查询'
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return device, None, (400, '设备离线，无法查询')
 
         # 获取绑定柜子ID列表
         cabinet_ids = list(device.bound_cabinets.values_list('cabinet_id', flat=True))
 
-        # 记录查询指令（ESP32轮询获取）
+        # 下发查询指令（ESP32 领取后执行，状态上报时回传指令ID）并记录日志
+        command = enqueue_command(device, 'query_status', {'cabinet_ids': cabinet_ids})
         DeviceLog.objects.create(
             device=device,
             log_type='status_query',
-            message=f'服务器查询柜子状态',
-            data={'cabinet_ids': cabinet_ids, 'query_time': timezone.now().isoformat()}
+            message='服务器查询柜子状态',
+            data={'cabinet_ids': cabinet_ids, 'query_id': command.pk, 'query_time': timezone.now().isoformat()}
         )
+        return device, command, None
 
-        # 等待 ESP32 上报状态（这里返回已记录的本地状态）
-        from apps.cabinets.models import Cabinet
-        cabinets = device.bound_cabinets.all()
-        cabinet_data = []
-        for cabinet in cabinets:
-            cabinet_data.append({
+    @staticmethod
+    def query_result(command_id):
+        return DeviceCommand.objects.filter(pk=command_id).values_list('result', flat=True).first()
+
+    @staticmethod
+    def cabinet_states(device):
+        return [
+            {
                 'cabinet_id': cabinet.cabinet_id,
                 'door_closed': not cabinet.is_locked,
                 'lock_angle': cabinet.lock_angle,
@@ -494,15 +843,10 @@ class CabinetStatusQueryView(APIView):
                 'has_item': cabinet.has_item,
                 'item_detected_at': cabinet.item_detected_at.isoformat() if cabinet.item_detected_at else None,
                 'last_updated': cabinet.updated_at.isoformat()
-            })
-
-        return Response({
-            'code': 0,
-            'message': '查询指令已下发，请等待设备响应',
-            'data': {
-                'device_id': device.device_id,
-                'status': device.status,
-                'last_heartbeat': device.last_heartbeat.isoformat() if device.last_heartbeat else None,
-                'cabinets': cabinet_data
             }
-        })
+            for cabinet in device.bound_cabinets.all()
+        ]
+
+    @staticmethod
+    def respond(data, status=200):
+        return JsonResponse(data, status=status, json_dumps_params={'ensure_ascii': False})
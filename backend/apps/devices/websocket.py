@@ -0,0 +1,238 @@
+"""
+设备 WebSocket 通道（ASGI，挂载于 /ws/devices/，见 waylink/asgi.py）
+
+设备通过 X-API-Key 请求头或 ?api_key= 查询参数认证后保持一条长连接。
+
+服务器推送:
+    {"type": "command", "commands": [{"id": 1, "command": "open_cabinet", ...}]}
+设备发送:
+    {"type": "heartbeat", "battery_level": 80}
+    {"type": "status", "cabinet_status": {...}, "battery_level": 80, "state_hash": "..."}
+    {"type": "ack", "ids": [1]}
+每条设备消息回复 {"type": <消息类型>, "code": 0}，失败时附带 message；
+带 state_hash 的状态上报另外回复 state_hash / resync（见 DeviceStatusReportView）。
+
+推送的指令需通过 ack 确认，语义与 /api/devices/commands/poll/ 相同。
+指令入队后经消息代理广播，任一工作进程入队的指令都能送达持有该连接的进程；
+同一设备在其他进程重新连接时，旧连接会被关闭。
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import uuid
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+
+from .authentication import device_key_cache
+from .broker import get_broker
+from .commands import ack_commands, lease_commands, serialize_command
+from .heartbeat import heartbeat_buffer
+from .notify import command_notifier
+from .serializers import DeviceHeartbeatSerializer, DeviceStatusReportSerializer
+from .services import apply_status_report
+
+logger = logging.getLogger(__name__)
+
+CONNECTION_CHANNEL = 'device-connections'
+
+# 设备关闭码
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_REPLACED = 4409
+
+
+def run_sync(func):
+    """ORM 调用放到线程池执行（不串行在单一线程上）"""
+    return sync_to_async(func, thread_sensitive=False)
+
+
+class DeviceConnectionRegistry:
+    """本进程持有的设备连接；通过消息代理保证每台设备只保留最新的一条连接"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._subscribed_pid = None
+
+    def register(self, session):
+        self._ensure_subscribed()
+        with self._lock:
+            previous = self._sessions.get(session.device.pk)
+            self._sessions[session.device.pk] = session
+        if previous is not None:
+            previous.close_threadsafe(CLOSE_REPLACED)
+        get_broker().publish(CONNECTION_CHANNEL, {'device': session.device.pk, 'session': session.id})
+
+    def unregister(self, session):
+        with self._lock:
+            if self._sessions.get(session.device.pk) is session:
+                del self._sessions[session.device.pk]
+
+    def is_connected(self, device_pk):
+        with self._lock:
+            return device_pk in self._sessions
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _ensure_subscribed(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._subscribed_pid == pid:
+                return
+            self._subscribed_pid = pid
+        get_broker().subscribe(CONNECTION_CHANNEL, self._on_connected)
+
+    def _on_connected(self, message):
+        """其他连接（可能在其他进程）接管了设备，关闭本进程的旧连接"""
+        with self._lock:
+            session = self._sessions.get(message.get('device'))
+        if session is not None and session.id != message.get('session'):
+            session.close_threadsafe(CLOSE_REPLACED)
+
+
+connection_registry = DeviceConnectionRegistry()
+
+
+class DeviceSession:
+    """单个设备连接"""
+
+    def __init__(self, device, send):
+        self.device = device
+        self.id = uuid.uuid4().hex
+        self.loop = asyncio.get_running_loop()
+        self._send = send
+        self._send_lock = asyncio.Lock()
+        self._closed = False
+
+    async def send_json(self, data):
+        async with self._send_lock:
+            if self._closed:
+                return
+            await self._send({'type': 'websocket.send', 'text': json.dumps(data, ensure_ascii=False)})
+
+    async def close(self, code=1000):
+        async with self._send_lock:
+            if self._closed:
+                return
+            self._closed = True
+            await self._send({'type': 'websocket.close', 'code': code})
+
+    def close_threadsafe(self, code=1000):
+        asyncio.run_coroutine_threadsafe(self.close(code), self.loop)
+
+    async def push_commands(self):
+        """有指令入队时领取并推送"""
+        try:
+            with command_notifier.subscribe(self.device.pk) as arrived:
+                while not self._closed:
+                    arrived.clear()
+                    commands = await run_sync(lease_commands)(self.device)
+                    if commands:
+                        await self.send_json({
+                            'type': 'command',
+                            'commands': [serialize_command(cmd) for cmd in commands]
+                        })
+                        continue
+                    await arrived.wait()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('设备指令推送失败: %s', self.device.device_id)
+            await self.close(1011)
+
+    async def handle(self, raw):
+        """处理设备消息，返回回执"""
+        try:
+            message = json.loads(raw)
+            message_type = message['type']
+        except (TypeError, ValueError, KeyError):
+            return {'type': 'error', 'code': 400, 'message': '消息格式错误'}
+
+        if message_type == 'heartbeat':
+            serializer = DeviceHeartbeatSerializer(data=message)
+            if not serializer.is_valid():
+                return {'type': 'heartbeat', 'code': 400, 'message': '数据格式错误', 'errors': serializer.errors}
+            await run_sync(heartbeat_buffer.record)(self.device, serializer.validated_data.get('battery_level'))
+            return {'type': 'heartbeat', 'code': 0}
+
+        if message_type == 'status':
+            return await run_sync(self._apply_status)(message)
+
+        if message_type == 'ack':
+            try:
+                command_ids = [int(command_id) for command_id in message.get('ids') or []]
+            except (TypeError, ValueError):
+                return {'type': 'ack', 'code': 400, 'message': 'ids 必须是指令ID列表'}
+            acked = await run_sync(ack_commands)(self.device, command_ids)
+            return {'type': 'ack', 'code': 0, 'acked': acked}
+
+        return {'type': message_type, 'code': 400, 'message': '未知消息类型'}
+
+    def _apply_status(self, message):
+        serializer = DeviceStatusReportSerializer(data=message)
+        if not serializer.is_valid():
+            return {'type': 'status', 'code': 400, 'message': '数据格式错误', 'errors': serializer.errors}
+        result = apply_status_report(
+            self.device,
+            serializer.validated_data['cabinet_status'],
+            serializer.validated_data.get('battery_level'),
+            serializer.validated_data.get('state_hash'),
+            serializer.validated_data.get('query_id')
+        )
+        reply = {'type': 'status', 'code': 0}
+        if result['state_hash'] is not None:
+            reply.update(state_hash=result['state_hash'], resync=result['resync'])
+        return reply
+
+
+class DeviceWebSocketApp:
+    """设备 WebSocket 的 ASGI 应用"""
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+
+        device = await self.authenticate(scope)
+        if device is None:
+            await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+            return
+
+        await send({'type': 'websocket.accept'})
+        session = DeviceSession(device, send)
+        connection_registry.register(session)
+        # 建立连接视为一次心跳
+        await run_sync(heartbeat_buffer.record)(device)
+
+        pusher = asyncio.create_task(session.push_commands())
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message['type'] == 'websocket.receive':
+                    reply = await session.handle(message.get('text') or message.get('bytes'))
+                    await session.send_json(reply)
+        except Exception:
+            logger.exception('设备连接异常: %s', device.device_id)
+            await session.close(1011)
+        finally:
+            pusher.cancel()
+            connection_registry.unregister(session)
+
+    async def authenticate(self, scope):
+        headers = dict(scope.get('headers') or [])
+        api_key = headers.get(b'x-api-key', b'').decode('latin-1')
+        if not api_key:
+            query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+            api_key = (query.get('api_key') or [''])[0]
+        if not api_key:
+            return None
+        return await run_sync(device_key_cache.get)(api_key)
+
+
+device_websocket_application = DeviceWebSocketApp()
@@ -0,0 +1,230 @@
+"""
+查询次数回归检查
+
+按几种数据规模分别造数据（每种规模在一个回滚的事务中），逐个请求主要接口并
+统计 SQL 查询次数。出现以下情况时命令失败（退出码非 0）：
+
+- 查询次数随数据行数增长（N+1 查询）；
+- 超过视图声明的 query_budget（见 waylink/querybudget.py）；
+- 接口返回错误。
+
+    python manage.py check_query_budgets
+    python manage.py check_query_budgets --sizes 2,20,100
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from apps.cabinets.availability import rebuild as rebuild_availability
+from apps.cabinets.models import Cabinet, CabinetEvent, CabinetSnapshot, Station
+from apps.cabinets.stations import station_index
+from apps.cabinets.versions import cabinet_versions
+from apps.devices.authentication import device_key_cache
+from apps.devices.models import Device, DeviceLog
+from apps.devices.state import cabinet_state_cache
+from apps.orders.models import Order
+from waylink.querybudget import QueryCounter, view_budget
+
+# (名称, 方法, 路径, 身份, 请求体)；路径中的 {device} / {cabinet} 替换为造出的数据
+ENDPOINTS = [
+    ('admin-stats', 'GET', '/api/admin/stats/', 'admin', None),
+    ('admin-revenue', 'GET', '/api/admin/revenue/', 'admin', None),
+    ('admin-orders', 'GET', '/api/admin/orders/', 'admin', None),
+    ('admin-cabinets', 'GET', '/api/admin/cabinets/', 'admin', None),
+    ('admin-cabinet-events', 'GET', '/api/admin/cabinets/events/?cabinet_id=QB00000', 'admin', None),
+    ('admin-cabinet-state', 'GET', '/api/admin/cabinets/state/?cabinet_id=QB00000', 'admin', None),
+    ('admin-devices', 'GET', '/api/admin/devices/', 'admin', None),
+    ('admin-stations', 'GET', '/api/admin/stations/', 'admin', None),
+    ('admin-alerts', 'GET', '/api/admin/alerts/', 'admin', None),
+    ('admin-uptime', 'GET', '/api/admin/uptime/', 'admin', None),
+    ('device-list', 'GET', '/api/devices/manage/', 'admin', None),
+    ('device-detail', 'GET', '/api/devices/manage/{device_pk}/', 'admin', None),
+    ('device-logs', 'GET', '/api/devices/{device}/logs/', 'admin', None),
+    ('device-telemetry', 'GET', '/api/devices/telemetry/?metric=battery&group=station', 'admin', None),
+    ('cabinet-list', 'GET', '/api/cabinets/', 'user', None),
+    ('cabinet-available', 'GET', '/api/cabinets/available/', 'user', None),
+    ('cabinet-nearby', 'GET', '/api/cabinets/nearby/?lat=31.2&lng=121.4&limit=20&radius=50000', 'user', None),
+    ('my-orders', 'GET', '/api/orders/my/', 'user', None),
+    ('device-heartbeat', 'POST', '/api/devices/heartbeat/', 'device', {'battery_level': 80}),
+    ('device-status', 'POST', '/api/devices/status/', 'device', 'status'),
+    ('device-poll', 'POST', '/api/devices/commands/poll/', 'device', {'ack': []}),
+]
+
+CABINETS_PER_DEVICE = 4
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = '检查主要接口的 SQL 查询次数是否随数据量增长、是否超出声明的预算'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,5,25', help='数据规模（设备数），逗号分隔')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted({int(size) for size in options['sizes'].split(',')})
+        except ValueError:
+            raise CommandError('--sizes 格式错误')
+        if len(sizes) < 2 or sizes[0] < 1:
+            raise CommandError('至少需要两种大于 0 的规模')
+
+        # 心跳和遥测同步写库（随事务回滚）；不写共享的在线状态表；关闭响应缓存以统计实际查询；预算由本命令检查
+        with override_settings(
+            QUERY_BUDGET_MODE='off', DEVICE_HEARTBEAT_FLUSH_INTERVAL=0, DEVICE_TELEMETRY_FLUSH_INTERVAL=0,
+            DEVICE_PRESENCE_PATH=None, RESPONSE_CACHE_ENABLED=False, ALLOWED_HOSTS=['*'],
+        ):
+            counts = {name: [] for name, *_ in ENDPOINTS}
+            failures = []
+            for size in sizes:
+                for name, count, error in self.measure(size):
+                    counts[name].append(count)
+                    if error:
+                        failures.append(f'{name}（规模 {size}）: {error}')
+
+        self.stdout.write(f'{"接口":<20}{"预算":>6}' + ''.join(f'{f"n={size}":>8}' for size in sizes))
+        for name, method, path, *_ in ENDPOINTS:
+            budget = self.budget(method, path)
+            row = counts[name]
+            status = ''
+            if row[-1] > row[0]:
+                status = '随数据量增长'
+            elif budget is not None and max(row) > budget:
+                status = '超出预算'
+            if status:
+                failures.append(f'{name}: {status} {row}')
+            self.stdout.write(
+                f'{name:<20}{budget if budget is not None else "-":>6}'
+                + ''.join(f'{count:>8}' for count in row) + (f'  <- {status}' if status else '')
+            )
+
+        if failures:
+            for failure in failures:
+                self.stderr.write(failure)
+            raise CommandError(f'{len(failures)} 项检查未通过')
+        self.stdout.write(self.style.SUCCESS('全部接口的查询次数与数据量无关且在预算内'))
+
+    @staticmethod
+    def budget(method, path):
+        match = resolve(path.format(device='QB-0', device_pk=1).split('?')[0])
+        return view_budget(match.func, method)
+
+    def measure(self, size):
+        """造数据、逐个请求接口，返回 [(名称, 查询次数, 错误)]；数据随事务回滚"""
+        results = []
+        try:
+            with transaction.atomic():
+                fixtures = self.seed(size)
+                device_key_cache.clear()
+                cabinet_state_cache.clear()
+                cabinet_versions.clear()
+                station_index.invalidate(broadcast=False)
+                client = Client()
+                for name, method, path, identity, body in ENDPOINTS:
+                    if body == 'status':
+                        body = {'cabinet_status': {
+                            cabinet_id: {'door': True, 'lock_angle': 0, 'lock_locked': True, 'has_item': True}
+                            for cabinet_id in fixtures['cabinet_ids']
+                        }}
+                    url = path.format(device=fixtures['device'].device_id, device_pk=fixtures['device'].pk)
+                    headers = fixtures['headers'][identity]
+                    # 每个接口先请求一次预热进程内缓存，统计第二次请求
+                    self.request(client, method, url, body, headers)
+                    with QueryCounter() as counter:
+                        response = self.request(client, method, url, body, headers)
+                    error = None if response.status_code < 300 else f'HTTP {response.status_code}'
+                    results.append((name, counter.count, error))
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            device_key_cache.clear()
+            cabinet_state_cache.clear()
+            cabinet_versions.clear()
+            station_index.invalidate(broadcast=False)
+        return results
+
+    @staticmethod
+    def request(client, method, url, body, headers):
+        if method == 'GET':
+            return client.get(url, **headers)
+        return client.post(url, body or {}, content_type='application/json', **headers)
+
+    def seed(self, size):
+        User = get_user_model()
+        now = timezone.now()
+        admin = User.objects.create(username='qb-admin', phone='19900000000', is_staff=True, is_superuser=True)
+        users = User.objects.bulk_create([
+            User(username=f'qb-user-{i}', phone=f'1990001{i:04d}') for i in range(size)
+        ])
+
+        cabinets = Cabinet.objects.bulk_create([
+            Cabinet(
+                cabinet_id=f'QB{i:05d}', size=('small', 'medium', 'large')[i % 3], location='qb',
+                station=f'QB-S{i % 3}', status=('available', 'in_use', 'maintenance')[i % 3],
+            )
+            for i in range(size * CABINETS_PER_DEVICE)
+        ])
+        rebuild_availability()
+        Station.objects.bulk_create([
+            Station(code=f'QB-S{i}', name='qb', latitude=31.2 + i * 0.001, longitude=121.4 + i * 0.001)
+            for i in range(max(size, 3))
+        ])
+        devices = Device.objects.bulk_create([
+            Device(device_id=f'QB-{i}', station=f'QB-S{i % 3}', api_key=f'qb-key-{i}',
+                   status=('online', 'offline')[i % 2], battery_level=10 + i % 90, last_heartbeat=now)
+            for i in range(size)
+        ])
+        cabinets = list(Cabinet.objects.filter(cabinet_id__startswith='QB').order_by('cabinet_id'))
+        devices = list(Device.objects.filter(device_id__startswith='QB-').order_by('pk'))
+        through = Device.bound_cabinets.through
+        through.objects.bulk_create([
+            through(device_id=device.pk, cabinet_id=cabinets[i * CABINETS_PER_DEVICE + j].pk)
+            for i, device in enumerate(devices) for j in range(CABINETS_PER_DEVICE)
+        ])
+
+        users = list(User.objects.filter(username__startswith='qb-user-').order_by('pk'))
+        orders = []
+        for i in range(size * 3):
+            status = ('paid', 'in_use', 'completed')[i % 3]
+            orders.append(Order(
+                order_no=f'QB{i:08d}', user=users[i % len(users)], cabinet=cabinets[i % len(cabinets)],
+                status=status, price_per_hour=Decimal('2.00'), total_amount=Decimal('2.00'),
+                pickup_code=f'{i:06d}', end_time=now - timedelta(hours=1),
+            ))
+        Order.objects.bulk_create(orders)
+        CabinetSnapshot.objects.bulk_create([
+            CabinetSnapshot(cabinet=cabinet, state={'status': cabinet.status}, taken_at=now - timedelta(hours=2))
+            for cabinet in cabinets
+        ])
+        CabinetEvent.objects.bulk_create([
+            CabinetEvent(cabinet=cabinets[0], changes={'has_item': [i % 2 == 0, i % 2 == 1]}, source='device',
+                         created_at=now - timedelta(minutes=size * 5 - i))
+            for i in range(size * 5)
+        ])
+        DeviceLog.objects.bulk_create([
+            DeviceLog(device=devices[0], log_type=('open', 'status', 'online')[i % 3], message='qb')
+            for i in range(size * 5)
+        ])
+
+        def bearer(user):
+            return {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+        return {
+            'device': devices[0],
+            'cabinet_ids': [cabinet.cabinet_id for cabinet in cabinets[:CABINETS_PER_DEVICE]],
+            'headers': {
+                'admin': bearer(admin),
+                'user': bearer(users[0]),
+                'device': {'HTTP_X_API_KEY': devices[0].api_key},
+            },
+        }
@@ -4,8 +4,12 @@ from .views import (
     DashboardStatsView,
     AllOrdersView,
     AdminCabinetsView,
+    AdminCabinetEventsView,
+    AdminCabinetStateView,
     AdminDevicesView,
+    AdminStationsView,
     FaultAlertsView,
+    DeviceUptimeView,
     RevenueStatsView
 )
 
@@ -24,10 +28,18 @@ urlpatterns = [
 
     # 柜子管理
     path('cabinets/', AdminCabinetsView.as_view(), name='admin-cabinets'),
+    path('cabinets/events/', AdminCabinetEventsView.as_view(), name='admin-cabinet-events'),
+    path('cabinets/state/', AdminCabinetStateView.as_view(), name='admin-cabinet-state'),
 
     # 设备管理
     path('devices/', AdminDevicesView.as_view(), name='admin-devices'),
 
+    # 站点管理
+    path('stations/', AdminStationsView.as_view(), name='admin-stations'),
+
     # 故障预警
     path('alerts/', FaultAlertsView.as_view(), name='admin-alerts'),
+
+    # 设备可用率
+    path('uptime/', DeviceUptimeView.as_view(), name='admin-uptime'),
 ]
@@ -1,7 +1,8 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.utils import timezone
-from django.db import connection
-from django.db.models import Count, Avg, Sum
+from django.db import connection, transaction
+from django.db.models import Count, Avg, DateTimeField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
 from django.contrib.auth import get_user_model
 from rest_framework import viewsets, status
 from rest_framework.views import APIView
@@ -9,11 +10,45 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 
 from apps.orders.models import Order
-from apps.cabinets.models import Cabinet
+from apps.cabinets import history
+from apps.cabinets.models import Cabinet, CabinetEvent
+from apps.devices.authentication import device_key_cache
+from apps.devices.logs import parse_log_time
 from apps.devices.models import Device, DeviceLog
+from apps.devices.presence import presence_table
+from waylink.responsecache import cache_response
 
 User = get_user_model()
 
+# 按天统计的最大天数
+MAX_STATS_DAYS = 3660
+
+# 设备可用率报表的最大天数（按小时汇总聚合，跨度越大扫描的汇总行越多）
+MAX_UPTIME_DAYS = 366
+
+
+def daily_aggregate(queryset, days, now, **aggregates):
+    """
+    按天分组聚合（一次 GROUP BY 查询），返回 [(日期字符串, 聚合结果)]
+
+    第 i 天为 now 往前 days-i-1 天起的 24 小时；created_at 减去 now 与当天 UTC 零点的差后，
+    每个窗口恰好落在同一个 UTC 日期内，按日期分组即可。
+    """
+    day_starts = [now - timedelta(days=days - i - 1) for i in range(days)]
+    if not day_starts:
+        return []
+    shift = now - now.astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    rows = queryset.filter(created_at__gte=day_starts[0]).annotate(
+        day=TruncDate(
+            ExpressionWrapper(F('created_at') - shift, output_field=DateTimeField()), tzinfo=dt_timezone.utc
+        )
+    ).order_by().values('day').annotate(**aggregates)
+    by_day = {row.pop('day'): row for row in rows}
+    return [
+        (day_start.strftime('%Y-%m-%d'), by_day.get(day_start.astimezone(dt_timezone.utc).date(), {}))
+        for day_start in day_starts
+    ]
+
 
 class HealthCheckView(APIView):
     """健康检查端点"""
@@ -29,14 +64,14 @@ class HealthCheckView(APIView):
         except Exception as e:
             db_status = f'unhealthy: {str(e)}'
 
-        # 检查设备在线状态
+        # 检查设备在线状态（由离线检测进程维护，心跳超时的设备按离线计）
         device_status = 'healthy'
         try:
-            offline_threshold = timezone.now() - timedelta(minutes=10)
-            offline_count = Device.objects.filter(
-                is_active=True,
-                last_heartbeat__lt=offline_threshold
-            ).count()
+            counts = presence_table.counts(active_only=True)
+            if counts is not None:
+                offline_count = counts['offline']
+            else:
+                offline_count = Device.objects.filter(Device.offline_q(), is_active=True).count()
             if offline_count > 0:
                 device_status = f'warning: {offline_count} devices offline'
         except Exception as e:
@@ -50,6 +85,9 @@ class HealthCheckView(APIView):
             'checks': {
                 'database': db_status,
                 'devices': device_status,
+            },
+            'metrics': {
+                'device_auth_cache': device_key_cache.stats(),
             }
         }
 
@@ -60,56 +98,54 @@ class HealthCheckView(APIView):
 class DashboardStatsView(APIView):
     """运维仪表盘统计数据"""
     permission_classes = [IsAdminUser]
+    query_budget = 13
 
+    @cache_response(tags=['orders:stats', 'cabinets', 'devices'], timeout=30, scope='staff')
     def get(self, request):
         # 时间范围（默认最近7天）
-        days = int(request.query_params.get('days', 7))
+        days = min(int(request.query_params.get('days', 7)), MAX_STATS_DAYS)
         start_date = timezone.now() - timedelta(days=days)
 
         # 基本统计
         total_users = User.objects.count()
         total_orders = Order.objects.count()
-        total_cabinets = Cabinet.objects.count()
-        total_devices = Device.objects.count()
-
-        # 订单统计
-        orders = Order.objects.filter(created_at__gte=start_date)
-        order_stats = {
-            'total': orders.count(),
-            'completed': orders.filter(status='completed').count(),
-            'cancelled': orders.filter(status='cancelled').count(),
-            'total_amount': float(orders.aggregate(Sum('total_amount'))['total_amount__sum'] or 0),
-        }
+        device_counts = presence_table.counts()
+        total_devices = device_counts['total'] if device_counts is not None else Device.objects.count()
+
+        # 订单统计（一次聚合）
+        order_stats = Order.objects.filter(created_at__gte=start_date).aggregate(
+            total=Count('id'),
+            completed=Count('id', filter=Q(status='completed')),
+            cancelled=Count('id', filter=Q(status='cancelled')),
+            total_amount=Sum('total_amount'),
+        )
+        order_stats['total_amount'] = float(order_stats['total_amount'] or 0)
 
         # 柜子使用率
-        cabinet_stats = {
-            'total': total_cabinets,
-            'available': Cabinet.objects.filter(status='available').count(),
-            'in_use': Cabinet.objects.filter(status='in_use').count(),
-            'maintenance': Cabinet.objects.filter(status='maintenance').count(),
-        }
-
-        # 设备状态
-        device_stats = {
-            'total': total_devices,
-            'online': Device.objects.filter(status='online').count(),
-            'offline': Device.objects.filter(status='offline').count(),
-            'error': Device.objects.filter(status='error').count(),
-        }
+        cabinet_stats = Cabinet.objects.aggregate(
+            total=Count('id'),
+            available=Count('id', filter=Q(status='available')),
+            in_use=Count('id', filter=Q(status='in_use')),
+            maintenance=Count('id', filter=Q(status='maintenance')),
+        )
+        total_cabinets = cabinet_stats['total']
+
+        # 设备状态（优先读共享内存在线状态表）
+        if device_counts is not None:
+            device_stats = device_counts
+        else:
+            device_stats = {
+                'total': total_devices,
+                'online': Device.objects.filter(Device.online_q()).count(),
+                'offline': Device.objects.filter(Device.offline_q()).count(),
+                'error': Device.objects.filter(status='error').count(),
+            }
 
-        # 每日订单趋势
-        daily_orders = []
-        for i in range(days):
-            day_start = timezone.now() - timedelta(days=days - i - 1)
-            day_end = day_start + timedelta(days=1)
-            day_count = Order.objects.filter(
-                created_at__gte=day_start,
-                created_at__lt=day_end
-            ).count()
-            daily_orders.append({
-                'date': day_start.strftime('%Y-%m-%d'),
-                'count': day_count
-            })
+        # 每日订单趋势（按天分组，一次查询）
+        daily_orders = [
+            {'date': date, 'count': row.get('count', 0)}
+            for date, row in daily_aggregate(Order.objects.all(), days, timezone.now(), count=Count('id'))
+        ]
 
         # 高峰时段分析
         hourly_orders = Order.objects.filter(
@@ -146,9 +182,10 @@ class DashboardStatsView(APIView):
 class AllOrdersView(APIView):
     """所有订单列表（管理员）"""
     permission_classes = [IsAdminUser]
+    query_budget = 5
 
     def get(self, request):
-        queryset = Order.objects.all()
+        queryset = Order.objects.select_related('user', 'cabinet')
 
         # 筛选状态
         status_filter = request.query_params.get('status')
@@ -193,6 +230,7 @@ class AllOrdersView(APIView):
 class AdminCabinetsView(APIView):
     """柜子管理（管理员）"""
     permission_classes = [IsAdminUser]
+    query_budget = {'get': 4, 'put': 8}
 
     def get(self, request):
         """获取所有柜子"""
@@ -235,7 +273,8 @@ class AdminCabinetsView(APIView):
         for field in updatable_fields:
             if field in request.data:
                 setattr(cabinet, field, request.data[field])
-        cabinet.save()
+        with transaction.atomic():
+            cabinet.save(event_source='admin')
 
         from apps.cabinets.serializers import CabinetSerializer
         return Response({
@@ -245,13 +284,124 @@ class AdminCabinetsView(APIView):
         })
 
 
+class AdminCabinetEventsView(APIView):
+    """柜子状态事件查询（管理员，纠纷处理与统计分析）"""
+    permission_classes = [IsAdminUser]
+    query_budget = 3
+
+    def get(self, request):
+        """
+        查询参数:
+        - cabinet_id / order_id: 柜子编号或订单ID，至少指定一个
+        - source: 来源（device / order / admin / system）
+        - start / end: ISO 8601 时间或日期（start 含、end 不含）
+        - limit: 每页条数（默认100，最大1000）；cursor: 上一页返回的 next_cursor
+        按发生顺序返回。
+        """
+        cabinet_id = request.query_params.get('cabinet_id')
+        try:
+            order_id = int(request.query_params['order_id']) if request.query_params.get('order_id') else None
+            start = parse_log_time(request.query_params.get('start'))
+            end = parse_log_time(request.query_params.get('end'))
+            after = int(request.query_params.get('cursor') or 0)
+            limit = min(max(int(request.query_params.get('limit', 100)), 1), 1000)
+        except ValueError:
+            return Response({
+                'code': 400,
+                'message': '参数格式错误'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if not cabinet_id and order_id is None:
+            return Response({
+                'code': 400,
+                'message': '请指定柜子编号或订单ID'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = CabinetEvent.objects.filter(pk__gt=after)
+        if cabinet_id:
+            queryset = queryset.filter(cabinet__cabinet_id=cabinet_id)
+        if order_id is not None:
+            queryset = queryset.filter(order_id=order_id)
+        if request.query_params.get('source'):
+            queryset = queryset.filter(source=request.query_params['source'])
+        if start:
+            queryset = queryset.filter(created_at__gte=start)
+        if end:
+            queryset = queryset.filter(created_at__lt=end)
+
+        rows = list(queryset.order_by('pk').values(
+            'pk', 'cabinet__cabinet_id', 'changes', 'source', 'order_id', 'created_at'
+        )[:limit + 1])
+        sources = dict(CabinetEvent.SOURCE_CHOICES)
+        return Response({
+            'code': 0,
+            'message': 'success',
+            'data': [
+                {
+                    'id': row['pk'],
+                    'cabinet_id': row['cabinet__cabinet_id'],
+                    'changes': row['changes'],
+                    'source': row['source'],
+                    'source_display': sources.get(row['source']),
+                    'order_id': row['order_id'],
+                    'created_at': row['created_at'].isoformat(),
+                }
+                for row in rows[:limit]
+            ],
+            'next_cursor': str(rows[limit - 1]['pk']) if len(rows) > limit else None,
+        })
+
+
+class AdminCabinetStateView(APIView):
+    """柜子在指定时刻的状态（管理员）：最近的快照 + 其后的事件回放"""
+    permission_classes = [IsAdminUser]
+    query_budget = 4
+
+    def get(self, request):
+        """查询参数: cabinet_id（必填）、at（ISO 8601 时间，默认当前时间）"""
+        cabinet_id = request.query_params.get('cabinet_id')
+        try:
+            at = parse_log_time(request.query_params.get('at')) or timezone.now()
+        except ValueError:
+            return Response({
+                'code': 400,
+                'message': '参数格式错误'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            cabinet = Cabinet.objects.only('pk', 'cabinet_id').get(cabinet_id=cabinet_id)
+        except Cabinet.DoesNotExist:
+            return Response({
+                'code': 404,
+                'message': '柜子不存在'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        result = history.state_at(cabinet, at)
+        if result is None:
+            return Response({
+                'code': 404,
+                'message': '该时刻没有状态记录'
+            }, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'code': 0,
+            'message': 'success',
+            'data': {
+                'cabinet_id': cabinet.cabinet_id,
+                'at': at.isoformat(),
+                'state': result['state'],
+                'snapshot_at': result['snapshot_at'].isoformat() if result['snapshot_at'] else None,
+                'replayed': result['replayed'],
+            }
+        })
+
+
 class AdminDevicesView(APIView):
     """设备管理（管理员）"""
     permission_classes = [IsAdminUser]
+    query_budget = 5
 
     def get(self, request):
         """获取所有设备"""
-        queryset = Device.objects.all()
+        queryset = Device.objects.prefetch_related('bound_cabinets')
 
         station = request.query_params.get('station')
         if station:
@@ -286,7 +436,7 @@ class AdminDevicesView(APIView):
             }, status=status.HTTP_404_NOT_FOUND)
 
         # 可更新字段
-        updatable_fields = ['name', 'station', 'location', 'is_active']
+        updatable_fields = ['name', 'station', 'location', 'is_active', 'debug_heartbeat_log']
         for field in updatable_fields:
             if field in request.data:
                 setattr(device, field, request.data[field])
@@ -300,20 +450,78 @@ class AdminDevicesView(APIView):
         })
 
 
+class AdminStationsView(APIView):
+    """站点管理（管理员）：维护站点名称、地址和坐标，坐标用于附近站点搜索"""
+    permission_classes = [IsAdminUser]
+    query_budget = {'get': 4, 'put': 6}
+
+    def get(self, request):
+        """获取所有站点（located=0 只看未设置坐标的站点）"""
+        from apps.cabinets.models import Station
+        from apps.cabinets.serializers import StationSerializer
+
+        queryset = Station.objects.all()
+        if request.query_params.get('located') == '0':
+            queryset = queryset.filter(Q(latitude__isnull=True) | Q(longitude__isnull=True))
+        return Response({
+            'code': 0,
+            'message': 'success',
+            'data': StationSerializer(queryset, many=True).data
+        })
+
+    def put(self, request):
+        """更新站点（按 code 查找）"""
+        from apps.cabinets.models import Station
+        from apps.cabinets.serializers import StationSerializer
+
+        code = request.data.get('code')
+        if not code:
+            return Response({
+                'code': 400,
+                'message': '缺少站点编号'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            station = Station.objects.get(code=code)
+        except Station.DoesNotExist:
+            return Response({
+                'code': 404,
+                'message': '站点不存在'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        # 站点编号与柜子、设备关联，不允许修改
+        data = {key: value for key, value in request.data.items() if key != 'code'}
+        serializer = StationSerializer(station, data=data, partial=True)
+        if not serializer.is_valid():
+            return Response({
+                'code': 400,
+                'message': '更新失败',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        serializer.save()
+        return Response({
+            'code': 0,
+            'message': '更新成功',
+            'data': serializer.data
+        })
+
+
 class FaultAlertsView(APIView):
     """故障预警列表"""
     permission_classes = [IsAdminUser]
+    query_budget = 7
 
+    @cache_response(tags=['devices', 'cabinets', 'orders:stats'], timeout=30, scope='staff')
     def get(self, request):
         """获取所有异常告警"""
         alerts = []
 
-        # 离线设备（超过10分钟无心跳）
-        offline_threshold = timezone.now() - timedelta(minutes=10)
-        offline_devices = Device.objects.filter(
-            is_active=True,
-            last_heartbeat__lt=offline_threshold
-        )
+        # 离线设备（由离线检测进程按心跳超时置为 offline）
+        offline_pks = presence_table.select(status='offline')
+        if offline_pks is not None:
+            offline_devices = Device.objects.filter(pk__in=offline_pks) if offline_pks else []
+        else:
+            offline_devices = Device.objects.filter(Device.offline_q(), is_active=True)
         for device in offline_devices:
             alerts.append({
                 'type': 'device_offline',
@@ -347,7 +555,7 @@ class FaultAlertsView(APIView):
         overdue_orders = Order.objects.filter(
             status='in_use',
             end_time__lt=timezone.now()
-        )
+        ).select_related('cabinet')
         for order in overdue_orders:
             cabinet = order.cabinet
             alerts.append({
@@ -384,14 +592,64 @@ class FaultAlertsView(APIView):
         })
 
 
+class DeviceUptimeView(APIView):
+    """设备可用率报表（基于心跳小时汇总）"""
+    permission_classes = [IsAdminUser]
+    query_budget = 5
+
+    @cache_response(tags=['devices'], timeout=300, scope='staff')
+    def get(self, request):
+        """查询参数: days（默认7，最大 MAX_UPTIME_DAYS）、station、device_id"""
+        try:
+            days = int(request.query_params.get('days', 7))
+        except ValueError:
+            days = 0
+        if days <= 0:
+            return Response({
+                'code': 400,
+                'message': 'days 必须是正整数'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        days = min(days, MAX_UPTIME_DAYS)
+        start_date = timezone.now() - timedelta(days=days)
+
+        devices = Device.objects.filter(is_active=True)
+        station = request.query_params.get('station')
+        if station:
+            devices = devices.filter(station=station)
+        device_id = request.query_params.get('device_id')
+        if device_id:
+            devices = devices.filter(device_id=device_id)
+
+        from apps.devices.uptime import uptime_report
+        report = uptime_report(devices, start_date)
+        uptimes = [item['uptime'] for item in report if item['uptime'] is not None]
+
+        return Response({
+            'code': 0,
+            'message': 'success',
+            'data': {
+                'start': start_date.isoformat(),
+                'summary': {
+                    'devices': len(report),
+                    'average_uptime': round(sum(uptimes) / len(uptimes), 4) if uptimes else None,
+                    'gap_count': sum(item['gap_count'] for item in report),
+                    'downtime_seconds': sum(item['downtime_seconds'] for item in report),
+                },
+                'devices': report,
+            }
+        })
+
+
 class RevenueStatsView(APIView):
     """收入统计"""
     permission_classes = [IsAdminUser]
+    query_budget = 6
 
+    @cache_response(tags=['orders:stats'], timeout=60, scope='staff')
     def get(self, request):
         """获取收入统计"""
         # 时间范围
-        days = int(request.query_params.get('days', 30))
+        days = min(int(request.query_params.get('days', 30)), MAX_STATS_DAYS)
         start_date = timezone.now() - timedelta(days=days)
 
         # 收入统计
@@ -400,17 +658,24 @@ class RevenueStatsView(APIView):
             status__in=['paid', 'in_use', 'completed']
         )
 
-        # 按天统计
-        daily_revenue = []
-        for i in range(days):
-            day_start = timezone.now() - timedelta(days=days - i - 1)
-            day_end = day_start + timedelta(days=1)
-            day_orders = orders.filter(created_at__gte=day_start, created_at__lt=day_end)
-            daily_revenue.append({
-                'date': day_start.strftime('%Y-%m-%d'),
-                'revenue': float(day_orders.aggregate(Sum('total_amount'))['total_amount__sum'] or 0),
-                'orders': day_orders.count()
-            })
+        # 总计
+        totals = orders.aggregate(
+            total_revenue=Sum('total_amount'),
+            total_orders=Count('id'),
+            average_order=Avg('total_amount'),
+        )
+
+        # 按天统计（按天分组，一次查询）
+        daily_revenue = [
+            {
+                'date': date,
+                'revenue': float(row.get('revenue') or 0),
+                'orders': row.get('orders', 0)
+            }
+            for date, row in daily_aggregate(
+                orders, days, timezone.now(), revenue=Sum('total_amount'), orders=Count('id')
+            )
+        ]
 
         # 按站点统计
         station_revenue = []
@@ -429,9 +694,9 @@ class RevenueStatsView(APIView):
             'code': 0,
             'message': 'success',
             'data': {
-                'total_revenue': float(orders.aggregate(Sum('total_amount'))['total_amount__sum'] or 0),
-                'total_orders': orders.count(),
-                'average_order': float(orders.aggregate(Avg('total_amount'))['total_amount__avg'] or 0),
+                'total_revenue': float(totals['total_revenue'] or 0),
+                'total_orders': totals['total_orders'],
+                'average_order': float(totals['average_order'] or 0),
                 'daily_revenue': daily_revenue,
                 'station_revenue': station_revenue,
             }
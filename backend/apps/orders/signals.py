@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from waylink.responsecache import purge_on_commit
+
+from .models import Order
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def purge_order_stats(sender, instance, **kwargs):
+    """订单变化时清除仪表盘、收入统计的响应缓存"""
+    purge_on_commit(['orders:stats'])
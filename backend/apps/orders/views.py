@@ -24,7 +24,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         return OrderSerializer
 
     def get_queryset(self):
-        queryset = Order.objects.filter(user=self.request.user)
+        queryset = Order.objects.filter(user=self.request.user).select_related('cabinet')
 
         # 筛选状态
         status_filter = self.request.query_params.get('status')
@@ -56,10 +56,6 @@ class OrderCreateView(APIView):
 
             # 创建订单
             with transaction.atomic():
-                # 锁定柜子
-                cabinet.status = 'in_use'
-                cabinet.save()
-
                 order = Order.objects.create(
                     user=request.user,
                     cabinet=cabinet,
@@ -68,6 +64,10 @@ class OrderCreateView(APIView):
                     status='pending',
                 )
 
+                # 锁定柜子（状态事件关联本订单）
+                cabinet.status = 'in_use'
+                cabinet.save(event_source='order', order_id=order.id)
+
             return Response({
                 'code': 0,
                 'message': '订单创建成功',
@@ -167,9 +167,10 @@ class OrderDetailView(APIView):
 class MyOrdersView(APIView):
     """我的订单列表"""
     permission_classes = [IsAuthenticated]
+    query_budget = 4
 
     def get(self, request):
-        queryset = Order.objects.filter(user=request.user)
+        queryset = Order.objects.filter(user=request.user).select_related('cabinet')
 
         # 筛选状态
         status_filter = request.query_params.get('status')
@@ -246,13 +247,13 @@ class OrderCancelView(APIView):
                 'message': '只有待支付的订单可以取消'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # 释放柜子
-        order.cabinet.status = 'available'
-        order.cabinet.save()
+        # 释放柜子并更新订单状态（柜子保存时同一事务内更新站点可用性索引）
+        with transaction.atomic():
+            order.cabinet.status = 'available'
+            order.cabinet.save(event_source='order', order_id=order.id)
 
-        # 更新订单状态
-        order.status = 'cancelled'
-        order.save()
+            order.status = 'cancelled'
+            order.save()
 
         return Response({
             'code': 0,
@@ -44,8 +44,9 @@ access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"
 preload_app = True
 
 def on_starting(server):
-    """Called just before the master process is initialized."""
-    pass
+    """Called just before the master process is initialized; workers reseed the presence table from the DB."""
+    from apps.devices.presence import presence_table
+    presence_table.reset()
 
 def on_reload(server):
     """Called to recycle workers during reload."""
@@ -55,6 +56,11 @@ def worker_int(worker):
     """Called when worker receives INT or QUIT signal."""
     pass
 
+def worker_exit(server, worker):
+    """Called just after a worker has been exited; flush buffered heartbeats."""
+    from apps.devices.heartbeat import heartbeat_buffer
+    heartbeat_buffer.flush()
+
 def worker_abort(worker):
     """Called when worker receives SIGABRT signal."""
     pass
@@ -2,6 +2,8 @@
 ASGI config for waylink project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django; the device WebSocket channel (/ws/devices/) is
+served by apps.devices.websocket.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
@@ -13,4 +15,20 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'waylink.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Import after Django setup so the device app can load models
+from apps.devices.websocket import device_websocket_application  # noqa: E402
+
+DEVICE_WEBSOCKET_PATH = '/ws/devices/'
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'] == DEVICE_WEBSOCKET_PATH:
+            return await device_websocket_application(scope, receive, send)
+        # Unknown WebSocket path: reject the handshake
+        await receive()
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    return await django_application(scope, receive, send)
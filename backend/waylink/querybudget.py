@@ -0,0 +1,104 @@
+"""
+接口查询预算
+
+视图声明单次请求最多执行的 SQL 查询数：
+
+    class AllOrdersView(APIView):
+        query_budget = 4
+
+ViewSet 可按 action 声明字典（{'list': 3, 'retrieve': 3}）。
+QueryBudgetMiddleware 统计处理请求期间（所有已配置数据库上）执行的查询数，超出预算时：
+
+- QUERY_BUDGET_MODE = 'raise'（开发环境）：抛出 QueryBudgetExceeded；
+- QUERY_BUDGET_MODE = 'log'（生产环境）：记录警告日志；
+- QUERY_BUDGET_MODE = 'off'：不做任何处理。
+
+返回响应之后执行的查询（流式响应体）不计入。
+ASGI 下中间件以异步方式运行且不统计：异步视图的查询在线程池中执行，
+套一层只支持同步的中间件会在整个请求（可能是长轮询）期间占用一个线程。
+manage.py check_query_budgets 用造出的数据检查各接口声明的预算。
+"""
+import logging
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def view_budget(view_func, method):
+    """解析出的视图函数所对应视图声明的预算，未声明时返回 None"""
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    budget = getattr(view_class, 'query_budget', None)
+    if isinstance(budget, dict):
+        actions = getattr(view_func, 'actions', None) or {}
+        budget = budget.get(actions.get(method.lower(), method.lower()))
+    return budget
+
+
+def view_name(view_func):
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    return view_class.__name__ if view_class else getattr(view_func, '__name__', repr(view_func))
+
+
+class QueryCounter:
+    """统计当前线程在所有数据库连接上执行的查询数"""
+
+    def __init__(self):
+        self.count = 0
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+
+class QueryBudgetMiddleware:
+    """放在 MIDDLEWARE 最后；统计声明了预算的视图整个请求的查询数"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+        if getattr(settings, 'QUERY_BUDGET_MODE', 'log') == 'off':
+            return self.get_response(request)
+
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+
+        budget = getattr(request, '_query_budget', None)
+        if budget is not None and counter.count > budget[0]:
+            message = (
+                f'{budget[1]} {request.method} {request.path} 执行了 {counter.count} 次查询'
+                f'（预算 {budget[0]}）'
+            )
+            if getattr(settings, 'QUERY_BUDGET_MODE', 'log') == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        budget = view_budget(view_func, request.method)
+        if budget is not None:
+            request._query_budget = (budget, view_name(view_func))
@@ -0,0 +1,159 @@
+"""
+按标签失效的接口响应缓存（用于 DRF 视图）
+
+用 cache_response() 包装视图处理函数，并声明响应所依赖的标签：
+
+    class CabinetDetailView(APIView):
+        @cache_response(tags=lambda request, cabinet_id: [f'cabinet:{cabinet_id}'])
+        def get(self, request, cabinet_id):
+            ...
+
+缓存按路径、查询参数和身份范围区分（'public'、'staff'，或 'user' 即每个用户一份）。
+包装在 DRF 认证和权限检查之后执行，不改变访问控制。只缓存 200 响应，
+缓存的是 response.data，每次命中时重新渲染。
+
+失效：每个标签在同一个缓存中存有一个令牌。缓存条目记录计算响应之前各标签的令牌，
+只有令牌全部未变时才命中。purge(tags) 更换令牌，带有这些标签的条目同时失效；
+与计算并发的写入因此不会留下看似有效的过期条目。模型信号（apps/*/signals.py）在事务提交后清除标签。
+
+存储为 Django 缓存别名 RESPONSE_CACHE_ALIAS（'responses'）：开发环境为进程内存，
+单机多工作进程用文件缓存共享，多机部署用 Redis。使用进程内缓存时清除操作同时经设备消息代理
+广播，其他工作进程一并更换令牌。RESPONSE_CACHE_TIMEOUT 限定不发信号的写入
+（批量更新、心跳）造成的过期时长；RESPONSE_CACHE_ENABLED = False 关闭缓存。
+"""
+import functools
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+PURGE_CHANNEL = 'response-cache'
+
+_lock = threading.Lock()
+_subscribed_pid = None
+
+
+def get_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'responses')]
+
+
+def _tag_key(tag):
+    return f'rc:tag:{tag}'
+
+
+def _new_token():
+    return uuid.uuid4().hex[:16]
+
+
+def tag_tokens(cache, tags):
+    """各标签的当前令牌；没有令牌的标签（从未清除或已被淘汰）生成新令牌"""
+    keys = {_tag_key(tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, _new_token(), None)
+        found.update(cache.get_many(missing))
+    return {keys[key]: token for key, token in found.items()}
+
+
+def purge(tags, broadcast=True):
+    """使带有其中任一标签的缓存响应全部失效"""
+    tags = list(tags)
+    if not tags:
+        return
+    cache = get_cache()
+    try:
+        cache.set_many({_tag_key(tag): _new_token() for tag in tags}, None)
+    except Exception:
+        logger.exception('响应缓存清除失败: %s', tags)
+    if broadcast and isinstance(cache, LocMemCache):
+        from apps.devices.broker import get_broker
+        get_broker().publish(PURGE_CHANNEL, {'tags': tags})
+
+
+def purge_on_commit(tags):
+    """当前事务提交后清除标签（自动提交模式下立即清除）"""
+    from django.db import transaction
+
+    tags = list(tags)
+    transaction.on_commit(lambda: purge(tags))
+
+
+def _on_message(message):
+    """其他工作进程的清除通知（本进程发布的也会收到，重复清除无副作用）"""
+    purge(message.get('tags') or (), broadcast=False)
+
+
+def _ensure_subscribed():
+    """进程内缓存经消息代理接收其他工作进程的清除通知"""
+    global _subscribed_pid
+    if not isinstance(get_cache(), LocMemCache):
+        return
+    pid = os.getpid()
+    with _lock:
+        if _subscribed_pid == pid:
+            return
+        _subscribed_pid = pid
+    from apps.devices.broker import get_broker
+    get_broker().subscribe(PURGE_CHANNEL, _on_message)
+
+
+def cache_key(request, scope):
+    if scope == 'public':
+        identity = 'public'
+    elif scope == 'staff' and request.user.is_staff:
+        identity = 'staff'
+    else:
+        identity = f'user:{request.user.pk}'
+    query = urlencode(sorted((key, value) for key, values in request.query_params.lists() for value in values))
+    digest = hashlib.sha1(f'{request.method} {request.path}?{query} {identity}'.encode('utf-8')).hexdigest()
+    return f'rc:resp:{digest}'
+
+
+def cache_response(tags, timeout=None, scope='public'):
+    """
+    缓存处理函数的 200 响应
+
+    tags: 标签列表，或接收处理函数参数 (request, *args, **kwargs) 的可调用对象。
+    timeout: 秒（默认 RESPONSE_CACHE_TIMEOUT）。
+    scope: 'public'（所有人共用一份）、'staff'（管理员共用一份，其他用户各一份）
+    或 'user'（每个用户一份）。
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            if not getattr(settings, 'RESPONSE_CACHE_ENABLED', True):
+                return handler(view, request, *args, **kwargs)
+            _ensure_subscribed()
+            cache = get_cache()
+            key = cache_key(request, scope)
+            entry_tags = tags(request, *args, **kwargs) if callable(tags) else tags
+            try:
+                tokens = tag_tokens(cache, entry_tags)
+                entry = cache.get(key)
+            except Exception:
+                logger.exception('响应缓存读取失败: %s', request.path)
+                return handler(view, request, *args, **kwargs)
+            if entry is not None and entry['tokens'] == tokens:
+                return Response(entry['data'], status=entry['status'])
+
+            response = handler(view, request, *args, **kwargs)
+            if response.status_code == 200 and isinstance(response, Response):
+                lifetime = timeout if timeout is not None else getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 60)
+                try:
+                    cache.set(key, {'tokens': tokens, 'status': response.status_code, 'data': response.data}, lifetime)
+                except Exception:
+                    logger.exception('响应缓存写入失败: %s', request.path)
+            return response
+        return wrapper
+    return decorator
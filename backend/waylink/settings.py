@@ -8,6 +8,8 @@ import os
 from datetime import timedelta
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -56,8 +58,12 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'waylink.querybudget.QueryBudgetMiddleware',
 ]
 
+# Per-view SQL query budgets (see waylink/querybudget.py): 'raise', 'log' or 'off'
+QUERY_BUDGET_MODE = 'raise' if DEBUG else 'log'
+
 ROOT_URLCONF = 'waylink.urls'
 
 TEMPLATES = [
@@ -159,6 +165,84 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
 }
 
+# ESP32 device settings
+
+# Heartbeat write-behind buffer: max seconds Device.last_heartbeat may lag (0 = write through)
+DEVICE_HEARTBEAT_FLUSH_INTERVAL = int(os.environ.get('DEVICE_HEARTBEAT_FLUSH_INTERVAL', 5))
+DEVICE_HEARTBEAT_MAX_PENDING = 5000
+DEVICE_HEARTBEAT_MAX_LOGS = 10000  # buffered debug heartbeat logs; oldest dropped while writes keep failing
+DEVICE_HEARTBEAT_MAX_RETRIES = 3  # failed batch flushes before a device is written alone (and dropped if that fails)
+DEVICE_HEARTBEAT_GAP = 300  # seconds without a heartbeat counted as downtime in rollups
+
+# Offline detection (manage.py sweep_offline_devices)
+DEVICE_OFFLINE_TIMEOUT = 600  # seconds without a heartbeat before a device is marked offline
+DEVICE_SWEEPER_TICK = 1  # seconds
+
+# Shared-memory device presence table (one file per host, shared by all workers; None disables)
+DEVICE_PRESENCE_PATH = BASE_DIR / 'run' / 'presence.bin'
+DEVICE_PRESENCE_SLOTS = 65536  # device pks above this fall back to DB queries
+
+# Device API-key authentication cache (per worker process)
+DEVICE_AUTH_CACHE_SIZE = 10000
+DEVICE_AUTH_CACHE_TTL = 60  # seconds; other workers are invalidated via the broker, TTL bounds staleness if a message is lost
+
+# Cabinet state fingerprints for status report change detection (per worker process)
+DEVICE_STATE_CACHE_TTL = 30  # seconds; backstop if a broker invalidation is lost
+
+# Cabinet/station versions behind the ETags of public cabinet reads (per worker process)
+CABINET_VERSION_CACHE_TTL = 30  # seconds; backstop if a broker invalidation is lost
+
+# Nearby-station search (apps/cabinets/stations.py): in-memory grid of located stations
+STATION_GRID_CELL = 0.01  # degrees (about 1.1 km of latitude)
+STATION_INDEX_TTL = 300  # seconds; backstop if a broker invalidation is lost
+
+# Cabinet event stream (SSE, /api/cabinets/stream/, served via ASGI); events arrive over DEVICE_BROKER
+CABINET_STREAM_BUFFER = 1000  # recent events kept per worker for Last-Event-ID resume
+CABINET_STREAM_KEEPALIVE = 15  # seconds between comment lines on idle connections
+CABINET_STREAM_RETRY = 3000  # client reconnect delay (ms)
+
+# Caches. 'responses' backs the tag-based response cache (waylink/responsecache.py);
+# purges reach other local-memory workers over DEVICE_BROKER.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'waylink-responses',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+RESPONSE_CACHE_ALIAS = 'responses'
+RESPONSE_CACHE_TIMEOUT = 60  # seconds; bounds staleness for writes that purge nothing
+
+# Device log retention: older day buckets are moved to compressed segment files
+DEVICE_LOG_HOT_DAYS = 30
+DEVICE_LOG_ARCHIVE_DIR = BASE_DIR / 'archive' / 'device_logs'
+
+# Device telemetry time series (apps/devices/telemetry.py), written by the heartbeat flush thread.
+# Days kept per downsampled tier (bucket seconds -> days, None = forever); manage.py prune_telemetry
+DEVICE_TELEMETRY_RETENTION = {300: 7, 3600: 180, 86400: None}
+DEVICE_TELEMETRY_FLUSH_INTERVAL = 60  # seconds; each flush rewrites the touched blocks
+
+# Device command queue (seconds)
+DEVICE_COMMAND_TTL = 60  # undelivered commands expire after this
+DEVICE_COMMAND_LEASE_TIMEOUT = 30  # delivered commands must be acked within this
+
+# Device command long-poll (served via ASGI, seconds)
+DEVICE_LONGPOLL_TIMEOUT = 25  # keep below the proxy read timeout
+DEVICE_LONGPOLL_RECHECK_INTERVAL = 0.5  # cross-process command check period
+DEVICE_STATUS_QUERY_MAX_WAIT = 10  # max wait_ms (in seconds) for admin cabinet status queries
+
+# Cross-process message broker for device notifications (long-poll, WebSocket)
+DEVICE_BROKER = os.environ.get('DEVICE_BROKER', 'apps.devices.broker.LocalBroker')
+DEVICE_BROKER_SOCKET_DIR = BASE_DIR / 'run' / 'broker'
+DEVICE_BROKER_URL = os.environ.get('DEVICE_BROKER_URL', 'redis://127.0.0.1:6379/0')
+
+# UDP/TCP device gateway (manage.py device_gateway)
+DEVICE_GATEWAY_BATCH_INTERVAL = 0.05  # seconds between batched status report writes
+DEVICE_GATEWAY_BATCH_SIZE = 500  # write early once this many reports are queued
+
 # CORS settings (allow all for development)
 
 CORS_ALLOW_ALL_ORIGINS = DEBUG
@@ -166,3 +250,6 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:8080",
     "http://127.0.0.1:8080",
 ]
+# Conditional GET on cabinet reads (ETag / If-None-Match) and event stream resume (Last-Event-ID)
+CORS_ALLOW_HEADERS = (*default_headers, 'if-none-match', 'last-event-id')
+CORS_EXPOSE_HEADERS = ['ETag']